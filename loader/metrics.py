@@ -0,0 +1,173 @@
+"""Collects counters and latency histograms for the stages of the file loading and
+posting pipeline, and exports them in the Prometheus text exposition format, either
+to a file or from a small HTTP server.
+
+The stages timed are, with the labels of each:
+
+    glob, header, parse, route, post_buffer     reader, source
+    queue_append, queue_pop, queue_block,
+    json_encode, http_post, retry_sleep         bmon
+
+Each stage's latency is recorded in the 'file_to_bmon_stage_seconds' histogram, whose
+'_count' series counts the times the stage was run.  Counters of lines, readings,
+posts and bytes are also kept.  Metrics are held in the module-level REGISTRY, which
+is safe to use from multiple threads.
+"""
+
+import os
+import time
+import threading
+import http.server
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Descriptions of the metrics, used in the HELP lines of the export.
+HELP = {
+    'file_to_bmon_stage_seconds': 'Time spent in each stage of the pipeline.',
+    'file_to_bmon_files_total': 'Files processed.',
+    'file_to_bmon_lines_total': 'Lines processed, by result.',
+    'file_to_bmon_readings_total': 'Readings added to the buffer of each BMON server.',
+    'file_to_bmon_posts_total': 'Post attempts, by result.',
+    'file_to_bmon_post_readings_total': 'Readings successfully posted.',
+    'file_to_bmon_post_bytes_total': 'Bytes of post bodies successfully posted.',
+    'file_to_bmon_queue_pressure_total': 'Times a posting queue went over its limits.',
+    'file_to_bmon_queue_spilled_items_total': 'Queue items written to overflow segments.',
+    'file_to_bmon_circuit_changes_total': 
+        'Times the circuit breaker of a BMON server opened or closed.',
+    'file_to_bmon_probes_total': 'Probes of a BMON server that is not responding, by result.',
+    'file_to_bmon_dead_letter_readings_total': 
+        'Readings rejected by a BMON server and moved to the dead letter table.',
+}
+
+
+class Registry:
+    """Holds counters and histograms, each identified by a metric name and a set
+    of label values.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}      # (name, labels) -> value
+        self.histograms = {}    # (name, labels) -> [bucket counts, sum, count]
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        """Adds 'amount' to the counter 'name' with the labels 'labels'.
+        """
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Records the value 'value' in the histogram 'name' with the labels 'labels'.
+        """
+        key = self._key(name, labels)
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+            counts = hist[0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            hist[1] += value
+            hist[2] += 1
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """Context manager that records the time spent in the 'with' block as a run
+        of the pipeline stage 'stage'.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('file_to_bmon_stage_seconds', time.perf_counter() - start,
+                         stage=stage, **labels)
+
+    def export(self):
+        """Returns the metrics in the Prometheus text exposition format.
+        """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2]))
+                                for key, h in self.histograms.items())
+
+        out = []
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                out.append(f'# HELP {name} {HELP.get(name, name)}')
+                out.append(f'# TYPE {name} counter')
+                last_name = name
+            out.append(f'{name}{_format_labels(labels)} {value}')
+
+        for (name, labels), (counts, total, count) in histograms:
+            if name != last_name:
+                out.append(f'# HELP {name} {HELP.get(name, name)}')
+                out.append(f'# TYPE {name} histogram')
+                last_name = name
+            cumulative = 0
+            for bound, n in zip(BUCKETS, counts):
+                cumulative += n
+                bucket_labels = _format_labels(labels + (('le', repr(bound)),))
+                out.append(f'{name}_bucket{bucket_labels} {cumulative}')
+            out.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {count}')
+            out.append(f'{name}_sum{_format_labels(labels)} {total:.6f}')
+            out.append(f'{name}_count{_format_labels(labels)} {count}')
+
+        return '\n'.join(out) + '\n'
+
+    def write(self, path):
+        """Writes the metrics to the file 'path', replacing the file atomically so a
+        partly-written file is never read.
+        """
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.export())
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host=''):
+        """Serves the metrics at http://host:port/metrics from a background thread.
+        """
+        registry = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.export().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        httpd.daemon_threads = True
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return httpd
+
+
+def _format_labels(labels):
+    """Formats a tuple of (label name, value) pairs for the text exposition format.
+    """
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+# The registry used by the application.
+REGISTRY = Registry()
@@ -0,0 +1,441 @@
+"""An alternative to HttpPoster that posts readings with asyncio and aiohttp
+instead of blocking worker threads.  Many posts can be in flight at once, and
+posts waiting to retry do not tie up a thread.  Readings are held in the same
+SqliteReliableQueue used by HttpPoster, and items stay in the queue's
+'processing' table until they are posted, so readings are posted at least once
+even if the process stops.
+"""
+
+import asyncio
+import threading, json, logging
+
+import aiohttp
+
+from .sqlite_queue import SqliteReliableQueue
+from .circuit import CLOSED
+from .httpPoster import HttpPoster, coalesce_items, record_post_time, record_post_metrics, \
+    gzip_body, is_rejection, split_post, empty_post, add_dead_letter, log_server_rejection
+from metrics import REGISTRY as metrics
+
+
+class AsyncHttpPoster(HttpPoster):
+    """A class to post readings to a URL via HTTP using an asyncio event loop
+    running in a background thread.  Readings are delivered to this object with
+    the add_readings() method, as with HttpPoster.
+    """
+
+    def __init__(self, post_URL,
+                       reading_converter=None,
+                       post_q_filename='postQ.sqlite',
+                       max_concurrency=10,
+                       post_time_file='/var/tmp/last_post_time',
+                       post_batch_size=10,
+                       journal_mode=None,
+                       synchronous=None,
+                       gzip_posts=False,
+                       max_post_readings=1000,
+                       max_post_bytes=100000,
+                       bmon_id=None,
+                       queue_limits=None,
+                       breaker_failures=3,
+                       probe_interval=10.0,
+                       burst_concurrency=None,
+                       reject_limit=3):
+        """Parameters are:
+        'post_URL': URL to post the data to.
+        'reading_converter': function or callable to convert the format
+            of the readings delivered to the "addReadings" method, if
+            required.
+        'post_q_filename': name of the file to use for implementing the
+            queue.
+        'max_concurrency': the maximum number of posts to the server that
+            are in progress at one time, including posts waiting to retry.
+        'post_time_file': name of the file to store the last time that
+            a successful post occurred. (Unix timestamp).
+        'post_batch_size': the maximum number of queue items removed from
+            the queue in one transaction.
+        'journal_mode': SQLite journal mode for the queue file, e.g. 'WAL'.
+        'synchronous': SQLite synchronous setting for the queue file, e.g.
+            'NORMAL'.
+        'gzip_posts': if True, post bodies are gzip compressed and sent with
+            a 'Content-Encoding: gzip' header.  The server must support this.
+        'max_post_readings': queued sets of readings for the same store key
+            are merged into posts holding up to this many readings.  0 disables
+            merging.
+        'max_post_bytes': the maximum size in bytes of the JSON body of a
+            merged post.
+        'bmon_id': the ID of the BMON server, used to label the pipeline metrics.
+            Defaults to 'post_URL'.
+        'queue_limits': a dictionary of keyword arguments for a QueueLimits object
+            that limits the size of the queue, e.g. {'max_items': 100000, 
+            'policy': 'spill', 'spill_dir': ...}.  If None, the queue is not limited.
+        'breaker_failures': the number of failed posts in a row after which the
+            server is considered down and is probed until it responds.  See the
+            circuit module.
+        'probe_interval': seconds between probes of a server that is down.
+        'burst_concurrency': the number of posts in progress at once while the
+            backlog is drained after the server comes back.  Defaults to 4 times
+            'max_concurrency'.
+        'reject_limit': the number of times the server can reject the readings
+            in a post before the post is split to isolate the rejected readings.
+            0 or None retries rejected posts, like failed posts, forever.
+        """
+        # the posts in progress at once are limited by 'max_concurrency' instead
+        # of a number of threads.
+        self.max_concurrency = max_concurrency
+        super().__init__(post_URL, reading_converter, post_q_filename,
+                         post_thread_count=max_concurrency,
+                         post_time_file=post_time_file,
+                         post_batch_size=post_batch_size,
+                         journal_mode=journal_mode,
+                         synchronous=synchronous,
+                         gzip_posts=gzip_posts,
+                         max_post_readings=max_post_readings,
+                         max_post_bytes=max_post_bytes,
+                         bmon_id=bmon_id,
+                         queue_limits=queue_limits,
+                         breaker_failures=breaker_failures,
+                         probe_interval=probe_interval,
+                         burst_concurrency=burst_concurrency,
+                         reject_limit=reject_limit)
+
+    def start_posting(self):
+        """Starts the AsyncPostEngine that posts the readings in the queue.
+        """
+        self.engine = AsyncPostEngine(self.post_Q, self.post_URL, self.post_time_file, 
+                                      self.max_concurrency, self.post_batch_size, 
+                                      self.gzip_posts, self.max_post_readings, 
+                                      self.max_post_bytes, self.bmon_id, self.breaker,
+                                      self.burst_concurrency, self.reject_limit)
+        self.engine.start()
+
+    def close(self):
+        """Stops posting.  Posts in progress are abandoned; their readings stay in the
+        queue's 'processing' table and are posted the next time the queue is opened.
+        """
+        self.engine.stop()
+
+
+class AsyncPostEngine(threading.Thread):
+    """Runs an asyncio event loop in its own thread that posts the items in a
+    queue to an HTTP server.  As with PostWorker, the HTTP server must respond
+    with a status code of 200 if it receives the readings, or the readings will
+    be reposted.
+    """
+
+    def __init__(self, source_Q, post_URL, post_time_file, max_concurrency=10,
+                 batch_size=10, gzip_posts=False, max_post_readings=0, max_post_bytes=0,
+                 bmon_id=None, breaker=None, burst_concurrency=None, reject_limit=3):
+        """Create the posting engine.
+        'source_Q': the SqliteReliableQueue to get postings from.
+        'post_URL': the URL to post to, w/o any parameters
+        'post_time_file': the name of a file to record the time of
+             a successful post.
+        'max_concurrency': the maximum number of posts in progress at once.
+        'batch_size': the maximum number of items to pop from the queue at
+             one time.
+        'gzip_posts': if True, gzip compress the body of each post.
+        'max_post_readings', 'max_post_bytes': popped items for the same
+             store key are merged into one post holding up to this many 
+             readings and JSON bytes.  0 disables merging.
+        'bmon_id': the ID of the BMON server, used to label the pipeline
+             metrics.  Defaults to 'post_URL'.
+        'breaker': the CircuitBreaker tracking whether the server is responding.
+             If None, failed posts are retried on a back-off schedule only.
+        'burst_concurrency': the maximum number of posts in progress at once while
+             the backlog is drained after the server comes back.  Defaults to
+             'max_concurrency'.
+        'reject_limit': the number of times the server can reject the readings
+             in a post before the post is split to isolate the rejected readings.
+             0 or None retries rejected posts, like failed posts, forever.
+        """
+        threading.Thread.__init__(self)
+
+        # If only thing left running are daemon threads, Python will exit.
+        self.daemon = True
+        self.source_Q = source_Q
+        self.post_URL = post_URL
+        self.post_time_file = post_time_file
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.gzip_posts = gzip_posts
+        self.max_post_readings = max_post_readings
+        self.max_post_bytes = max_post_bytes
+        self.bmon_id = bmon_id or post_URL
+        self.breaker = breaker
+        self.burst_concurrency = max(burst_concurrency or max_concurrency, max_concurrency)
+        self.burst_permits = 0      # extra semaphore counts added for a burst drain
+        self.reject_limit = reject_limit
+        self.loop = asyncio.new_event_loop()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.main_task = self.loop.create_task(self.post_items())
+        try:
+            self.loop.run_until_complete(self.main_task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    def stop(self):
+        """Called from another thread to stop posting and end the thread.
+        """
+        if self.is_alive():
+            self.loop.call_soon_threadsafe(self.main_task.cancel)
+
+    async def post_items(self):
+        """Pops items from the queue and posts them, keeping up to 'max_concurrency'
+        posts in progress.
+        """
+        loop = asyncio.get_event_loop()
+
+        # Each post in progress holds one count of this semaphore, which limits the
+        # number of concurrent posts to the server.
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # references to the running post tasks, so they are not garbage collected.
+        tasks = set()
+
+        # Event set when items are added to the queue, so this task can wait for
+        # items without polling or blocking a thread.
+        queue_changed = asyncio.Event()
+        def on_queue_change():
+            loop.call_soon_threadsafe(queue_changed.set)
+
+        # Event set, and replaced, when the circuit breaker opens or closes.
+        self.circuit_changed = asyncio.Event()
+        def on_circuit_change(state):
+            loop.call_soon_threadsafe(self.on_circuit_change, state)
+
+        # the listeners are removed when posting stops, as they call into this loop.
+        SqliteReliableQueue.add_change_listener(on_queue_change)
+        if self.breaker:
+            self.breaker.add_listener(on_circuit_change)
+        try:
+            await self.post_loop(loop, tasks, queue_changed)
+        finally:
+            SqliteReliableQueue.remove_change_listener(on_queue_change)
+            if self.breaker:
+                self.breaker.remove_listener(on_circuit_change)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def post_loop(self, loop, tasks, queue_changed):
+        """Pops items from the queue and starts the tasks posting them, until cancelled.
+        'tasks' is the set holding the running tasks, and 'queue_changed' is the Event
+        set when items are added to the queue.
+        """
+        # need to *not* verify SSL requests, as with PostWorker.
+        connector = aiohttp.TCPConnector(limit=self.burst_concurrency, ssl=False)
+        timeout = aiohttp.ClientTimeout(total=15)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            while True:
+                # wait for a free slot before removing items from the queue.
+                await self.semaphore.acquire()
+
+                try:
+                    # Pop without waiting, in a worker thread, as the SQLite transaction
+                    # can wait for a lock held by another process.  If the queue is
+                    # empty, wait for it to change, re-checking the database
+                    # periodically in case another process added items.
+                    while True:
+                        queue_changed.clear()
+                        with metrics.timer('queue_pop', bmon=self.bmon_id):
+                            items = await loop.run_in_executor(
+                                None, self.source_Q.pop_many, self.batch_size, False)
+                        if items:
+                            break
+                        if self.burst_permits:
+                            # the backlog is drained, so end the burst by taking back
+                            # the extra counts of the semaphore.
+                            task = loop.create_task(self.end_burst(self.burst_permits))
+                            tasks.add(task)
+                            task.add_done_callback(tasks.discard)
+                            self.burst_permits = 0
+                        await wait_event(queue_changed, SqliteReliableQueue._max_wait)
+                except asyncio.CancelledError:
+                    raise
+                except:
+                    logging.exception('Error popping readings to post.')
+                    self.semaphore.release()
+                    await asyncio.sleep(5)   # to limit rapid fire errors
+                    continue
+
+                # merge the items into posts.  The first post uses the slot already
+                # acquired; each other post waits for a free slot.
+                with metrics.timer('json_encode', bmon=self.bmon_id):
+                    posts = coalesce_items(items, self.max_post_readings, self.max_post_bytes)
+                if not posts:
+                    self.semaphore.release()
+                for i, (q_ids, readings, post_data) in enumerate(posts):
+                    if i > 0:
+                        await self.semaphore.acquire()
+                    task = loop.create_task(self.post_item(session, q_ids, readings, post_data))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+    def on_circuit_change(self, state):
+        """Called in the event loop when the server goes down or comes back.  Wakes the
+        posts waiting for the circuit to change, and when the server comes back, raises
+        the number of posts allowed at once to 'burst_concurrency' until the queue is
+        empty.
+        """
+        event, self.circuit_changed = self.circuit_changed, asyncio.Event()
+        event.set()
+        if state == CLOSED:
+            # if the queue is empty, the next pop ends the burst.
+            extra = self.burst_concurrency - self.max_concurrency - self.burst_permits
+            if extra > 0:
+                logging.info(f'Draining the backlog for {self.bmon_id} with {extra} extra '
+                             'posts at once.')
+                for i in range(extra):
+                    self.semaphore.release()
+                self.burst_permits += extra
+
+    async def end_burst(self, count):
+        """Takes 'count' counts of the semaphore, which lowers the number of posts allowed
+        at once back to 'max_concurrency' as the burst posts finish.
+        """
+        for i in range(count):
+            await self.semaphore.acquire()
+
+    async def wait_after_failure(self, delay):
+        """Waits after a failed post as CircuitBreaker.wait_after_failure() does, without
+        blocking the event loop.  Returns True if the wait ended because the circuit closed.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + delay
+        while True:
+            event = self.circuit_changed
+            if self.breaker.is_open:
+                await event.wait()
+                if not self.breaker.is_open:
+                    return True
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            if not await wait_event(event, remaining):
+                return False
+
+    async def post_item(self, session, q_ids, readings, post_data):
+        """Posts the JSON string 'post_data', which encodes 'readings', retrying until
+        the post succeeds or the readings being rejected are isolated.  Then marks the
+        queue items with the ids in 'q_ids' as finished.
+        """
+        try:
+            rejection = await self.post(session, readings, post_data, self.reject_limit)
+            if rejection is not None:
+                await self.isolate(session, readings, post_data, rejection)
+
+            try:
+                # tell the queue that these items are complete
+                await asyncio.get_event_loop().run_in_executor(
+                    None, self.source_Q.finished_many, q_ids)
+            except asyncio.CancelledError:
+                raise
+            except:
+                logging.exception('Error marking posted readings as finished.')
+
+        finally:
+            self.semaphore.release()
+
+    async def post(self, session, readings, post_data, max_rejects=None):
+        """Posts the JSON string 'post_data', which encodes 'readings', retrying until
+        the post succeeds.  If the server rejects the readings 'max_rejects' times,
+        gives up and returns a description of the rejection.  Returns None if the post
+        succeeded.  If 'max_rejects' is None, rejections are retried like other failed
+        posts.
+        """
+        if self.gzip_posts:
+            body, headers = gzip_body(post_data)
+        else:
+            body = post_data
+            headers = None
+
+        retry_delay = 15  # start with a 15 second delay before retrying a post
+        rejects = 0
+        while True:
+            server_error = True     # False if the server rejected the readings
+            try:
+                with metrics.timer('http_post', bmon=self.bmon_id):
+                    async with session.post(self.post_URL, data=body, headers=headers) as resp:
+                        resp_text = await resp.text()
+                if resp.status == 200:
+                    if self.breaker:
+                        self.breaker.record_success()
+                    record_post_metrics(self.bmon_id, readings, body)
+                    break
+                if max_rejects and is_rejection(resp.status):
+                    server_error = False
+                    rejects += 1
+                    if rejects >= max_rejects:
+                        metrics.inc('file_to_bmon_posts_total', bmon=self.bmon_id, 
+                                    result='rejected')
+                        return 'Status %s: %s' % (resp.status, resp_text[:200])
+                raise Exception('Bad Post Status Code: %s' % resp.status)
+            except asyncio.CancelledError:
+                raise
+            except:
+                logging.exception("Error posting: %s" % readings)
+                metrics.inc('file_to_bmon_posts_total', bmon=self.bmon_id, result='error')
+                with metrics.timer('retry_sleep', bmon=self.bmon_id):
+                    # try again later.  If the server is down, the circuit breaker
+                    # ends the wait when it comes back.
+                    if self.breaker:
+                        if server_error:
+                            self.breaker.record_failure()
+                        server_back = await self.wait_after_failure(retry_delay)
+                    else:
+                        await asyncio.sleep(retry_delay)
+                        server_back = False
+                if server_back:
+                    retry_delay = 15
+                elif retry_delay < 8 * 60:
+                    retry_delay *= 2
+
+        if logging.root.level == logging.DEBUG:
+            logging.debug('posted: %s, %s' % (readings, resp_text))
+        else:
+            logging.info('posted %d bytes' % len(body))
+        record_post_time(self.post_time_file)
+
+    async def isolate(self, session, readings, post_data, rejection):
+        """Called when the server keeps rejecting the post of 'readings', encoded as
+        'post_data'.  Isolates the readings being rejected as PostWorker.isolate() does.
+        """
+        halves = split_post(readings)
+        if halves is None:
+            await asyncio.get_event_loop().run_in_executor(
+                None, add_dead_letter, self.source_Q, self.bmon_id, readings, rejection)
+            return
+        while True:
+            rejections = [await self.post(session, half, half_data, max_rejects=1)
+                          for half, half_data in halves]
+            if None in rejections:
+                break
+            empty, empty_data = empty_post(readings)
+            server_rejection = await self.post(session, empty, empty_data, max_rejects=1)
+            if server_rejection is None:
+                break
+            log_server_rejection(self.bmon_id, server_rejection)
+            await self.post(session, empty, empty_data)
+        for (half, half_data), rejection in zip(halves, rejections):
+            if rejection is not None:
+                await self.isolate(session, half, half_data, rejection)
+
+
+async def wait_event(event, timeout):
+    """Waits until the asyncio Event 'event' is set or 'timeout' seconds pass.  Returns
+    True if the event was set.  Unlike asyncio.wait_for() in Python 3.11 and earlier,
+    a cancellation arriving as the event is set is never lost, so the engine can be
+    stopped.
+    """
+    waiter = asyncio.ensure_future(event.wait())
+    try:
+        done, _ = await asyncio.wait({waiter}, timeout=timeout)
+    finally:
+        waiter.cancel()
+    return bool(done)
@@ -0,0 +1,155 @@
+"""Holds the CircuitBreaker class, which notices when a BMON server is down and finds
+out quickly when it is back.  After 'failure_threshold' posts in a row fail because
+the server could not be reached or returned a server error, the circuit opens.  While
+it is open, posts that failed wait for the circuit to close instead of retrying the
+whole post on a back-off schedule, and a background thread probes the server every
+'probe_interval' seconds with a HEAD request, which is much cheaper than a post.  Any
+response that is not a server error means the server is back.  The circuit then
+closes, the waiting posts are retried at once, and the posters are told so they can
+drain the backlog with raised concurrency.
+"""
+import time
+import logging
+import threading
+
+import requests
+
+from metrics import REGISTRY as metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+
+
+class CircuitBreaker:
+    """Tracks whether the BMON server at a URL can be reached.  Safe to use from
+    multiple threads.
+    """
+
+    def __init__(self, post_URL, bmon_id, failure_threshold=3, probe_interval=10.0):
+        """'post_URL' is the URL posted to, which is also probed.  'bmon_id' identifies
+        the server in log messages and metrics.  The circuit opens after
+        'failure_threshold' failed posts in a row, and the server is probed every
+        'probe_interval' seconds while it is open.
+        """
+        self.post_URL = post_URL
+        self.bmon_id = bmon_id
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.state = CLOSED
+        self.failures = 0           # failed posts in a row
+        self.opened_time = None
+        self.open_count = 0         # times the circuit has opened
+        self.cond = threading.Condition()
+        self.listeners = []
+
+    @property
+    def is_open(self):
+        return self.state == OPEN
+
+    def add_listener(self, listener):
+        """Registers a function, 'listener', that is called with the new state, CLOSED
+        or OPEN, each time the circuit opens or closes.  It is called from the thread
+        causing the change, so must be quick and thread-safe.
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Unregisters a function registered with add_listener().
+        """
+        self.listeners.remove(listener)
+
+    def record_success(self):
+        """Called after a successful post.
+        """
+        with self.cond:
+            self.failures = 0
+            if self.state != OPEN:
+                return
+            self._set_state(CLOSED)
+        self._notify(CLOSED)
+
+    def record_failure(self):
+        """Called after a post fails because the server could not be reached or
+        returned a server error.
+        """
+        with self.cond:
+            self.failures += 1
+            if self.state == OPEN or self.failures < self.failure_threshold:
+                return
+            self._set_state(OPEN)
+            self.open_count += 1
+            open_count = self.open_count
+        threading.Thread(target=self._probe, args=(open_count,), daemon=True).start()
+        self._notify(OPEN)
+
+    def _set_state(self, state):
+        """Changes the state of the circuit and logs it.  Must be called holding 'cond'.
+        """
+        self.state = state
+        if state == OPEN:
+            self.opened_time = time.time()
+            logging.warning(f'BMON server {self.bmon_id} is not responding after '
+                            f'{self.failures} failed posts; probing it every '
+                            f'{self.probe_interval} s.')
+        else:
+            logging.warning(f'BMON server {self.bmon_id} is responding again after '
+                            f'{time.time() - self.opened_time:.0f} s.')
+        metrics.inc('file_to_bmon_circuit_changes_total', bmon=self.bmon_id, state=state)
+        self.cond.notify_all()
+
+    def _notify(self, state):
+        for listener in list(self.listeners):
+            try:
+                listener(state)
+            except:
+                logging.exception('Error in circuit breaker listener.')
+
+    def wait_after_failure(self, delay):
+        """Called by a thread after a failed post, before retrying it.  While the circuit
+        is closed, waits 'delay' seconds.  While it is open, waits until it closes.
+        Returns True if the wait ended because the circuit closed, so the retry delay
+        can start over.
+        """
+        deadline = time.time() + delay
+        with self.cond:
+            while True:
+                if self.state == OPEN:
+                    self.cond.wait_for(lambda: self.state != OPEN)
+                    return True
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+
+    def probe(self, session):
+        """Returns True if the server responds to a HEAD request with anything other
+        than a server error.  A 501 response, from a server that does not implement
+        HEAD, means the server is up.
+        """
+        try:
+            resp = session.head(self.post_URL, timeout=10, verify=False)
+            up = resp.status_code < 500 or resp.status_code == 501
+        except requests.RequestException:
+            up = False
+        metrics.inc('file_to_bmon_probes_total', bmon=self.bmon_id, 
+                    result='up' if up else 'down')
+        return up
+
+    def _probe(self, open_count):
+        """Run in a background thread while the circuit is open.  Probes the server
+        until it responds, or until a post succeeds.  'open_count' identifies the time
+        the circuit opened, so the thread stops if it has closed and opened again.
+        """
+        session = requests.Session()
+        while True:
+            time.sleep(self.probe_interval)
+            if self.state != OPEN or self.open_count != open_count:
+                return
+            if self.probe(session):
+                with self.cond:
+                    if self.state != OPEN or self.open_count != open_count:
+                        return
+                    self.failures = 0
+                    self._set_state(CLOSED)
+                self._notify(CLOSED)
+                return
@@ -2,21 +2,34 @@
 them to a HTTP URL.  Readings are cached if an Internet connection 
 is not available, or the the post fails for any reason.
 
+If the server keeps rejecting the readings in a post, with a status code in
+REJECTION_CODES, e.g. because of one badly formatted reading, the post is split in
+half repeatedly to find the readings being rejected.  The other readings are posted,
+and the rejected readings are moved to the 'dead_letter' table of the queue, so one
+bad reading does not stop posting.  See tools/dead_letter.py to list and replay them.
+When both halves of a post are rejected, a post with no readings is sent; if the
+server rejects that too, it is rejecting every post, and the isolation waits until
+the server accepts posts again.  Other client errors, e.g. a wrong URL or a failed
+authorization, are retried like server errors.
+
 TO DO:
     * Test separate threads writing to post_time_file simultaneously
-    * Perhaps abandon post if it isn't successful after a few retries. It would
-        be left in the 'processing' queue, so would get tried again upon a
-        restart. This protects against some bad format locking up a post worker.
-        But if post is abandoned and Internet comes back, it will be left in
-        processing queue.
 """
 
 import time
-import threading, json, logging
+import threading, json, logging, gzip
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from .sqlite_queue import SqliteReliableQueue
+from .queue_limits import QueueLimits
+from .circuit import CircuitBreaker, CLOSED
+from metrics import REGISTRY as metrics
+
+# HTTP status codes meaning the server rejected the readings in a post, rather than
+# the post itself: Bad Request, Payload Too Large and Unprocessable Entity.
+REJECTION_CODES = (400, 413, 422)
 
 # Disable warning messages that result from having to use Python 2.7.3 instead of
 # 2.7.9 and from having to disable SSL verification due to problems with Python 2.7.3
@@ -34,7 +47,20 @@ class HttpPoster:
                        reading_converter=None, 
                        post_q_filename='postQ.sqlite', 
                        post_thread_count=2, 
-                       post_time_file='/var/tmp/last_post_time'):
+                       post_time_file='/var/tmp/last_post_time',
+                       post_batch_size=10,
+                       journal_mode=None,
+                       synchronous=None,
+                       pool_size=None,
+                       gzip_posts=False,
+                       max_post_readings=1000,
+                       max_post_bytes=100000,
+                       bmon_id=None,
+                       queue_limits=None,
+                       breaker_failures=3,
+                       probe_interval=10.0,
+                       burst_concurrency=None,
+                       reject_limit=3):
         """Parameters are:
         'post_URL': URL to post the data to.
         'reading_converter': function or callable to convert the format
@@ -45,64 +71,227 @@ class HttpPoster:
         'post_thread_count': number of post worker threads to start up.
         'post_time_file': name of the file to store the last time that
             a successful post occurred. (Unix timestamp).
+        'post_batch_size': the maximum number of queue items a post worker
+            removes from the queue, and marks finished, in one transaction.
+            These items can be merged into fewer posts.
+        'journal_mode': SQLite journal mode for the queue file, e.g. 'WAL'.
+        'synchronous': SQLite synchronous setting for the queue file, e.g.
+            'NORMAL'.
+        'pool_size': the number of kept-alive connections to the server held
+            for reuse by the post workers.  Defaults to 'post_thread_count'.
+        'gzip_posts': if True, post bodies are gzip compressed and sent with
+            a 'Content-Encoding: gzip' header.  The server must support this.
+        'max_post_readings': queued sets of readings for the same store key
+            are merged into posts holding up to this many readings.  0 disables
+            merging.
+        'max_post_bytes': the maximum size in bytes of the JSON body of a
+            merged post.
+        'bmon_id': the ID of the BMON server, used to label the pipeline metrics.
+            Defaults to 'post_URL'.
+        'queue_limits': a dictionary of keyword arguments for a QueueLimits object
+            that limits the size of the queue, e.g. {'max_items': 100000, 
+            'policy': 'spill', 'spill_dir': ...}.  If None, the queue is not limited.
+        'breaker_failures': the number of failed posts in a row after which the
+            server is considered down and is probed until it responds.  See the
+            circuit module.
+        'probe_interval': seconds between probes of a server that is down.
+        'burst_concurrency': the number of posts in progress at once while the
+            backlog is drained after the server comes back.  Defaults to 4 times
+            'post_thread_count'.
+        'reject_limit': the number of times the server can reject the readings
+            in a post before the post is split to isolate the rejected readings.
+            0 or None retries rejected posts, like failed posts, forever.
         """
         
         self.reading_converter = reading_converter
+        self.bmon_id = bmon_id or post_URL
+        self.post_URL = post_URL
+        self.post_time_file = post_time_file
+        self.post_batch_size = post_batch_size
+        self.gzip_posts = gzip_posts
+        self.max_post_readings = max_post_readings
+        self.max_post_bytes = max_post_bytes
+        self.post_thread_count = post_thread_count
+        self.pool_size = pool_size
+        self.reject_limit = reject_limit
+        self.burst_concurrency = burst_concurrency or 4 * post_thread_count
+        self.burst_workers = []
 
         # create the queue used to store the readings.
-        self.post_Q = SqliteReliableQueue(post_q_filename)
+        self.post_Q = SqliteReliableQueue(post_q_filename, 
+                                          journal_mode=journal_mode, 
+                                          synchronous=synchronous)
+
+        # limits on the size of the queue, if any
+        if queue_limits:
+            self.limits = QueueLimits(self.post_Q, self.bmon_id, **queue_limits)
+        else:
+            self.limits = None
         
+        # tracks whether the server is responding
+        self.breaker = CircuitBreaker(post_URL, self.bmon_id, breaker_failures, probe_interval)
+
+        self.start_posting()
+
+    def start_posting(self):
+        """Starts posting the readings in the queue with 'post_thread_count' PostWorker
+        threads.  Called at the end of __init__(); a subclass that posts in a different
+        way overrides it.
+        """
+        # create a Session, shared by the post workers, that keeps connections
+        # to the server alive so each post does not require a new TCP and TLS
+        # handshake.  Enough connections are kept for a burst drain.
+        pool_size = max(self.pool_size or self.post_thread_count, self.burst_concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # start a burst drain when the server comes back
+        self.breaker.add_listener(self.on_circuit_change)
+
         # start the posting worker threads
-        for i in range(post_thread_count):
-            PostWorker(self.post_Q, post_URL, post_time_file).start()
-            
+        for i in range(self.post_thread_count):
+            self.make_worker().start()
+
+    def make_worker(self, burst=False):
+        """Returns a PostWorker for this poster.  If 'burst' is True, the worker stops
+        when the queue is empty.
+        """
+        return PostWorker(self.post_Q, self.post_URL, self.post_time_file, self.post_batch_size, 
+                          session=self.session, gzip_posts=self.gzip_posts,
+                          max_post_readings=self.max_post_readings,
+                          max_post_bytes=self.max_post_bytes,
+                          bmon_id=self.bmon_id, breaker=self.breaker, burst=burst,
+                          reject_limit=self.reject_limit)
+
+    def on_circuit_change(self, state):
+        """Called when the server goes down or comes back.  When it comes back, extra
+        post workers are started to drain the backlog; they stop when the queue is empty.
+        """
+        if state != CLOSED:
+            return
+        self.burst_workers = [w for w in self.burst_workers if w.is_alive()]
+        extra = self.burst_concurrency - self.post_thread_count - len(self.burst_workers)
+        if extra > 0 and len(self.post_Q):
+            logging.info(f'Draining the backlog for {self.bmon_id} with {extra} extra '
+                         'post workers.')
+            for i in range(extra):
+                worker = self.make_worker(burst=True)
+                worker.start()
+                self.burst_workers.append(worker)
+
     def add_readings(self, reading_data):
         """Adds a set of readings to the posting queue.  The 'reading_data' 
         variable will be converted to JSON and posted to the HTTP server.  So, 
         the server must understand that format.  If there is a converting
         function present, use it to convert the readings.
         """
+        self.add_readings_many([reading_data])
+
+    def add_readings_many(self, reading_data_list):
+        """Adds a list of reading sets to the posting queue in one transaction.
+        Each set of readings is posted separately, as if add_readings() had been
+        called for it.  If the queue has limits, the readings may be held back or
+        rejected; see the queue_limits module.
+        """
         if self.reading_converter:
-            self.post_Q.append(self.reading_converter(reading_data))
+            items = [self.reading_converter(rd) for rd in reading_data_list]
         else:
-            self.post_Q.append(reading_data)
+            items = list(reading_data_list)
+        if self.limits and not self.limits.admit(items):
+            return      # written to an overflow segment
+        with metrics.timer('queue_append', bmon=self.bmon_id):
+            self.post_Q.extend(items)
 
     def items_remaining(self):
         """Returns the number of items remaining in the queue, including
-        those currently being processed.
+        those currently being processed and those in overflow segments.
         """
-        return len(self.post_Q) + self.post_Q.processing_count()
+        remaining = len(self.post_Q) + self.post_Q.processing_count()
+        if self.limits:
+            remaining += self.limits.spilled_count()
+        return remaining
 
-    def wait_until_done(self, wait_time=5):
-        """wait until this poster finishes its work or stops
-        making progress on posting.
+    def wait_until_done(self, timeout=None, stall_time=None):
+        """Waits until this poster finishes its work.  See wait_all() for
+        a description of the parameters and the return value.
         """
-        last_remaining_count = 0
-        while True:
-            remaining_count = self.items_remaining()
-            if remaining_count == 0 or remaining_count == last_remaining_count:
-                break
-            last_remaining_count = remaining_count
+        return wait_all([self], timeout, stall_time)
+
+
+def wait_all(posters, timeout=None, stall_time=None):
+    """Waits until all of the HttpPoster objects in the sequence 'posters' have empty
+    queues, or until 'timeout' seconds have passed.  If 'stall_time' is provided, also
+    stops waiting if no posting progress is made for 'stall_time' seconds, e.g. when a
+    BMON server is down.  A 'timeout' of None waits without a deadline.  The posters
+    all post at the same time, so the wait is for the slowest of them, and the wait
+    ends as soon as the last item is finished.  Returns True if all queues are empty.
+    """
+    start = time.time()
+    deadline = start + timeout if timeout is not None else None
+    last_remaining = None
+    last_progress = start
+    while True:
+        change_count = SqliteReliableQueue.change_count()
+        remaining = sum(poster.items_remaining() for poster in posters)
+        if remaining == 0:
+            return True
+
+        now = time.time()
+        if remaining != last_remaining:
+            last_remaining = remaining
+            last_progress = now
 
-            # wait a few seconds before checking again.  this needs to be long enough
-            # so that posting progress can be made.
-            time.sleep(wait_time)
+        # determine how long to wait for the next change to the queues
+        waits = [SqliteReliableQueue._max_wait]
+        if deadline is not None:
+            waits.append(deadline - now)
+        if stall_time is not None:
+            waits.append(last_progress + stall_time - now)
+        wait = min(waits)
+        if wait <= 0:
+            logging.info('Stopped waiting with %d items remaining to post.' % remaining)
+            return False
+
+        SqliteReliableQueue.wait_for_change(change_count, wait)
 
 
 class PostWorker(threading.Thread):
     """
     A class to post readings to an HTTP server.
     Make sure the HTTP server responds with a status code of 200 if it receives
-    the readings, even though those readings may be badly formatted or duplicates.
-    Otherwise, this object will continue to try to repost the bad readings.
+    the readings, even though those readings may be duplicates.  Readings the
+    server keeps rejecting are moved to the dead letter table of the queue.
     """
 
-    def __init__ (self, source_Q, post_URL, post_time_file):
+    def __init__ (self, source_Q, post_URL, post_time_file, batch_size=1, 
+                  session=None, gzip_posts=False, max_post_readings=0, 
+                  max_post_bytes=0, bmon_id=None, breaker=None, burst=False,
+                  reject_limit=3):
         """ Create the posting worker in its own thread.
         'sourceQ': the ReadingQueue to get postings from.
         'postURL': the URL to post to, w/o any parameters
         'post_time_file': the name of a file to record the time of 
              a successful post.
+        'batch_size': the maximum number of items to pop from the queue
+             at one time.  The items are marked finished together after they
+             are all posted.
+        'session': the requests Session used to post, which keeps connections
+             alive between posts.  If None, a new Session is created.
+        'gzip_posts': if True, gzip compress the body of each post.
+        'max_post_readings', 'max_post_bytes': popped items for the same
+             store key are merged into one post holding up to this many 
+             readings and JSON bytes.  0 disables merging.
+        'bmon_id': the ID of the BMON server, used to label the pipeline
+             metrics.  Defaults to 'post_URL'.
+        'breaker': the CircuitBreaker tracking whether the server is responding.
+             If None, failed posts are retried on a back-off schedule only.
+        'burst': if True, the worker stops when the queue is empty.  Used for the
+             extra workers that drain a backlog.
+        'reject_limit': the number of times the server can reject the readings
+             in a post before the post is split to isolate the rejected readings.
+             0 or None retries rejected posts, like failed posts, forever.
         """  
         # run constructor of base class
         threading.Thread.__init__(self)
@@ -112,6 +301,15 @@ class PostWorker(threading.Thread):
         self.source_Q = source_Q
         self.post_URL = post_URL
         self.post_time_file = post_time_file
+        self.batch_size = batch_size
+        self.session = session or requests.Session()
+        self.gzip_posts = gzip_posts
+        self.max_post_readings = max_post_readings
+        self.max_post_bytes = max_post_bytes
+        self.bmon_id = bmon_id or post_URL
+        self.breaker = breaker
+        self.burst = burst
+        self.reject_limit = reject_limit
        
         
     def run(self):
@@ -119,53 +317,286 @@ class PostWorker(threading.Thread):
         while True:
 
             try:
-                # get the next list of readings to post.  the 'q_id' identifies
-                # this set of readings so it can be dropped from queue when 
-                # finished.
-                q_id, readings = self.source_Q.popleft()
-                
-                # encode these as json to put into the post
-                post_data = json.dumps(readings)
+                # get the next lists of readings to post.  the 'q_id' of each item
+                # identifies that set of readings so it can be dropped from queue 
+                # when finished.  Only pops that don't wait for items are timed.
+                with metrics.timer('queue_pop', bmon=self.bmon_id):
+                    items = self.source_Q.pop_many(self.batch_size, sleep_wait=False)
+                if not items:
+                    if self.burst:
+                        return      # the backlog is drained
+                    items = self.source_Q.pop_many(self.batch_size)
             except:
-                logging.exception('Error popping or JSON Encoding readings to post.')
+                logging.exception('Error popping readings to post.')
                 time.sleep(5)   # to limit rapid fire errors
                 continue   # go back and pop another
 
-            retry_delay = 15  # start with a 15 second delay before retrying a post
-            while True:
-                try:
-                    # need to *not* verify SSL requests as Python 2.7.3 has an issue with
-                    # requests SSL verification causing to fail when cert is actually OK.
-                    req = requests.post(self.post_URL, data=post_data, timeout=15, verify=False)
-                    if req.status_code == 200:
-                        if logging.root.level == logging.DEBUG:
-                            logging.debug('posted: %s, %s' % (readings, req.text))
-                        else:
-                            logging.info('posted %d bytes' % len(post_data))
-                        
-                        # tell the queue that this item is complete
-                        self.source_Q.finished(q_id)
-                        
-                        # record the time of the post in the file ignoring
-                        # errors (which might be caused by another worker writing
-                        # to the file simultaneously.
-                        try:
-                            fout = open(self.post_time_file, 'w')
-                            fout.write(str(time.time()))
-                            fout.close()
-                        except:
-                            pass
-                            
-                        break   # and get another item from the queue
-                        
+            # merge small items into larger posts, encoding them as JSON.
+            finished_ids = []
+            with metrics.timer('json_encode', bmon=self.bmon_id):
+                posts = coalesce_items(items, self.max_post_readings, self.max_post_bytes)
+            for q_ids, readings, post_data in posts:
+                rejection = self.post(readings, post_data, self.reject_limit)
+                if rejection is not None:
+                    self.isolate(readings, post_data, rejection)
+                finished_ids.extend(q_ids)
+
+            try:
+                # tell the queue that these items are complete
+                self.source_Q.finished_many(finished_ids)
+            except:
+                logging.exception('Error marking posted readings as finished.')
+
+    def post(self, readings, post_data, max_rejects=None):
+        """Posts the JSON string 'post_data', which encodes 'readings', to the
+        URL, retrying until the post succeeds.  If the server rejects the readings
+        'max_rejects' times, gives up and returns a description of the rejection.
+        Returns None if the post succeeded.  If 'max_rejects' is None, rejections are
+        retried like other failed posts.
+        """
+        if self.gzip_posts:
+            body, headers = gzip_body(post_data)
+        else:
+            body = post_data
+            headers = None
+
+        retry_delay = 15  # start with a 15 second delay before retrying a post
+        rejects = 0
+        while True:
+            server_error = True     # False if the server rejected the readings
+            try:
+                # need to *not* verify SSL requests as Python 2.7.3 has an issue with
+                # requests SSL verification causing to fail when cert is actually OK.
+                with metrics.timer('http_post', bmon=self.bmon_id):
+                    req = self.session.post(self.post_URL, data=body, headers=headers, 
+                                            timeout=15, verify=False)
+                if req.status_code == 200:
+                    if self.breaker:
+                        self.breaker.record_success()
+                    record_post_metrics(self.bmon_id, readings, body)
+                    if logging.root.level == logging.DEBUG:
+                        logging.debug('posted: %s, %s' % (readings, req.text))
+                    else:
+                        logging.info('posted %d bytes' % len(body))
+                    
+                    record_post_time(self.post_time_file)
+                    return
+                    
+                else:
+                    if max_rejects and is_rejection(req.status_code):
+                        server_error = False
+                        rejects += 1
+                        if rejects >= max_rejects:
+                            metrics.inc('file_to_bmon_posts_total', bmon=self.bmon_id, 
+                                        result='rejected')
+                            return 'Status %s: %s' % (req.status_code, req.text[:200])
+                    raise Exception('Bad Post Status Code: %s' % req.status_code)
+                    
+            except:
+                logging.exception("Error posting: %s" % readings)
+                metrics.inc('file_to_bmon_posts_total', bmon=self.bmon_id, result='error')
+                with metrics.timer('retry_sleep', bmon=self.bmon_id):
+                    # try again later.  If the server is down, the circuit breaker
+                    # ends the wait when it comes back.
+                    if self.breaker:
+                        if server_error:
+                            self.breaker.record_failure()
+                        server_back = self.breaker.wait_after_failure(retry_delay)
                     else:
-                        raise Exception('Bad Post Status Code: %s' % req.status_code)
-                        
-                except:
-                    logging.exception("Error posting: %s" % readings)
-                    time.sleep(retry_delay)   # try again later
-                    if retry_delay < 8 * 60:
-                        retry_delay *= 2
+                        time.sleep(retry_delay)
+                        server_back = False
+                if server_back:
+                    retry_delay = 15
+                elif retry_delay < 8 * 60:
+                    retry_delay *= 2
+
+    def isolate(self, readings, post_data, rejection):
+        """Called when the server keeps rejecting the post of 'readings', encoded as
+        'post_data', with the description of the rejection 'rejection'.  Splits the
+        readings in half and posts each half, repeating with the halves that are
+        rejected down to single readings, so only the readings being rejected are
+        moved to the dead letter table.  If both halves of a split are rejected, and
+        the server also rejects a post with no readings, the server is rejecting posts
+        regardless of their readings, so waits until it accepts posts again and then
+        posts the halves again.
+        """
+        halves = split_post(readings)
+        if halves is None:
+            add_dead_letter(self.source_Q, self.bmon_id, readings, rejection)
+            return
+        while True:
+            # a half is not retried when rejected; the whole post already was.
+            rejections = [self.post(half, half_data, max_rejects=1) 
+                          for half, half_data in halves]
+            if None in rejections:
+                break
+            empty, empty_data = empty_post(readings)
+            server_rejection = self.post(empty, empty_data, max_rejects=1)
+            if server_rejection is None:
+                break
+            log_server_rejection(self.bmon_id, server_rejection)
+            # retried, like a failed post, until the server accepts it.
+            self.post(empty, empty_data)
+        for (half, half_data), rejection in zip(halves, rejections):
+            if rejection is not None:
+                self.isolate(half, half_data, rejection)
+
+def is_rejection(status_code):
+    """Returns True if the HTTP status code 'status_code' means the server rejected
+    the readings in the post, so posting the same readings again will fail again.
+    """
+    return status_code in REJECTION_CODES
+
+def log_server_rejection(bmon_id, rejection):
+    """Logs that the BMON server 'bmon_id' rejected a post with no readings as described
+    by 'rejection', so readings are not moved to the dead letter table until it accepts
+    posts again.
+    """
+    logging.warning('%s rejected a post with no readings (%s); waiting for it to accept '
+                    'posts before isolating rejected readings.' % (bmon_id, rejection))
+
+def split_post(readings):
+    """Splits the readings of a rejected post in two.  'readings' is an item created
+    by BMSreadConverter.  Returns a list of two (readings, JSON post data) tuples, or
+    None if 'readings' holds only one reading or is in another format.
+    """
+    if not (isinstance(readings, dict) and set(readings.keys()) == {'storeKey', 'readings'}
+            and len(readings['readings']) > 1):
+        return None
+    rd_list = readings['readings']
+    middle = len(rd_list) // 2
+    halves = []
+    for part in (rd_list[:middle], rd_list[middle:]):
+        half = {'storeKey': readings['storeKey'], 'readings': part}
+        halves.append((half, json.dumps(half)))
+    return halves
+
+def empty_post(readings):
+    """Returns a (readings, JSON post data) tuple for a post with the store key of
+    'readings', an item created by BMSreadConverter, but no readings.  Used to find
+    out if the server rejects posts regardless of their readings.
+    """
+    empty = {'storeKey': readings['storeKey'], 'readings': []}
+    return empty, json.dumps(empty)
+
+def add_dead_letter(queue, bmon_id, readings, rejection):
+    """Moves 'readings', which the BMON server 'bmon_id' rejected as described by
+    'rejection', to the dead letter table of 'queue'.
+    """
+    logging.error('Moving readings rejected by %s to the dead letter table (%s): %s' % 
+                  (bmon_id, rejection, readings))
+    try:
+        queue.add_dead_letters([readings], rejection)
+    except:
+        logging.exception('Error adding rejected readings to the dead letter table.')
+    if isinstance(readings, dict) and 'readings' in readings:
+        count = len(readings['readings'])
+    else:
+        count = 1
+    metrics.inc('file_to_bmon_dead_letter_readings_total', count, bmon=bmon_id)
+
+def coalesce_items(items, max_readings=0, max_bytes=0):
+    """Merges queue items into fewer, larger posts and encodes them as JSON.
+    'items' is a list of (q_id, item) tuples popped from a queue.  Items created by
+    BMSreadConverter that have the same 'storeKey' have their 'readings' lists
+    combined, up to 'max_readings' readings and 'max_bytes' bytes of JSON per post.
+    A single item larger than the limits is posted by itself, as are items of other
+    formats.  A limit of 0 disables merging.  Items that cannot be encoded as JSON
+    are logged and left out, so they stay in the queue's 'processing' list.
+    Returns a list of (list of q_ids, readings, JSON post data) tuples, one per post.
+    """
+    posts = []
+    groups = {}     # storeKey -> the PostGroup being filled for that key
+
+    for q_id, item in items:
+        try:
+            if max_readings and max_bytes and isinstance(item, dict) \
+                    and set(item.keys()) == {'storeKey', 'readings'}:
+                # encode the readings list and strip the enclosing brackets so the
+                # readings can be joined with those of other items.
+                store_key = item['storeKey']
+                readings = item['readings']
+                json_part = json.dumps(readings)[1:-1]
+            else:
+                posts.append(([q_id], item, json.dumps(item)))
+                continue
+        except:
+            logging.exception('Error JSON Encoding readings to post.')
+            continue
+
+        group = groups.get(store_key)
+        if group and not group.fits(readings, json_part, max_readings, max_bytes):
+            posts.append(group.post())
+            group = None
+        if group is None:
+            group = groups[store_key] = PostGroup(store_key)
+        group.add(q_id, readings, json_part)
+
+    for group in groups.values():
+        posts.append(group.post())
+
+    return posts
+
+class PostGroup:
+    """Accumulates the readings of queue items with the same store key that
+    will be merged into one post.  Used by coalesce_items().
+    """
+
+    def __init__(self, store_key):
+        self.store_key = store_key
+        self.q_ids = []
+        self.readings = []
+        self.json_parts = []
+        self.json_bytes = 0
+
+    def fits(self, readings, json_part, max_readings, max_bytes):
+        """Returns True if 'readings', encoded as 'json_part', can be added without
+        exceeding the limits.
+        """
+        return len(self.readings) + len(readings) <= max_readings and \
+            self.json_bytes + len(json_part) + 2 <= max_bytes
+
+    def add(self, q_id, readings, json_part):
+        self.q_ids.append(q_id)
+        self.readings.extend(readings)
+        if json_part:
+            self.json_parts.append(json_part)
+        self.json_bytes += len(json_part) + 2
+
+    def post(self):
+        """Returns a (list of q_ids, readings, JSON post data) tuple for the group.
+        """
+        post_data = '{"storeKey": %s, "readings": [%s]}' % (json.dumps(self.store_key), 
+                                                           ', '.join(self.json_parts))
+        return self.q_ids, {'storeKey': self.store_key, 'readings': self.readings}, post_data
+
+def record_post_time(post_time_file):
+    """Records the current time in the file 'post_time_file' as the time
+    of the last successful post.
+    """
+    # ignore errors (which might be caused by another worker writing
+    # to the file simultaneously.
+    try:
+        fout = open(post_time_file, 'w')
+        fout.write(str(time.time()))
+        fout.close()
+    except:
+        pass
+
+def record_post_metrics(bmon_id, readings, body):
+    """Counts a successful post of 'readings', sent as 'body', to the BMON server
+    'bmon_id' in the pipeline metrics.
+    """
+    metrics.inc('file_to_bmon_posts_total', bmon=bmon_id, result='ok')
+    if isinstance(readings, dict) and 'readings' in readings:
+        metrics.inc('file_to_bmon_post_readings_total', len(readings['readings']), bmon=bmon_id)
+    metrics.inc('file_to_bmon_post_bytes_total', len(body), bmon=bmon_id)
+
+def gzip_body(post_data):
+    """Returns the body and headers for posting the JSON string 'post_data'
+    with gzip compression.
+    """
+    return gzip.compress(post_data.encode('utf-8')), {'Content-Encoding': 'gzip'}
 
 class BMSreadConverter:
     """Used to create the needed data structure for posting to the BMS application
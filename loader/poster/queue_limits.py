@@ -0,0 +1,243 @@
+"""Holds the QueueLimits class, which keeps the posting queue of a BMON server from
+growing without bound when the server is down or slow, e.g. during a large backfill.
+The queue can be limited by the number of items, the bytes used in the queue file,
+and the age of the oldest item.  When the queue is over a limit, new readings are
+handled by one of these policies:
+
+    block   the Reader adding the readings waits until posting brings the queue
+            back under its limits.
+    spill   the readings are written to gzip compressed overflow segment files, which
+            are moved into the queue, oldest first, as it drains.
+    fail    QueueFullError is raised, which stops the loading of the file source.
+            The file being loaded and the rest of the source's files are left for a
+            later run.
+
+Checking the size of a large queue takes time, so the size is checked at most once per
+'check_interval' seconds, unless the items added since the last check may have put the
+queue over a limit.  Once the queue is over a limit, it must drain below RESUME_FRACTION
+of the limits before new readings are queued again, so that the policy is not switched
+on and off with every post.  The start and end of queue pressure are logged, at most
+once per LOG_INTERVAL seconds.
+"""
+import os
+import time
+import gzip
+import pickle
+import logging
+import threading
+from pathlib import Path
+
+from .sqlite_queue import SqliteReliableQueue
+from metrics import REGISTRY as metrics
+
+POLICIES = ('block', 'spill', 'fail')
+
+# Fraction of the limits the queue must drain below to end a period of queue pressure.
+RESUME_FRACTION = 0.8
+
+# Minimum seconds between log messages about the start of queue pressure.
+LOG_INTERVAL = 60.0
+
+
+class QueueFullError(Exception):
+    """Raised when readings are added to a posting queue that is over its limits and
+    uses the 'fail' policy.
+    """
+    pass
+
+
+class QueueLimits:
+    """Applies size limits and a policy to the posting queue of one BMON server.
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self, queue, bmon_id, max_items=None, max_bytes=None, max_age=None,
+                 policy='block', spill_dir=None, check_interval=1.0):
+        """'queue' is the SqliteReliableQueue holding the readings to post to the BMON
+        server 'bmon_id'.  'max_items', 'max_bytes' and 'max_age' are the maximum number
+        of items in the queue, bytes used in the queue file, and age in seconds of the
+        oldest item; None means no limit.  'policy' is 'block', 'spill' or 'fail'.
+        'spill_dir' is the directory holding the overflow segments, required for the
+        'spill' policy.  The queue size is checked at most every 'check_interval' seconds.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f'Invalid queue limit policy: {policy}')
+        if policy == 'spill' and spill_dir is None:
+            raise ValueError('The spill policy requires a spill directory.')
+        self.queue = queue
+        self.bmon_id = bmon_id
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.policy = policy
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.last_check = 0.0
+        self.last_reason = None
+        self.last_stats = (0, 0, 0.0)   # queue stats() at the last check
+        self.added = 0                  # items added to the queue since the last check
+        self.pressure_start = None      # time the queue went over its limits
+        self.pressure_items = 0         # items spilled or blocked during the pressure
+        self.last_log = None            # time of the last queue pressure log message
+        self.unlogged = 0               # periods of pressure started without a message
+        self.logged = False             # True if the current pressure start was logged
+
+        self.spill_dir = Path(spill_dir) if spill_dir is not None else None
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            # remove segments that were not completely written
+            for path in self.spill_dir.glob('*.tmp'):
+                path.unlink()
+        if policy == 'spill' or self.spill_segments():
+            # segments left by an earlier run with the spill policy are loaded
+            # regardless of the current policy.
+            threading.Thread(target=self.drain_spill, daemon=True).start()
+
+    def over_limit(self, force=False):
+        """Returns a description of the limit the queue is over, or None if it is under
+        its limits.  During queue pressure, the limits are reduced to RESUME_FRACTION of
+        their values.  The queue size is only checked if 'check_interval' seconds have
+        passed since the last check, the items added since then may have put the queue
+        over a limit, or 'force' is True; otherwise the last result is returned.
+        """
+        now = time.time()
+        if not force and now - self.last_check < self.check_interval:
+            if self.last_reason is not None or not self._estimate_over():
+                return self.last_reason
+        self.last_check = now
+        self.added = 0
+        count, used_bytes, age = self.last_stats = self.queue.stats()
+        fraction = RESUME_FRACTION if self.pressure_start is not None else 1.0
+        reason = None
+        if self.max_items is not None and count >= self.max_items * fraction:
+            reason = f'{count} items, limit {self.max_items}'
+        elif self.max_bytes is not None and used_bytes >= self.max_bytes * fraction:
+            reason = f'{used_bytes} bytes, limit {self.max_bytes}'
+        elif self.max_age is not None and age >= self.max_age * fraction:
+            reason = f'oldest item {age:.0f} s old, limit {self.max_age} s'
+        self.last_reason = reason
+        return reason
+
+    def _estimate_over(self):
+        """Returns True if the items added since the last check may have put the queue
+        over its item or byte limit, estimating the bytes from the average item size.
+        """
+        count, used_bytes, _ = self.last_stats
+        if self.max_items is not None and count + self.added >= self.max_items:
+            return True
+        if self.max_bytes is not None and count and \
+                used_bytes * (count + self.added) / count >= self.max_bytes:
+            return True
+        return False
+
+    def admit(self, items):
+        """Called before the list of queue items 'items' is added to the queue.  Returns
+        True if the items should be added to the queue, or False if they were written to
+        an overflow segment.  With the 'block' policy, waits until the queue is under its
+        limits.  With the 'fail' policy, raises QueueFullError if the queue is over a limit.
+        """
+        if self.policy == 'spill':
+            with self.lock:
+                # once spilling, keep spilling until the segments are drained, so
+                # readings are queued in order.
+                reason = self.over_limit()
+                if reason is None and not self.spill_segments():
+                    self._pressure_end()
+                    self.added += len(items)
+                    return True
+                self._pressure_begin(reason or 'overflow segments waiting')
+                self.write_segment(items)
+                self.pressure_items += len(items)
+                metrics.inc('file_to_bmon_queue_spilled_items_total', len(items), 
+                            bmon=self.bmon_id)
+                return False
+
+        reason = self.over_limit()
+        if reason is None:
+            self._pressure_end()
+            self.added += len(items)
+            return True
+        self._pressure_begin(reason)
+        self.pressure_items += len(items)
+        if self.policy == 'fail':
+            raise QueueFullError(f'Posting queue for {self.bmon_id} is full: {reason}.')
+
+        # block until posting makes room in the queue
+        with metrics.timer('queue_block', bmon=self.bmon_id):
+            while reason is not None:
+                change_count = SqliteReliableQueue.change_count()
+                SqliteReliableQueue.wait_for_change(change_count, SqliteReliableQueue._max_wait)
+                reason = self.over_limit(force=True)
+        self.added += len(items)
+        return True
+
+    def _pressure_begin(self, reason):
+        if self.pressure_start is not None:
+            return
+        now = self.pressure_start = time.time()
+        self.pressure_items = 0
+        metrics.inc('file_to_bmon_queue_pressure_total', bmon=self.bmon_id, policy=self.policy)
+        self.logged = self.last_log is None or now - self.last_log >= LOG_INTERVAL
+        if not self.logged:
+            self.unlogged += 1
+            return
+        action = {'block': 'blocking', 'spill': 'spilling', 'fail': 'rejecting'}[self.policy]
+        msg = (f'Posting queue for {self.bmon_id} is over its limits ({reason}); '
+               f'{action} new readings.')
+        if self.unlogged:
+            msg += (f'  It went over its limits {self.unlogged} more times since the '
+                    'last message.')
+        logging.warning(msg)
+        self.last_log = now
+        self.unlogged = 0
+
+    def _pressure_end(self):
+        if self.pressure_start is None:
+            return
+        if self.logged:
+            logging.info(f'Posting queue for {self.bmon_id} is back under its limits after '
+                         f'{time.time() - self.pressure_start:.1f} s; {self.pressure_items} '
+                         f'queue items were held back by the {self.policy} policy.')
+        self.pressure_start = None
+
+    def spill_segments(self):
+        """Returns a list of the paths of the overflow segments, oldest first.
+        """
+        if self.spill_dir is None:
+            return []
+        return sorted(self.spill_dir.glob('spill_*.pkl.gz'))
+
+    def spilled_count(self):
+        """Returns the number of queue items held in overflow segments.
+        """
+        return sum(int(path.name.split('_')[2].split('.')[0]) for path in self.spill_segments())
+
+    def write_segment(self, items):
+        """Writes the list of queue items 'items' to a new overflow segment.  The
+        segment name holds the time it was written and the number of items.
+        """
+        path = self.spill_dir / f'spill_{time.time_ns():020d}_{len(items)}.pkl.gz'
+        tmp_path = path.with_name(path.name + '.tmp')
+        with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+            pickle.dump(items, f)
+        os.replace(tmp_path, path)
+
+    def drain_spill(self):
+        """Run in a background thread.  Moves the overflow segments into the queue,
+        oldest first, whenever the queue is under its limits.
+        """
+        while True:
+            change_count = SqliteReliableQueue.change_count()
+            try:
+                with self.lock:
+                    segments = self.spill_segments()
+                    if segments and self.over_limit(force=True) is None:
+                        with gzip.open(segments[0], 'rb') as f:
+                            items = pickle.load(f)
+                        self.queue.extend(items)
+                        segments[0].unlink()
+                        continue
+            except:
+                logging.exception('Error moving overflow readings into the queue for '
+                                  f'{self.bmon_id}.')
+            SqliteReliableQueue.wait_for_change(change_count, SqliteReliableQueue._max_wait)
@@ -7,12 +7,17 @@ process.
 Modified from the code presented at (reliability added):  
     http://flask.pocoo.org/snippets/88/
 Also modified to provide a method to return the number of items in the
-'processing' table.
+'processing' table, and methods to append, pop and finish a batch of items in
+one transaction.  Threads waiting for items, or waiting for queues to empty, are
+woken by a condition variable when items are added or finished, rather than
+polling the database.  The time each item was added is stored with it, so the
+age of the oldest item can be reported by stats().  Items that can never be
+processed, e.g. readings the server keeps rejecting, can be moved to a
+'dead_letter' table, from which they can be listed and replayed into the queue.
 """
-import os, sqlite3
+import os, sqlite3, time
 from pickle import loads, dumps
-from time import sleep
-from threading import get_ident
+from threading import get_ident, Condition
 
 
 class SqliteReliableQueue(object):
@@ -22,49 +27,109 @@ class SqliteReliableQueue(object):
             'CREATE TABLE IF NOT EXISTS queue ' 
             '('
             '  id INTEGER PRIMARY KEY AUTOINCREMENT,'
-            '  item BLOB'
+            '  item BLOB,'
+            '  added REAL'
             ')'
             )
     _create_processing = (
             'CREATE TABLE IF NOT EXISTS processing ' 
             '('
             '  id INTEGER PRIMARY KEY,'
-            '  item BLOB'
+            '  item BLOB,'
+            '  added REAL'
+            ')'
+            )
+    _create_dead_letter = (
+            'CREATE TABLE IF NOT EXISTS dead_letter ' 
+            '('
+            '  id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            '  item BLOB,'
+            '  added REAL,'
+            '  reason TEXT'
             ')'
             )
     _count = 'SELECT COUNT(*) FROM queue'
     _iterate = 'SELECT id, item FROM queue'
-    _append = 'INSERT INTO queue (item) VALUES (?)'
+    _append = 'INSERT INTO queue (item, added) VALUES (?, ?)'
     _write_lock = 'BEGIN IMMEDIATE'
     _popleft_get = (
             'SELECT id, item FROM queue '
             'ORDER BY id LIMIT 1'
             )
     _popleft_del = 'DELETE FROM queue WHERE id = ?'
+    _pop_many_get = (
+            'SELECT id, item, added FROM queue '
+            'ORDER BY id LIMIT ?'
+            )
     _peek = (
             'SELECT item FROM queue '
             'ORDER BY id LIMIT 1'
             )
-    _processing_append = 'INSERT INTO processing (id, item) VALUES (?, ?)'
+    _processing_append = 'INSERT INTO processing (id, item, added) VALUES (?, ?, ?)'
     _processing_del = 'DELETE FROM processing WHERE id = ?'
     _processing_clear = 'DELETE FROM processing'
     _processing_iterate = 'SELECT id, item FROM processing'
+    _processing_restore = 'SELECT item, added FROM processing ORDER BY id'
     _processing_count = 'SELECT COUNT(*) FROM processing'
+    _oldest_added = 'SELECT added FROM queue ORDER BY id LIMIT 1'
+    _processing_oldest_added = 'SELECT MIN(added) FROM processing'
+    _dead_letter_append = 'INSERT INTO dead_letter (item, added, reason) VALUES (?, ?, ?)'
+    _dead_letter_iterate = 'SELECT id, item, added, reason FROM dead_letter ORDER BY id'
+    _dead_letter_count = 'SELECT COUNT(*) FROM dead_letter'
+    _dead_letter_del = 'DELETE FROM dead_letter WHERE id = ?'
+
+    # Condition variable notified when items are added to or finished in any
+    # queue in this process, and a count of those changes.
+    _changed = Condition()
+    _change_count = 0
+
+    # Functions called, with no arguments, when items are added to or finished
+    # in any queue.  Used to wake up waiters that cannot wait on the condition
+    # variable, such as asyncio tasks.
+    _change_listeners = []
 
-    def __init__(self, path):
+    # Maximum seconds to wait for a change notification before checking the
+    # database again, in case another process added items.
+    _max_wait = 5.0
+
+    # Allowed values for the journal_mode and synchronous pragmas
+    _journal_modes = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+    _synchronous_modes = ('OFF', 'NORMAL', 'FULL', 'EXTRA', '0', '1', '2', '3')
+
+    def __init__(self, path, journal_mode=None, synchronous=None):
+        """'path' is the path to the SQLite database file holding the queue.
+        'journal_mode' sets the SQLite journal mode for the database, e.g. 'WAL',
+        and 'synchronous' sets the SQLite synchronous setting, e.g. 'NORMAL'.  If
+        they are None, the SQLite defaults are used.  'WAL' with 'NORMAL' greatly
+        reduces the number of disk syncs per transaction.
+        """
         self.path = os.path.abspath(path)
+        if journal_mode is not None and str(journal_mode).upper() not in self._journal_modes:
+            raise ValueError('Invalid journal_mode: %s' % journal_mode)
+        if synchronous is not None and str(synchronous).upper() not in self._synchronous_modes:
+            raise ValueError('Invalid synchronous setting: %s' % synchronous)
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
         self._connection_cache = {}
         with self._get_conn() as conn:
             # if queue and processing tables do not exist, create them
             conn.execute(self._create_queue)
             conn.execute(self._create_processing)
+            conn.execute(self._create_dead_letter)
+
+            # queue files created before the time added was stored need the column
+            # added to their tables.
+            for table in ('queue', 'processing'):
+                columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+                if 'added' not in columns:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN added REAL')
 
             # transfer any entries from the processing list back into the
             # queue and clear the processing list.
-            for _, obj_buffer in conn.execute(self._processing_iterate):
+            for obj_buffer, added in conn.execute(self._processing_restore).fetchall():
                 # append method does not work here, perhaps due to running
                 # a second 'with' statement.  Use direct SQL statemen instead.
-                conn.execute(self._append, (obj_buffer,))
+                conn.execute(self._append, (obj_buffer, added))
             conn.execute(self._processing_clear)
 
     def __len__(self):
@@ -92,8 +157,12 @@ class SqliteReliableQueue(object):
         """
         id = get_ident()
         if id not in self._connection_cache:
-            self._connection_cache[id] = sqlite3.Connection(self.path, 
-                    timeout=60)
+            conn = sqlite3.Connection(self.path, timeout=60)
+            if self.journal_mode is not None:
+                conn.execute('PRAGMA journal_mode=%s' % self.journal_mode)
+            if self.synchronous is not None:
+                conn.execute('PRAGMA synchronous=%s' % self.synchronous)
+            self._connection_cache[id] = conn
         return self._connection_cache[id]
     
     def append(self, obj):
@@ -101,36 +170,58 @@ class SqliteReliableQueue(object):
         """
         obj_buffer = sqlite3.Binary(dumps(obj))
         with self._get_conn() as conn:
-            conn.execute(self._append, (obj_buffer,))
+            conn.execute(self._append, (obj_buffer, time.time()))
             # the 'with' statement commits the insert.
+        self._notify_change()
+
+    def extend(self, objs):
+        """Adds a sequence of items to the queue in one transaction.
+        """
+        now = time.time()
+        obj_buffers = [(sqlite3.Binary(dumps(obj)), now) for obj in objs]
+        with self._get_conn() as conn:
+            conn.executemany(self._append, obj_buffers)
+        self._notify_change()
 
     def popleft(self, sleep_wait=True):
+        """Removes the next item from the queue and places it in the 'processing'
+        list.  Returns a two-tuple: (id # of the item, item).  If the queue is empty
+        and 'sleep_wait' is True, waits until an item is available; if 'sleep_wait'
+        is False, returns (None, None).
+        """
+        items = self.pop_many(1, sleep_wait)
+        if items:
+            return items[0]
+        return None, None
+
+    def pop_many(self, max_count, sleep_wait=True):
+        """Removes up to 'max_count' items from the front of the queue in one
+        transaction and places them in the 'processing' list.  Returns a list of
+        (id # of the item, item) two-tuples.  If the queue is empty and 'sleep_wait'
+        is True, waits until at least one item is available; if 'sleep_wait' is False,
+        returns an empty list.
+        """
         keep_pooling = True
-        wait = 0.5       # initial wait time for new queue items
-        max_wait = 5.0   # seconds of maximum wait for item in queue
-        tries = 0
         with self._get_conn() as conn:
-            id = None
+            rows = []
             while keep_pooling:
+                change_count = self.change_count()
                 # need to make sure another thread does not pop the same item.
                 conn.execute(self._write_lock)
-                cursor = conn.execute(self._popleft_get)
-                try:
-                    id, obj_buffer = cursor.fetchone()
+                rows = conn.execute(self._pop_many_get, (max_count,)).fetchall()
+                if rows:
                     keep_pooling = False
-                except TypeError:
+                else:
                     conn.commit() # unlock the database
                     if not sleep_wait:
                         keep_pooling = False
                         continue
-                    tries += 1
-                    sleep(wait)
-                    wait = min(max_wait, tries/2.0 + wait)
-            if id:
-                conn.execute(self._popleft_del, (id,))
-                conn.execute(self._processing_append, (id, obj_buffer))
-                return id, loads(obj_buffer)
-        return None, None
+                    # wait until items are added to a queue
+                    self.wait_for_change(change_count, self._max_wait)
+            if rows:
+                conn.executemany(self._popleft_del, [(row[0],) for row in rows])
+                conn.executemany(self._processing_append, rows)
+        return [(id, loads(obj_buffer)) for id, obj_buffer, _ in rows]
 
     def peek(self):
         """Returns next item in queue but does not remove if from the queue.
@@ -148,7 +239,57 @@ class SqliteReliableQueue(object):
         """
         with self._get_conn() as conn:
             conn.execute(self._processing_del, (id,))
+        self._notify_change()
             
+    def finished_many(self, ids):
+        """Call when finished processing a number of items.  This deletes the
+        items with the id #'s in the sequence 'ids' from the 'processing' list in
+        one transaction.
+        """
+        with self._get_conn() as conn:
+            conn.executemany(self._processing_del, [(id,) for id in ids])
+        self._notify_change()
+
+    @classmethod
+    def _notify_change(cls):
+        """Wakes up threads waiting for a change to a queue.
+        """
+        with cls._changed:
+            cls._change_count += 1
+            cls._changed.notify_all()
+        for listener in list(cls._change_listeners):
+            listener()
+
+    @classmethod
+    def add_change_listener(cls, listener):
+        """Registers a function, 'listener', that is called with no arguments each
+        time an item is added to or finished in any queue in this process.  It is
+        called from the thread making the change, so must be quick and thread-safe.
+        """
+        cls._change_listeners.append(listener)
+
+    @classmethod
+    def remove_change_listener(cls, listener):
+        """Unregisters a function registered with add_change_listener().
+        """
+        cls._change_listeners.remove(listener)
+
+    @classmethod
+    def change_count(cls):
+        """Returns a count that increases each time an item is added to or finished
+        in any queue in this process.  Pass it to wait_for_change().
+        """
+        return cls._change_count
+
+    @classmethod
+    def wait_for_change(cls, last_count, timeout):
+        """Waits until an item has been added to or finished in any queue in this
+        process since change_count() returned 'last_count', or until 'timeout'
+        seconds pass.  Returns True if a change occurred.
+        """
+        with cls._changed:
+            return cls._changed.wait_for(lambda: cls._change_count != last_count, timeout)
+
     def iter_processing(self):
         """Iterator returning items from the processing list.
         """
@@ -162,3 +303,66 @@ class SqliteReliableQueue(object):
         with self._get_conn() as conn:
             l = conn.execute(self._processing_count).fetchone()[0]
         return l
+
+    def add_dead_letters(self, objs, reason):
+        """Adds the sequence of items 'objs', which could not be processed, to the
+        dead letter table in one transaction.  'reason' describes why they failed.
+        """
+        now = time.time()
+        rows = [(sqlite3.Binary(dumps(obj)), now, reason) for obj in objs]
+        with self._get_conn() as conn:
+            conn.executemany(self._dead_letter_append, rows)
+
+    def dead_letters(self):
+        """Returns a list of the items in the dead letter table, oldest first, as
+        (id #, item, time added, reason) four-tuples.
+        """
+        with self._get_conn() as conn:
+            rows = conn.execute(self._dead_letter_iterate).fetchall()
+        return [(id, loads(obj_buffer), added, reason) 
+                for id, obj_buffer, added, reason in rows]
+
+    def dead_letter_count(self):
+        """Returns the number of items in the dead letter table.
+        """
+        with self._get_conn() as conn:
+            l = conn.execute(self._dead_letter_count).fetchone()[0]
+        return l
+
+    def remove_dead_letters(self, ids=None, replay=False):
+        """Removes the items with the id #'s in the sequence 'ids' from the dead
+        letter table, or all of its items if 'ids' is None.  If 'replay' is True, the
+        items are added back to the queue, in the same transaction.  Returns the
+        number of items removed.
+        """
+        with self._get_conn() as conn:
+            conn.execute(self._write_lock)
+            rows = conn.execute(self._dead_letter_iterate).fetchall()
+            if ids is not None:
+                ids = set(ids)
+                rows = [row for row in rows if row[0] in ids]
+            conn.executemany(self._dead_letter_del, [(row[0],) for row in rows])
+            if replay:
+                now = time.time()
+                conn.executemany(self._append, [(row[1], now) for row in rows])
+        if replay and rows:
+            self._notify_change()
+        return len(rows)
+
+    def stats(self):
+        """Returns a three-tuple describing the size of the queue: (number of items in
+        the queue and processing list, bytes of the database file used by the queue,
+        age in seconds of the oldest item).  The age is 0 if the queue is empty, and 
+        is not known for items added by versions that did not store the time added.
+        """
+        with self._get_conn() as conn:
+            count = conn.execute(self._count).fetchone()[0] + \
+                conn.execute(self._processing_count).fetchone()[0]
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+            used_pages = conn.execute('PRAGMA page_count').fetchone()[0] - \
+                conn.execute('PRAGMA freelist_count').fetchone()[0]
+            oldest = [row[0] for row in (conn.execute(self._oldest_added).fetchone(),
+                                         conn.execute(self._processing_oldest_added).fetchone())
+                      if row and row[0] is not None]
+        age = time.time() - min(oldest) if oldest else 0.0
+        return count, used_pages * page_size, age
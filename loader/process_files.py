@@ -1,29 +1,41 @@
 #!/usr/bin/env python3.7
 """Script to add sensor reading data from files into BMON systems.
+
+Usage:
+    process_files.py CONFIG_FILE [--daemon]
+
+Normally the script processes the files that are present and exits, and is run
+periodically, e.g. by cron.  With the --daemon option, the script keeps running,
+watches the file source directories and processes files soon after they arrive.
+The BMON posters and the sensor mapping stay loaded between files.  Sending the
+daemon a SIGHUP signal reloads the configuration file and sensor mapping; SIGTERM
+or SIGINT stops it.
 """
 
 import glob
 import logging
 from pathlib import Path
 import os
-import csv
 import sys
-from datetime import datetime
 import importlib
-import calendar
-import sqlite3
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import yaml
-import pytz
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials 
 
 import logging_setup
-from poster.httpPoster import HttpPoster, BMSreadConverter
+from watcher import DirectoryWatcher
+from sensor_mapping import SensorMapping
+from metrics import REGISTRY as metrics
+from poster.httpPoster import HttpPoster, BMSreadConverter, wait_all
 
 # configuration file name, 1st command line argument
 config_fn = sys.argv[1]
 
+# run as a daemon if requested
+daemon_mode = '--daemon' in sys.argv[2:]
+
 # get path to folder where config file is.  This folder
 # is used to store logs and other files.
 config_folder = Path(config_fn).parent
@@ -31,6 +43,7 @@ config_folder = Path(config_fn).parent
 # Make sure there are log and posters directories underneath config file
 (config_folder / 'log').mkdir(exist_ok=True)
 (config_folder / 'posters').mkdir(exist_ok=True)
+poster_folder = config_folder / 'posters'
 
 # ----- Setup Exception/Debug Logging for the Application
 
@@ -40,16 +53,14 @@ logging_setup.configure_logging(log_file)
 
 # -------------------
 
-try:
+def load_config():
+    """Reads the configuration file and sets the logging level from it.
+    Returns the configuration as a dictionary.
+    """
     # load configuration file describing general operation of this script
     # and the files to be loaded.
     config = yaml.safe_load(open(config_fn))
 
-except:
-    logging.exception('Error in Reading Configuration File.')
-    sys.exit()
-
-try:
     # set the log level. Because we are setting this on the logger, it will apply
     # to all handlers (unless maybe you set a specific level on a handler?).
     # defaults to INFO if no entry or a bad entry in the config file.
@@ -57,102 +68,264 @@ try:
         logging.root.setLevel(getattr(logging, config['logging_level'].upper(), logging.INFO))
     else:
         logging.root.setLevel(logging.INFO)
-    logging.info('Started file processing.')
 
-    # start BMON posters and put in a dictionary
-    posters = {}
-    poster_folder = config_folder / 'posters'
-    for id, bmon_info in config['bmon_servers'].items():
-        posters[id] = HttpPoster(bmon_info['url'],
-                                 reading_converter=BMSreadConverter(bmon_info['store_key']),
-                                 post_q_filename=poster_folder / ('%s_postQ.sqlite' % id),
-                                 post_thread_count=1,
-                                 post_time_file=poster_folder / ('%s_last_post_time' % id)
-                                )
-
-    # Make a dictionary mapping sensor IDs to BMON server IDs.  The file name 
-    # comes from the config file and is either a SQLite database (if the file
-    # extension is .sqlite), a CSV file (if the file extension is .csv), or
-    # the name of a Google Sheets spreadsheet (if there is no file extension).
-    # If no file is specified, then presumably every file source will have a 
-    # default bmon location.
-    if 'sensor_to_bmon_file' in config:
-        id_to_bmon_fn = Path(config['sensor_to_bmon_file'])
-        if id_to_bmon_fn.suffix.lower() == '.sqlite':
-            conn = sqlite3.connect(id_to_bmon_fn)
-            with conn:
-                cur = conn.cursor()
-                cur.execute('SELECT sensor_id, bmon_id from sensor_target')
-                rows = cur.fetchall()
-                id_to_bmon = dict(rows)
-
-        elif id_to_bmon_fn.suffix.lower() ==  '.csv':
-            id_to_bmon = {}
-            with open(id_to_bmon_fn) as csvfile:
-                filereader = csv.reader(csvfile)
-                for row in filereader:
-                    if len(row) != 2:
-                        continue
-                    id_to_bmon[row[0].strip()] = row[1].strip()
-
-        elif id_to_bmon_fn.suffix == '':
-            # no file extension so this must be a Google Sheets document.
-            scope = ['https://spreadsheets.google.com/feeds','https://www.googleapis.com/auth/drive']
-            creds = ServiceAccountCredentials.from_json_keyfile_name(config['google_credentials_file'], scope)
-            client = gspread.authorize(creds)
-            sheet = client.open(config['sensor_to_bmon_file']).sheet1
-            id_to_bmon = {}
-            for rec in sheet.get_all_records():
-                id_to_bmon[rec['sensor_id'].strip()] = rec['bmon_id'].strip()
+    return config
 
+def make_posters(config, posters):
+    """Starts a BMON poster for each server in the 'bmon_servers' section of 'config'
+    that does not already have one in the 'posters' dictionary, and adds it to
+    the dictionary, which is keyed on BMON id.  Posters that already exist are
+    left running, as their worker threads cannot be stopped.
+    """
+    for id, bmon_info in config['bmon_servers'].items():
+        if id in posters:
+            continue
+        poster_params = dict(
+            reading_converter=BMSreadConverter(bmon_info['store_key']),
+            post_q_filename=poster_folder / ('%s_postQ.sqlite' % id),
+            post_time_file=poster_folder / ('%s_last_post_time' % id),
+            post_batch_size=bmon_info.get('post_batch_size', 10),
+            journal_mode=bmon_info.get('journal_mode'),
+            synchronous=bmon_info.get('synchronous'),
+            gzip_posts=bmon_info.get('gzip', False),
+            max_post_readings=bmon_info.get('max_post_readings', 1000),
+            max_post_bytes=bmon_info.get('max_post_bytes', 100000),
+            bmon_id=id,
+            breaker_failures=bmon_info.get('breaker_failures', 3),
+            probe_interval=bmon_info.get('breaker_probe_interval', 10.0),
+            burst_concurrency=bmon_info.get('burst_concurrency'),
+            reject_limit=bmon_info.get('reject_limit', 3),
+        )
+        limit_keys = ('queue_max_items', 'queue_max_bytes', 'queue_max_age')
+        if any(bmon_info.get(ky) is not None for ky in limit_keys):
+            poster_params['queue_limits'] = dict(
+                max_items=bmon_info.get('queue_max_items'),
+                max_bytes=bmon_info.get('queue_max_bytes'),
+                max_age=bmon_info.get('queue_max_age'),
+                policy=bmon_info.get('queue_full_policy', 'block'),
+                spill_dir=poster_folder / ('%s_spill' % id),
+            )
+        if bmon_info.get('engine', 'thread') == 'async':
+            # only import the asyncio poster, and its aiohttp dependency, if used.
+            from poster.asyncPoster import AsyncHttpPoster
+            posters[id] = AsyncHttpPoster(bmon_info['url'],
+                                          max_concurrency=bmon_info.get('max_concurrency', 10),
+                                          **poster_params)
         else:
-            raise TypeError('Invalid extension for configuration file.')
+            posters[id] = HttpPoster(bmon_info['url'],
+                                     post_thread_count=bmon_info.get('post_thread_count', 1),
+                                     pool_size=bmon_info.get('pool_size'),
+                                     **poster_params)
 
-    else:
-        # No mapping file so use empty dictionary.
-        id_to_bmon = {}
+def load_sensor_mapping(config, force_refresh=False):
+    """Returns a SensorMapping object holding the dictionary that maps sensor IDs
+    to BMON server IDs.  A local snapshot of the mapping is used if it is still valid,
+    unless 'force_refresh' is True.
+    """
+    mapping = SensorMapping(config, 
+                            poster_folder / 'sensor_to_bmon_snapshot.json',
+                            ttl=config.get('sensor_mapping_ttl', 3600))
+    mapping.load(force_refresh)
+    return mapping
 
-except:
-    logging.exception('Error in Script Initialization.')
-    sys.exit()
+def make_reader(src):
+    """Returns a Reader object for one of the 'file_sources' entries in the configuration
+    file, 'src'.
+    """
+    # Extract the reader to use with this set of files; the remaining entries
+    # are passed to the Reader.
+    src = src.copy()
+    reader_name = src.pop('reader')
 
-# Loop through file sources
-for src in config['file_sources']:
+    # Dynamically import the module containing the reader class
+    mod = importlib.import_module(f'readers.{reader_name}')
 
+    # Determine Dry-Run status.  If setting is not present, then not
+    # a dry run.
+    if 'dry_run' in config:
+        dry_run = config['dry_run']
+    else:
+        dry_run = False
+    
+    # develop a dictionary of the constructor parameters for the
+    # reader class, some of which come from the config file.  The checkpoint
+    # and dedup files are only used if the source turns on the 'checkpoint'
+    # or 'dedup' setting.
+    reader_params = {
+        'id_to_bmon': id_to_bmon,
+        'posters': posters,
+        'dry_run': dry_run,
+        'checkpoint_file': poster_folder / 'file_checkpoints.sqlite',
+        'dedup_file': poster_folder / 'high_water_marks.sqlite',
+    }
+    reader_params.update(src)
+
+    # pass parameters as keyword arguments to the Reader class within
+    # the imported module.
+    return mod.Reader(**reader_params)
+
+def process_source(src):
+    """Loads the files from one of the 'file_sources' entries in the configuration
+    file, 'src'.
+    """
     try:
-        # Extract the reader to use with this set of files and then
-        # delete it from the dictionary
-        reader_name = src['reader']
-        del src['reader']
-
-        # Dynamically import the module containing the reader class
-        mod = importlib.import_module(f'readers.{reader_name}')
-
-        # Determine Dry-Run status.  If setting is not present, then not
-        # a dry run.
-        if 'dry_run' in config:
-            dry_run = config['dry_run']
-        else:
-            dry_run = False
-        
-        # develop a dictionary of the constructor parameters for the
-        # reader class, some of which come from the config file.
-        reader_params = {
-            'id_to_bmon': id_to_bmon,
-            'posters': posters,
-            'dry_run': dry_run,
-        }
-        reader_params.update(src)
-
-        # pass parameters as keyword arguments to the Reader class within
-        # the imported module.
-        reader_obj = mod.Reader(**reader_params)
+        reader_obj = make_reader(src)
         reader_obj.load()     # process the files
 
     except:
         logging.exception(f'Error processing {src["pattern"]}')
 
-# wait until all BMON posters finish their work or stop
-# making progress on posting.
-for poster in posters.values():
-    poster.wait_until_done()
+def write_metrics():
+    """Writes the pipeline metrics to the 'metrics_file' given in the configuration
+    file, if any.  A relative path is relative to the folder holding the configuration
+    file.
+    """
+    if config.get('metrics_file'):
+        try:
+            metrics.write(config_folder / config['metrics_file'])
+        except:
+            logging.exception('Error writing metrics file.')
+
+def run_once():
+    """Processes the files that are present in each file source, and waits for the
+    readings to be posted.
+    """
+    # Loop through file sources.  If 'max_workers' is present in the config file,
+    # that many file sources are processed concurrently.  Posters are thread-safe, so
+    # all of the sources share them.  The sources are threads in one process, so
+    # their parsing is serialized by the GIL; the gain comes from overlapping I/O.
+    max_workers = config.get('max_workers', 1)
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(process_source, config['file_sources']))
+    else:
+        for src in config['file_sources']:
+            process_source(src)
+
+    # wait until all BMON posters finish their work, stop making progress on posting,
+    # or the maximum wait time passes.  Any unposted readings remain in the posting
+    # queues and are posted the next time the script runs.
+    wait_all(posters.values(), 
+             timeout=config.get('post_wait_timeout', 600), 
+             stall_time=config.get('post_stall_time', 30))
+    write_metrics()
+
+# Flags set by signal handlers in daemon mode
+reload_requested = False
+stop_requested = False
+
+def request_reload(signum, frame):
+    global reload_requested
+    reload_requested = True
+
+def request_stop(signum, frame):
+    global stop_requested
+    stop_requested = True
+
+def run_daemon():
+    """Keeps processing files as they arrive in the file source directories until
+    a SIGTERM or SIGINT signal is received.  A SIGHUP signal reloads the
+    configuration file and the sensor mapping.
+    """
+    global config, sensor_mapping, id_to_bmon, reload_requested
+
+    signal.signal(signal.SIGHUP, request_reload)
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    # serve the pipeline metrics over HTTP, if requested.
+    if config.get('metrics_port'):
+        metrics.serve(config['metrics_port'])
+
+    readers = None
+    watcher = None
+    last_cleanup = time.time()
+    while not stop_requested:
+        try:
+            if reload_requested:
+                reload_requested = False
+                logging.info('Reloading configuration.')
+                config = load_config()
+                make_posters(config, posters)
+                sensor_mapping = load_sensor_mapping(config, force_refresh=True)
+                id_to_bmon = sensor_mapping.id_to_bmon
+                readers = None
+
+            if readers is None:
+                # Make a Reader for each file source, which are kept between passes,
+                # and watch the directories of the file sources.
+                readers = []
+                for src in config['file_sources']:
+                    try:
+                        readers.append(make_reader(src))
+                    except:
+                        logging.exception(f'Error setting up {src["pattern"]}')
+                if watcher:
+                    watcher.close()
+                watcher = DirectoryWatcher({r.file_dir for r in readers},
+                                           config.get('daemon_poll_interval', 5))
+
+            # Process files that have not been modified for 'daemon_settle_time'
+            # seconds, so files that are still being written are not processed.
+            settle_time = config.get('daemon_settle_time', 5)
+            files_waiting = False
+            for reader in readers:
+                try:
+                    ready, waiting = reader.find_files(settle_time)
+                    files_waiting = files_waiting or waiting > 0
+                    if ready:
+                        reader.load(ready)
+                except:
+                    logging.exception(f'Error processing {reader.pattern}')
+
+            write_metrics()
+
+            # Pick up changes to the sensor mapping.
+            sensor_mapping.refresh_if_stale()
+
+            # Clean out old files in the completed directories once an hour.
+            if time.time() - last_cleanup > 3600:
+                for reader in readers:
+                    reader.clean_completed()
+                last_cleanup = time.time()
+
+            # Wait for new files.  If files are waiting to settle, check again
+            # after the settle time.
+            timeout = settle_time if files_waiting else config.get('daemon_poll_interval', 5)
+            watcher.wait(timeout)
+
+        except:
+            logging.exception('Error in daemon loop.')
+            time.sleep(5)
+
+    logging.info('Stopping daemon.')
+    wait_all(posters.values(), 
+             timeout=config.get('post_wait_timeout', 600), 
+             stall_time=config.get('post_stall_time', 30))
+    write_metrics()
+
+try:
+    config = load_config()
+except:
+    logging.exception('Error in Reading Configuration File.')
+    sys.exit()
+
+try:
+    logging.info('Started file processing.')
+
+    # start BMON posters and put in a dictionary
+    posters = {}
+    make_posters(config, posters)
+
+    # Make a dictionary mapping sensor IDs to BMON server IDs.
+    sensor_mapping = load_sensor_mapping(config)
+    id_to_bmon = sensor_mapping.id_to_bmon
+
+except:
+    logging.exception('Error in Script Initialization.')
+    sys.exit()
+
+if daemon_mode:
+    run_daemon()
+else:
+    run_once()
@@ -0,0 +1,140 @@
+"""Classes used when a Reader's 'archive' option is True.  Instead of a separate
+'completed' and 'errors' file for each processed file, the lines are written in large
+buffered pieces to a compressed part file, which is appended to a daily archive
+segment when the file is finished.  Segments are named 'archive_YYYY-MM-DD.gz' (or
+'.zst'), and each segment has an index file, 'archive_YYYY-MM-DD.idx', with one line
+per processed file:
+
+    <path of processed file>,<byte offset in segment>,<bytes>,<number of lines>
+
+Each processed file's lines start at the recorded offset as one or more complete
+gzip members (or zstd frames), so they can be extracted without decompressing the
+rest of the segment.  The whole segment can also be read with gzip or zstd tools.
+Old archives are removed by deleting whole segments, based on the date in the name.
+"""
+import os
+import gzip
+import shutil
+import threading
+from datetime import date, timedelta
+
+# Compression formats available for archives, with the suffix of the segment files.
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+class ArchivePart:
+    """A file-like object that holds the compressed 'completed' or 'errors' lines of
+    one processed file until the file is finished.  Text or bytes written to it are
+    buffered and compressed in large pieces.  flush() ends the current gzip member or
+    zstd frame, so the size returned by tell() after a flush is a point the part file
+    can be truncated to, as is done when resuming from a checkpoint.
+    """
+
+    def __init__(self, path, mode='w', compression='gzip', buffer_size=1000000):
+        """'path' is the path to the part file, and 'mode' is 'w' to create a new file
+        or 'a' to append to an existing one.  'compression' is 'gzip' or 'zstd'.  Text
+        is compressed once 'buffer_size' bytes are buffered.
+        """
+        self.raw = open(path, mode + 'b')
+        self.compression = compression
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.stream = None      # compressing writer for the current member / frame
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.buffer_size:
+            self._write_buffer()
+
+    def _write_buffer(self):
+        if not self.buffer:
+            return
+        if self.stream is None:
+            if self.compression == 'zstd':
+                import zstandard
+                self.stream = zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+            else:
+                self.stream = gzip.GzipFile(fileobj=self.raw, mode='wb', compresslevel=6)
+        self.stream.write(b''.join(self.buffer))
+        self.buffer = []
+        self.buffered = 0
+
+    def flush(self):
+        """Compresses any buffered text and ends the current member or frame.
+        """
+        self._write_buffer()
+        if self.stream is not None:
+            self.stream.close()     # does not close the part file
+            self.stream = None
+        self.raw.flush()
+
+    def tell(self):
+        """Returns the size of the part file.  Only a valid truncation point after
+        flush().
+        """
+        return self.raw.tell()
+
+    def truncate(self, size):
+        self.raw.truncate(size)
+        self.raw.seek(size)
+
+    def close(self):
+        self.flush()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchiveWriter:
+    """Appends finished part files to the daily archive segments in one directory.
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self, directory, compression='gzip'):
+        """'directory' is the directory holding the segments.  'compression' is 'gzip'
+        or 'zstd'.
+        """
+        if compression not in SUFFIXES:
+            raise ValueError(f'Invalid archive compression: {compression}')
+        self.directory = directory
+        self.compression = compression
+        self.lock = threading.Lock()
+
+    def segment_paths(self, day):
+        """Returns the paths of the segment and index files for the date 'day'.
+        """
+        stem = f'archive_{day:%Y-%m-%d}'
+        return (self.directory / (stem + SUFFIXES[self.compression]),
+                self.directory / (stem + '.idx'))
+
+    def add(self, part_path, source_fn, line_count):
+        """Appends the part file 'part_path', holding 'line_count' lines from the
+        processed file 'source_fn', to today's segment, indexes it, and deletes the
+        part file.
+        """
+        seg_path, idx_path = self.segment_paths(date.today())
+        with self.lock:
+            with open(part_path, 'rb') as part, open(seg_path, 'ab') as seg:
+                offset = seg.tell()
+                shutil.copyfileobj(part, seg, 1024 * 1024)
+                length = seg.tell() - offset
+            with open(idx_path, 'a') as idx:
+                idx.write(f'{source_fn},{offset},{length},{line_count}\n')
+        os.unlink(part_path)
+
+    def remove_old(self, retention_days):
+        """Deletes the segments, and their indexes, for dates more than 'retention_days'
+        days ago.
+        """
+        cutoff = f'archive_{date.today() - timedelta(days=retention_days):%Y-%m-%d}'
+        for path in self.directory.glob('archive_????-??-??.*'):
+            if path.name[:18] < cutoff:
+                path.unlink()
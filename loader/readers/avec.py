@@ -5,16 +5,20 @@ converts the raw XML meter files from AVEC into CSV files.
 from .base_reader import BaseReader
 
 class Reader(BaseReader):
+
+    binary_lines = True
+    columnar = True
     
     def read_header(self, fobj, file_name):
         # There are no header lines in the file
         return []
 
-    def parse_line(self, lin):
+    def parse_columns(self, rows):
 
-        # there is one reading per line, fields are separated by commas.
-        meter_sn, ts, kw = lin.split(',')
-        ts = float(ts)
-        kw = float(kw)
+        # there is one reading per line: meter serial number, timestamp, kW.
+        if set(map(len, rows)) != {3}:
+            raise ValueError('Lines must have three fields.')
+        meter_sns, ts, kw = zip(*rows)
+        sensor_ids = [f'avec_{meter_sn.strip()}' for meter_sn in self.text_column(meter_sns)]
 
-        return [(ts, f'avec_{meter_sn.strip()}', kw)]
+        return list(map(float, ts)), sensor_ids, list(map(float, kw))
@@ -3,21 +3,68 @@ Readers.  File Readers parse sensor readings from files.  Files of different
 format require different File Readers.
 """
 from pathlib import Path
+import os
 from datetime import datetime
 import logging
 import time
 import calendar
 from glob import glob
+import threading
+import csv
+from concurrent.futures import ThreadPoolExecutor
 
 import pytz
 
+from .timestamps import TimestampConverter
+from .checkpoint import FileCheckpoints, Checkpoint, FINISHED
+from .dedup import HighWaterMarks
+from .archive import ArchivePart, ArchiveWriter
+from .xlsx import XlsxRows
+from .buffer import ReadingBuffer
+from .compressed import detect_compression, zip_members, uncompressed_name, open_file
+from metrics import REGISTRY as metrics
+from poster.queue_limits import QueueFullError
+
+# Seconds before find_files() returns an unchanged file that could not be loaded again.
+FAILED_RETRY_TIME = 3600.0
+
 class BaseReader:
     """The base class for File Readers.  An actual File Reader must subclass
     this base class and implement the read_header() and parse_line() methods.
+    Instead of parse_line(), a Reader for files with one reading in each line can
+    implement the parse_columns() method, which parses whole blocks of lines at once.
     """
+
+    # A Reader subclass with 'columnar' True can set this to True to have its files 
+    # read as bytes in large pieces.  The lines are split and parsed as bytes, and 
+    # written to the 'completed' and 'errors' files without decoding them, so only the
+    # fields that parse_columns() decodes are decoded.  Can be set to False with a 
+    # file source setting in the configuration file.
+    binary_lines = False
+
+    # A Reader subclass that implements parse_row() sets this to True, so its files
+    # are split into rows of fields by one csv.reader per file, using 'csv_dialect'
+    # (a dialect name or csv.Dialect subclass).  Takes precedence over 'binary_lines'.
+    row_mode = False
+    csv_dialect = 'excel'
+
+    # A Reader subclass that implements parse_xlsx_row() sets this to True, so files
+    # ending in '.xlsx' are read directly, one worksheet row at a time.  See the xlsx
+    # module.  Other files are read as text.
+    xlsx_input = False
+
+    # A Reader subclass for files with one reading in each line can implement
+    # parse_columns() and set this to True, so blocks of lines are parsed at once
+    # instead of one line at a time.  Lines are split into fields at 'field_sep'.
+    columnar = False
+    field_sep = ','
     
     def __init__(self, pattern, posters, dry_run=False, id_to_bmon={}, default_bmon=None, 
-                chunk_size=300, time_zone='US/Alaska', file_retention=3, **kw):
+                chunk_size=300, time_zone='US/Alaska', file_retention=3, max_workers=1, 
+                block_size=1000, checkpoint=False, checkpoint_file=None, 
+                checkpoint_interval=10000, dedup=False, dedup_file=None, archive=False, 
+                archive_compression='gzip', archive_buffer_size=1000000, read_size=4000000, 
+                **kw):
         """Constructor for BaseReader.
 
         Input Parameters:
@@ -31,7 +78,8 @@ class BaseReader:
               be '{BMON id}.txt'. Also, when 'dry_run' is True, no files will be deleted,
               including the processed files and old files in the completed directory.
           id_to_bmon: a dictionary that maps sensors ID values to the destination BMON
-              system, which is identified with a BMON id.
+              system, which is identified with a BMON id.  Any object with the get()
+              method of a dictionary can be used, such as a SensorRouter.
           default_bmon: the ID of the BMON system where a sensor reading should go if
               the sensor ID is not in the id_to_bmon dictionary.  If the sensor ID is
               not in the id_to_bmon dictionary AND this default_bmon is not provided,
@@ -46,6 +94,31 @@ class BaseReader:
           file_retention: lines from the file that are successfully parsed are added to 
               a file in the 'completed' directory.  These files in the completed directory
               are deleted when they become older than 'file_retention' days.
+          max_workers: the number of threads used to process the files matching 'pattern'
+              concurrently.  The default of 1 processes the files one at a time.  Parsing
+              is Python code that holds the GIL, so more threads only help while files
+              are waiting on I/O, such as reading, decompressing, or a full posting queue.
+          block_size: the number of lines that are passed to parse_lines() at one time.
+          checkpoint: if True, how far processing has progressed in each file is
+              recorded, so an interrupted run can resume where it left off instead of
+              reposting the readings from the start of the file.  No checkpoints are
+              saved in a dry run.
+          checkpoint_file: path to the SQLite database that holds the checkpoints.
+              Must be provided if 'checkpoint' is True.
+          checkpoint_interval: the approximate number of lines processed between
+              checkpoints.
+          dedup: if True, readings that are not newer than the newest reading posted
+              for the sensor before the current run are skipped.  See the dedup module.
+          dedup_file: path to the SQLite database holding the timestamp of the newest
+              posted reading for each sensor.  Must be provided if 'dedup' is True.
+          archive: if True, the completed and error lines are written to compressed, 
+              daily archive files instead of a 'completed' and 'errors' file for each
+              processed file.  See the archive module.
+          archive_compression: 'gzip', or 'zstd' if the zstandard package is installed.
+          archive_buffer_size: the number of bytes of lines buffered before they
+              are compressed and written to an archive.
+          read_size: the number of bytes read from a file at one time, for Readers
+              with 'binary_lines' True.
           **kw:  other keyword arguments can be passed to the constructor for use by 
               the subclass Reader. They are stored as object attributes.
         """
@@ -58,7 +131,20 @@ class BaseReader:
         self.default_bmon = default_bmon
         self.chunk_size = chunk_size
         self.time_zone = pytz.timezone(time_zone)    # convert to timezone object
+        self.ts_converter = TimestampConverter(self.time_zone)
         self.file_retention = file_retention
+        self.max_workers = max_workers
+        self.block_size = block_size
+        self.read_size = read_size
+        self.checkpoint_interval = checkpoint_interval
+        if checkpoint and checkpoint_file and not dry_run:
+            self.checkpoints = FileCheckpoints(checkpoint_file)
+        else:
+            self.checkpoints = None
+        if dedup and dedup_file:
+            self.dedup = HighWaterMarks(dedup_file)
+        else:
+            self.dedup = None
 
         # Store all extra keyword arguments as object attributes
         for ky, val in kw.items():
@@ -67,148 +153,608 @@ class BaseReader:
         # save the directory where the files are located as a Path
         self.file_dir = Path(pattern).parent
 
+        # file name -> (modification time, time of the failure) of the files that
+        # could not be loaded, which are left in place.
+        self.failed_files = {}
+
+        # labels identifying this Reader in the pipeline metrics
+        self.metric_labels = {'reader': self.__module__.split('.')[-1], 'source': pattern}
+
         # create subdirectories under file source to hold completed readings
         # and error readings.
         (self.file_dir / 'completed').mkdir(exist_ok=True)
         (self.file_dir / 'errors').mkdir(exist_ok=True)
         (self.file_dir / 'debug').mkdir(exist_ok=True)  # for dry run files
 
+        # Writers that add the lines of each processed file to the archives
+        self.archive_buffer_size = archive_buffer_size
+        if archive:
+            self.archives = {
+                'completed': ArchiveWriter(self.file_dir / 'completed', archive_compression),
+                'errors': ArchiveWriter(self.file_dir / 'errors', archive_compression),
+            }
+        else:
+            self.archives = None
+
         # Clean out old files in completed directory
-        if not dry_run:
-            max_age = file_retention * 24. * 3600.    # seconds
-            for f_path in (self.file_dir / 'completed').glob('*'):
-                if time.time() - f_path.stat().st_mtime > max_age:
-                    f_path.unlink()
+        self.clean_completed()
 
         # If a Dry Run, clean out the files in the Debug directory
         if dry_run:
             for p in (self.file_dir / 'debug').glob('*'):
                 p.unlink()
 
-    def load(self):
-        """Called to start the processing of files.
+    def clean_completed(self):
+        """Deletes files in the completed directory that are older than 'file_retention'
+        days, unless it is a dry run.
+        """
+        if self.archives:
+            # whole archive segments are deleted, without examining each file.
+            if not self.dry_run:
+                self.archives['completed'].remove_old(self.file_retention)
+        elif not self.dry_run:
+            max_age = self.file_retention * 24. * 3600.    # seconds
+            for f_path in (self.file_dir / 'completed').glob('*'):
+                if time.time() - f_path.stat().st_mtime > max_age:
+                    f_path.unlink()
+
+    def find_files(self, min_age=0):
+        """Returns a two-tuple: a list of the files matching the pattern that were last
+        modified at least 'min_age' seconds ago, and the number of matching files that
+        were modified more recently, which may still be being written.  Files that could
+        not be loaded are left out until they change or FAILED_RETRY_TIME seconds pass.
+        """
+        ready = []
+        waiting = 0
+        now = time.time()
+        with metrics.timer('glob', **self.metric_labels):
+            file_names = sorted(glob(self.pattern))
+        for fn in file_names:
+            try:
+                mtime = os.stat(fn).st_mtime
+                failed = self.failed_files.get(fn)
+                if failed and failed[0] == mtime and now - failed[1] < FAILED_RETRY_TIME:
+                    continue    # an unchanged file that could not be loaded recently
+                if now - mtime >= min_age:
+                    ready.append(fn)
+                else:
+                    waiting += 1
+            except FileNotFoundError:
+                pass     # file was removed after the glob
+        return ready, waiting
+
+    def load(self, file_names=None):
+        """Called to start the processing of files.  'file_names' is a list of the
+        files to process; if None, all files matching the pattern are processed.  If 
+        'max_workers' is greater than 1, the files are processed concurrently by a pool
+        of that many threads.  The files are started in order of their names, so the 
+        order does not depend on the directory listing.  If the posting queue of a BMON
+        server is full and uses the 'fail' policy, loading stops and the unfinished 
+        files are left for a later run.
         """
 
-        # Create list buffers for the poster object to accumulate records 
-        # before posting.
-        rd_buffer = {}
+        # Create buffers for the poster object to accumulate records 
+        # before posting.  The buffers are shared by all of the files being
+        # processed, so access to them is guarded by a lock.
+        self.rd_buffer = {}
         for bmon_id, _ in self.posters.items():
-            rd_buffer[bmon_id] = []
+            self.rd_buffer[bmon_id] = ReadingBuffer()
+        self.buffer_lock = threading.Lock()
+
+        # the files of this run are screened against the high-water marks as they
+        # are now, so the order the files are finished in does not matter.
+        if self.dedup:
+            self.dedup.start_run()
+
+        if file_names is None:
+            with metrics.timer('glob', **self.metric_labels):
+                file_names = glob(self.pattern)
+        file_names = sorted(file_names)
+        try:
+            if self.max_workers > 1 and len(file_names) > 1:
+                # threads overlap the I/O waits of the files, but the parsing itself
+                # is serialized by the GIL.
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    # consume the results so that the pool finishes before the final
+                    # post of the buffers.  load_file() handles its own errors, other
+                    # than a full posting queue.
+                    list(executor.map(self.load_file, file_names))
+            else:
+                for fn in file_names:
+                    self.load_file(fn)
+
+            # Send remaining readings to BMON poster
+            self.post_buffer(flush=True)
+
+        except QueueFullError as e:
+            logging.error(f'{e}  Stopped loading {self.pattern}; unfinished files are left '
+                          'for a later run.')
+
+        except:
+            # the readings left in the buffers came from files that were left in place,
+            # as each finished file's readings were queued before it was deleted.
+            logging.exception(f'Error queueing the readings of {self.pattern}; the files '
+                              'they came from are left for a later run.')
+
+    def post_buffer(self, flush=False):
+        """Posts the readings in the reading buffers in chunks of 'chunk_size'
+        readings.  Readings left over that do not fill a chunk stay in the buffer
+        unless 'flush' is True, in which case they are posted as well.
+        """
+        with metrics.timer('post_buffer', **self.metric_labels), self.buffer_lock:
+            for bmon_id, buf in self.rd_buffer.items():
 
-        def post_buffer(min_post_size=1):
-            """Posts the readings in the reading buffers if the reading count
-            exceeds 'min_post_size'.  Also resets buffer if records are posted.
-            """
-            for bmon_id, buf in rd_buffer.items():
+                if len(buf) < self.chunk_size and not (flush and buf):
+                    continue
 
-                if len(buf) >= min_post_size:
+                # take the readings from the buffer in chunks, leaving a partial
+                # chunk at the end in the buffer unless flushing.
+                chunks = buf.take_chunks(self.chunk_size, flush)
 
-                    if self.dry_run:
-                        with open(self.file_dir / 'debug' / f'{bmon_id}.txt', 'a') as fout:
-                            for rd in buf:
+                if self.dry_run:
+                    with open(self.file_dir / 'debug' / f'{bmon_id}.txt', 'a') as fout:
+                        for chunk in chunks:
+                            for rd in chunk:
                                 print(rd, file=fout)
-                    else:
-                        self.posters[bmon_id].add_readings(buf)
+                else:
+                    # all of the chunks are added to the posting queue in one transaction
+                    try:
+                        self.posters[bmon_id].add_readings_many(chunks)
+                    except:
+                        # keep the readings, e.g. if the queue is full.  The error stops
+                        # the files they came from being finished and deleted.
+                        buf.put_back(chunks)
+                        raise
+
+    def load_file(self, fn):
+        """Processes one file, 'fn', posting its readings and writing the 'completed'
+        and 'errors' files for it.  Safe to call from multiple threads at once.
+        If checkpoints are being saved and a checkpoint exists for the file from an
+        earlier, interrupted run, processing resumes at the checkpoint.  Files
+        compressed with gzip, bzip2 or xz are decompressed as they are read, and each 
+        member of a zip file is processed as a separate file.  See the compressed module.
+        The file is only deleted once all of its readings are in the posting queues; if
+        there is an error, it is left in place for a later run.
+        """
+        try:
+            compression = detect_compression(fn)
+            members = zip_members(fn) if compression == 'zip' else [None]
+        except:
+            logging.exception(f'Error processing {fn}; it is left for a later run.')
+            self.record_failure(fn)
+            return
+
+        # every member is loaded, even after an error in one of them.
+        results = [self.load_input(fn, compression, member) for member in members]
+        if not all(results):
+            self.record_failure(fn)
+            return
+        self.failed_files.pop(fn, None)
+
+        # delete the processed file, unless it is a dry run
+        if not self.dry_run:
+            Path(fn).unlink()
+            if self.checkpoints:
+                self.checkpoints.remove(fn)
+                if compression == 'zip':
+                    for member in members:
+                        self.checkpoints.remove(fn, member)
+
+    def record_failure(self, fn):
+        """Records that the file 'fn' could not be loaded, so find_files() does not
+        return it again until it changes or FAILED_RETRY_TIME seconds pass.
+        """
+        try:
+            self.failed_files[fn] = (os.stat(fn).st_mtime, time.time())
+        except OSError:
+            pass
+
+    def load_input(self, fn, compression=None, member=None):
+        """Processes the file 'fn', or the member named 'member' of the zip file 'fn', 
+        as described in load_file().  'compression' is the compression format of the 
+        file, as returned by compressed.detect_compression().  The file is not deleted.
+        Returns True if all of the readings were added to the posting queues, or False
+        if there was an error.
+        """
+        # the name of the file for messages and the Reader, and the name used for the
+        # output files, without the compression suffix.
+        if member is None:
+            name = fn
+            out_name = uncompressed_name(fn, compression)
+        else:
+            name = f'{fn}/{member}'
+            member_path = Path(member)
+            out_name = f'{Path(fn).stem}_{member_path.stem}{member_path.suffix}'
+
+        # track error lines and successful lines in this file.
+        error_ct = 0
+        success_ct = 0
+
+        # screens out readings posted by earlier runs, if enabled.
+        file_filter = self.dedup.start_file() if self.dedup else None
+
+        # Excel files are read as rows of cell values instead of lines of text.
+        xlsx = self.xlsx_input and out_name.lower().endswith('.xlsx')
+
+        finished = True
+        try:
+
+            cp = self.checkpoints.get(fn, member) if self.checkpoints else None
+            if cp and cp.offset == FINISHED:
+                # a zip member loaded by an earlier run that stopped before the
+                # whole zip file was finished.
+                logging.info(f'Skipping {name}, which was already loaded.')
+                return True
+
+            if xlsx:
+                fin = XlsxRows(open_file(fn, compression, member, binary=True))
+            else:
+                fin = open_file(fn, compression, member)
+            with fin:
+
+                # get the header lines from the file, and also reassemble into
+                # a string.
+                with metrics.timer('header', **self.metric_labels):
+                    header_lines = self.read_header(fin, name)
+                header_str = ''.join(header_lines)    # /n are already at end of lines
+
+                # Make Paths for both error lines and completed lines
+                f_path = Path(out_name)
+                if xlsx:
+                    # the rows are written to the output files as CSV lines.
+                    f_path = f_path.with_suffix('.csv')
+                f_err_path = self.file_dir / 'errors' / (f_path.stem + '_err' + f_path.suffix)
+                f_ok_path = self.file_dir / 'completed' / (f_path.stem + '_ok' + f_path.suffix)
+                if self.archives:
+                    # compressed part files that are added to the archives when the
+                    # file is finished.
+                    f_err_path = f_err_path.with_name(f_err_path.name + '.part')
+                    f_ok_path = f_ok_path.with_name(f_ok_path.name + '.part')
+
+                # See if there is a checkpoint to resume from.  If so, skip to that 
+                # point in the file, and append to the error and completed files after 
+                # removing anything written after the checkpoint.
+                if cp and f_err_path.exists() and f_ok_path.exists():
+                    fin.seek(cp.offset)
+                    line_count = cp.line_count
+                    success_ct = cp.success_ct
+                    error_ct = cp.error_ct
+                    open_mode = 'a'
+                    logging.info(f'Resuming {name} at line {line_count} after the header.')
+                else:
+                    cp = None
+                    line_count = 0
+                    open_mode = 'w'
+
+                # the lines of binary files are written to the output files as bytes.
+                binary = self.binary_lines and self.columnar and not (xlsx or self.row_mode)
+                with self.open_output(f_err_path, open_mode, binary) as f_err, \
+                        self.open_output(f_ok_path, open_mode, binary) as f_ok:
                     
-                    rd_buffer[bmon_id] = []  # reset buffer
-
+                    if cp:
+                        f_err.truncate(cp.err_bytes)
+                        f_ok.truncate(cp.ok_bytes)
+                    elif header_str.strip():
+                        # Write the header lines into each file
+                        header = header_str.encode('utf-8') if binary else header_str
+                        f_err.write(header)
+                        f_ok.write(header)
+
+                    # process the lines in blocks, checkpointing between blocks.
+                    if xlsx:
+                        blocks = self.read_xlsx_blocks(fin)
+                    elif self.row_mode:
+                        blocks = self.read_row_blocks(fin)
+                    elif binary:
+                        blocks = self.read_byte_blocks(
+                            open_file(fn, compression, member, binary=True), fin.tell())
+                    else:
+                        blocks = self.read_text_blocks(fin)
+                    checkpoint_line = line_count
+                    for lines, rows, raw_count, offset in blocks:
+                        line_count += raw_count
+                        if lines:
+                            ok_ct, err_ct = self.load_block(lines, f_ok, f_err, file_filter, 
+                                                            rows, xlsx)
+                            success_ct += ok_ct
+                            error_ct += err_ct
+                        if self.checkpoints and \
+                                line_count - checkpoint_line >= self.checkpoint_interval:
+                            new_cp = Checkpoint(offset, line_count, success_ct, error_ct, 0, 0)
+                            self.save_checkpoint(fn, new_cp, f_ok, f_err, member)
+                            checkpoint_line = line_count
+                            if file_filter:
+                                file_filter.commit()
+
+                # The high-water marks can only be raised, and the file deleted, once
+                # all of its readings are in the posting queues.  The marks are left
+                # alone in a dry run.
+                if not self.dry_run:
+                    self.post_buffer(flush=True)
+                    if file_filter:
+                        file_filter.commit()
+
+                # if the error and success files have nothing in them, remove them.
+                if error_ct == 0:
+                    f_err_path.unlink()
+                if success_ct == 0:
+                    f_ok_path.unlink()
+
+                if self.archives:
+                    if error_ct:
+                        self.archives['errors'].add(f_err_path, name, error_ct)
+                    if success_ct:
+                        self.archives['completed'].add(f_ok_path, name, success_ct)
+
+                # record that a zip member is finished, in case the run stops before 
+                # the rest of the members are loaded.
+                if member is not None and self.checkpoints:
+                    self.checkpoints.save(fn, Checkpoint(FINISHED, line_count, success_ct,
+                                                         error_ct, 0, 0), member)
+
+
+        except QueueFullError:
+            # stop loading the source, leaving this file in place.
+            raise
+
+        except:
+            logging.exception(f'Error processing {name}; it is left for a later run.')
+            finished = False
+
+        metrics.inc('file_to_bmon_files_total', **self.metric_labels)
+        if file_filter:
+            logging.info(f'Processed {name}: {success_ct} successful lines, '
+                         f'{error_ct} error lines, {file_filter.skipped} previously posted '
+                         'readings skipped.')
+        else:
+            logging.info(f'Processed {name}: {success_ct} successful lines, '
+                         f'{error_ct} error lines.')
+        return finished
+
+    def read_text_blocks(self, fin):
+        """Reads the lines of the text file object 'fin' from its current position,
+        and yields them in blocks of up to 'block_size' lines.  Yields four-tuples:
+        (list of non-blank lines stripped of whitespace, None, the number of lines 
+        read including blank lines, the file position after the block).  readline()
+        is used instead of iterating the file so the file position is available for
+        checkpoints.
+        """
+        lines = []
+        raw_count = 0
+        for lin in iter(fin.readline, ''):
+            raw_count += 1
+            lin = lin.strip()
+            if len(lin) == 0:
+                continue
+            lines.append(lin)
+            if len(lines) >= self.block_size:
+                yield lines, None, raw_count, fin.tell()
+                lines = []
+                raw_count = 0
+        if lines or raw_count:
+            yield lines, None, raw_count, fin.tell()
+
+    def read_row_blocks(self, fin):
+        """Splits the text file object 'fin', from its current position, into rows of 
+        fields with one csv.reader, and yields them in blocks of up to 'block_size' rows.
+        Yields four-tuples: (list of the text of the non-blank rows stripped of 
+        whitespace, list of the rows' lists of fields, the number of lines read 
+        including blank lines, the file position after the block).  The text of each
+        row is kept for the 'completed' and 'errors' files.
+        """
+        raw_lines = []          # the text of the row being parsed by the csv.reader
+
+        def line_source():
+            for lin in iter(fin.readline, ''):
+                raw_lines.append(lin)
+                yield lin
+
+        lines = []
+        rows = []
+        raw_count = 0
+        for fields in csv.reader(line_source(), self.csv_dialect):
+            # a row may span several lines if a quoted field holds a newline.
+            raw_count += len(raw_lines)
+            text = raw_lines[0] if len(raw_lines) == 1 else ''.join(raw_lines)
+            raw_lines.clear()
+            if not fields:
+                continue        # blank line
+            lines.append(text.strip())
+            rows.append(fields)
+            if len(lines) >= self.block_size:
+                yield lines, rows, raw_count, fin.tell()
+                lines = []
+                rows = []
+                raw_count = 0
+        if lines or raw_count:
+            yield lines, rows, raw_count, fin.tell()
+
+    def read_xlsx_blocks(self, fin):
+        """Reads the rows of the XlsxRows object 'fin' from its current position, and
+        yields them in blocks of up to 'block_size' rows.  Yields four-tuples: (list of 
+        the rows as CSV lines, without newlines, list of the rows' tuples of cell values,
+        the number of rows read including empty rows, the row position after the block).
+        """
+        lines = []
+        rows = []
+        raw_count = 0
+        for row in iter(fin.next_row, None):
+            raw_count += 1
+            if all(val is None for val in row):
+                continue        # empty row
+            lines.append(fin.row_text(row).strip())
+            rows.append(row)
+            if len(lines) >= self.block_size:
+                yield lines, rows, raw_count, fin.tell()
+                lines = []
+                rows = []
+                raw_count = 0
+        if lines or raw_count:
+            yield lines, rows, raw_count, fin.tell()
+
+    def read_byte_blocks(self, fbin, start):
+        """Reads the binary file object 'fbin' in large pieces starting at byte position
+        'start', splits the pieces into lines, and yields the lines as bytes in blocks of
+        up to 'block_size' lines.  'fbin' is closed when finished.  Yields the same 
+        four-tuples as read_text_blocks().  Used for Readers with 'binary_lines' True, 
+        which avoids decoding and creating a string for every line.
+        """
+        with fbin:
+            fbin.seek(start)
+            offset = start
+            tail = b''
+            while True:
+                data = fbin.read(self.read_size)
+                if not data:
+                    break
+                parts = (tail + data).split(b'\n')
+                tail = parts.pop()      # an incomplete line, finished by the next read
+                for i in range(0, len(parts), self.block_size):
+                    raw = parts[i:i + self.block_size]
+                    offset += sum(map(len, raw)) + len(raw)
+                    yield [lin for lin in map(bytes.strip, raw) if lin], None, len(raw), offset
+            if tail:
+                # last line of the file, without a newline
+                offset += len(tail)
+                tail = tail.strip()
+                yield ([tail] if tail else []), None, 1, offset
+
+    def open_output(self, path, mode, binary=False):
+        """Opens the 'completed' or 'errors' output file 'path' for writing, using 
+        'mode' of 'w' or 'a'.  If 'binary' is True, the file is opened for writing bytes.
+        If archiving, the file is a compressed ArchivePart, which accepts text or bytes.
+        """
+        if self.archives:
+            return ArchivePart(path, mode, self.archives['completed'].compression, 
+                               self.archive_buffer_size)
+        return open(path, mode + 'b' if binary else mode)
+
+    def save_checkpoint(self, fn, cp, f_ok, f_err, member=None):
+        """Saves the Checkpoint 'cp' for the file 'fn', or its zip member 'member', after
+        posting all of the buffered readings so that no readings from before the
+        checkpoint are lost.  'f_ok' and 'f_err' are the completed and error file objects,
+        which are flushed and their sizes recorded in the checkpoint.
+        """
+        self.post_buffer(flush=True)
+        f_ok.flush()
+        f_err.flush()
+        cp.ok_bytes = f_ok.tell()
+        cp.err_bytes = f_err.tell()
+        self.checkpoints.save(fn, cp, member)
+
+    def load_block(self, lines, f_ok, f_err, file_filter=None, rows=None, xlsx=False):
+        """Parses and routes a list of stripped, non-blank lines, 'lines', adds the
+        readings to the reading buffers, and writes the lines to the 'completed' file
+        object 'f_ok' or the 'errors' file object 'f_err'.  If 'file_filter' is a
+        dedup.FileFilter, readings that were already posted are skipped.  If 'rows' is
+        provided, it holds the lines already split into lists of fields, which are
+        parsed instead of the lines.  If 'xlsx' is True, 'rows' holds the cell values
+        of worksheet rows, which are parsed by parse_xlsx_rows().  Returns a two-tuple:
+        (number of successful lines, number of error lines).
+        """
         # Get default BMON ID, if not present, set to None.
         if hasattr(self, 'default_bmon'):
             default_bmon = self.default_bmon
         else:
             default_bmon = None
 
-        for fn in glob(self.pattern):
-
-            # track error lines and successful lines in this file.
-            error_ct = 0
-            success_ct = 0
-
-            try:
-
-                with open(fn) as fin:
-
-                    # get the header lines from the file, and also reassemble into
-                    # a string.
-                    header_lines = self.read_header(fin, fn)
-                    header_str = ''.join(header_lines)    # /n are already at end of lines
-
-                    # Make Paths for both error lines and completed lines
-                    f_path = Path(fn)
-                    f_err_path = self.file_dir / 'errors' / (f_path.stem + '_err' + f_path.suffix)
-                    f_ok_path = self.file_dir / 'completed' / (f_path.stem + '_ok' + f_path.suffix)
-
-                    with open(f_err_path, 'w') as f_err, open(f_ok_path, 'w') as f_ok:
-                        
-                        # Write the header lines into each file
-                        if header_str.strip():
-                            f_err.write(header_str)
-                            f_ok.write(header_str)
-
-                        # process each line
-                        for lin in fin:
-                            lin = lin.strip()
-                            if len(lin) == 0:
-                                continue
-
-                            try:
-                                reads = self.parse_line(lin)
-                                err_in_line = False
-                                for ts, sensor_id, val in reads:
-                                    # Add the reading to the appropriate BMON buffer
-                                    bmon_id = self.id_to_bmon.get(sensor_id, default_bmon)
-                                    if bmon_id:
-                                        rd_buffer[bmon_id].append( (ts, sensor_id, val) )
-                                    else:
-                                        # there is no BMON destination for this reading, so register
-                                        # it as an error.
-                                        err_in_line = True
-
-                                # put the line into the appropriate output file, depending on whether
-                                # it had an error or not.
-                                if err_in_line:
-                                    print(lin, file=f_err)
-                                    error_ct += 1
-                                else:
-                                    print(lin, file=f_ok)
-                                    success_ct += 1
-
-                                # Check to see if any of the buffers have enough records to send
-                                # to the poster.
-                                post_buffer(self.chunk_size)
-
-                            except:
-                                error_ct += 1
-                                print(lin, file=f_err)
-
-                    # if the error and success files have nothing in them, remove them.
-                    if error_ct == 0:
-                        f_err_path.unlink()
-                    if success_ct == 0:
-                        f_ok_path.unlink()
-
+        with metrics.timer('parse', **self.metric_labels):
+            if xlsx:
+                block = self.parse_xlsx_rows(rows)
+            elif rows is not None:
+                block = self.parse_rows(rows)
+            else:
+                block = self.parse_lines(lines)
+
+        # Route each reading to the buffer of its BMON server.  If there is no
+        # BMON destination for the reading, the line it came from is an error.
+        # The destination of each distinct sensor ID in the block is looked up once.
+        bad_lines = set(block.error_lines)
+        routed = {}
+        id_to_bmon = self.id_to_bmon
+        with metrics.timer('route', **self.metric_labels):
+            bmon_for = {sensor_id: id_to_bmon.get(sensor_id, default_bmon) 
+                        for sensor_id in set(block.sensor_ids)}
+            bmon_ids = set(bmon_for.values())
+            if len(bmon_ids) == 1 and None not in bmon_ids and not file_filter:
+                # the usual case: the whole block goes to one BMON server.
+                bmon_id = bmon_ids.pop()
+                if bmon_id:
+                    routed[bmon_id] = (block.ts, block.sensor_ids, block.values)
+                else:
+                    bad_lines.update(block.line_nums)
+            else:
+                for ts, sensor_id, val, line_num in zip(block.ts, block.sensor_ids, 
+                                                         block.values, block.line_nums):
+                    bmon_id = bmon_for[sensor_id]
+                    if bmon_id:
+                        if file_filter and not file_filter.accept(sensor_id, ts):
+                            continue
+                        # the timestamps, sensor IDs and values of the readings
+                        cols = routed.get(bmon_id)
+                        if cols is None:
+                            cols = routed[bmon_id] = ([], [], [])
+                        cols[0].append(ts)
+                        cols[1].append(sensor_id)
+                        cols[2].append(val)
+                    else:
+                        bad_lines.add(line_num)
+        for bmon_id, cols in routed.items():
+            metrics.inc('file_to_bmon_readings_total', len(cols[0]), bmon=bmon_id, 
+                        **self.metric_labels)
+
+        # Add the readings to the appropriate BMON buffers
+        with self.buffer_lock:
+            for bmon_id, cols in routed.items():
+                self.rd_buffer[bmon_id].extend(*cols)
+
+        # put the lines into the appropriate output file, depending on whether
+        # they had an error or not.
+        if bad_lines:
+            ok_lines = [lin for i, lin in enumerate(lines) if i not in bad_lines]
+            err_lines = [lines[i] for i in sorted(bad_lines)]
+        else:
+            ok_lines = lines
+            err_lines = []
+        newline = b'\n' if isinstance(lines[0], bytes) else '\n'
+        if ok_lines:
+            f_ok.write(newline.join(ok_lines) + newline)
+        if err_lines:
+            f_err.write(newline.join(err_lines) + newline)
 
-            except:
-                logging.exception(f'Error processing {fn}')
+        metrics.inc('file_to_bmon_lines_total', len(ok_lines), result='ok', 
+                    **self.metric_labels)
+        metrics.inc('file_to_bmon_lines_total', len(err_lines), result='error', 
+                    **self.metric_labels)
 
-            logging.info(f'Processed {fn}: {success_ct} successful lines, {error_ct} error lines.')
-            
-            # delete the processed file, unless it is a dry run
-            if not self.dry_run:
-                Path(fn).unlink()
+        # Send any full chunks of readings to the posters.
+        self.post_buffer()
 
-        # Send remaining readings to BMON poster
-        post_buffer()
+        return len(ok_lines), len(err_lines)
 
     def ts_from_date_str(self, date_time_str, fmt):
         """Converts a date/time string to a Unix Epoch time.
         'date_time_str' is the date/time string, and 'fmt' is the strptime
-        format string. 
+        format string, or a tuple of alternative format strings to try in order.
+        Fixed-width formats such as '%Y-%m-%d %H:%M:%S' are converted with a
+        fast parser; see the timestamps module.
+        """
+        return self.ts_converter.to_ts(date_time_str, fmt)
+
+    def ts_from_date_strs(self, date_time_strs, fmt):
+        """Converts a column of date/time strings, 'date_time_strs', to a list of Unix
+        Epoch times, as ts_from_date_str() does, for use in parse_columns().  The column
+        may also hold naive datetimes, which are converted as by ts_from_datetime().
+        Each distinct value in the column is only converted once.
+        """
+        return self.ts_converter.to_ts_many(date_time_strs, fmt)
+
+    def ts_from_datetime(self, dt):
+        """Converts a naive datetime in the Reader's time zone, such as a date cell
+        from an XLSX file, to a Unix Epoch time.  As with ts_from_date_str(), fractional
+        seconds are dropped.
         """
-        # convert timestamp string to Unix Epoch time.
-        dt = datetime.strptime(date_time_str, fmt)
-        dt_aware = self.time_zone.localize(dt)
-        return calendar.timegm(dt_aware.utctimetuple())
+        return self.ts_converter.from_datetime(dt)
 
     def read_header(self, fobj, fname):
         """This method must be overridden by the Reader subclass.  'fobj' is a file object
@@ -221,11 +767,157 @@ class BaseReader:
         raise TypeError('The read_header() method must be implemented in the Reader sublclass.')
 
     def parse_line(self, lin):
-        """This method must be overridden by the Reader subclass. 'lin' is a line from the
-        file being loaded, stripped of leading and trailing whitespace.  This method must
-        return a list of three-tuples, each tuple being one sensor reading.  The format
-        of the three-tuple is (Unix Epoch timestamp, sensor ID, reading value).  If no readings
-        are present in the line, return an empty list.  Do not catch any errors that occur
-        during processing of the line, as the calling routine will handle the errors.
+        """This method must be overridden by the Reader subclass, unless it sets 'columnar'
+        to True. 'lin' is a line from the file being loaded, stripped of leading and 
+        trailing whitespace.  This method must return a list of three-tuples, each tuple 
+        being one sensor reading.  The format of the three-tuple is (Unix Epoch timestamp,
+        sensor ID, reading value).  If no readings are present in the line, return an empty
+        list.  Do not catch any errors that occur during processing of the line, as the 
+        calling routine will handle the errors.
         """
+        if self.columnar:
+            return self.parse_fields(self.split_lines([lin])[0])
         raise TypeError('The parse_line() method must be implemented in the Reader sublclass.')
+
+    def parse_lines(self, lines):
+        """Parses a list of lines, 'lines', each stripped of leading and trailing
+        whitespace, and returns a ReadingBlock holding the readings in columnar form.
+        Lines that cannot be parsed are recorded in the 'error_lines' list of the 
+        ReadingBlock instead of raising an error.  If 'columnar' is True, the lines are
+        split into fields and parsed a block at a time by parse_columns(); otherwise
+        parse_line() is called for each line.
+        """
+        if self.columnar:
+            return self.parse_column_block(self.split_lines(lines))
+        return self.parse_items(lines, self.parse_line)
+
+    def parse_row(self, fields):
+        """Implemented by a Reader subclass that sets 'row_mode' to True, unless it sets
+        'columnar' to True.  'fields' is the list of string fields of one row of the 
+        file, as split by csv.reader.  Returns a list of (Unix Epoch timestamp, sensor ID,
+        reading value) three-tuples, like parse_line(), and should not catch errors.
+        """
+        if self.columnar:
+            return self.parse_fields(fields)
+        raise TypeError('The parse_row() method must be implemented by a Reader '
+                        'using row_mode.')
+
+    def parse_rows(self, rows):
+        """Parses a list of rows, each a list of fields, and returns a ReadingBlock as
+        parse_lines() does.
+        """
+        if self.columnar:
+            return self.parse_column_block(rows)
+        return self.parse_items(rows, self.parse_row)
+
+    def parse_xlsx_row(self, values):
+        """Implemented by a Reader subclass that sets 'xlsx_input' to True, unless it
+        sets 'columnar' to True.  'values' is a tuple of the cell values of one worksheet
+        row: datetimes, numbers, strings, or None for empty cells.  Returns a list of 
+        (Unix Epoch timestamp, sensor ID, reading value) three-tuples, like parse_line(),
+        and should not catch errors.
+        """
+        if self.columnar:
+            return self.parse_fields(values)
+        raise TypeError('The parse_xlsx_row() method must be implemented by a Reader '
+                        'using xlsx_input.')
+
+    def parse_xlsx_rows(self, rows):
+        """Parses a list of worksheet rows, each a tuple of cell values, and returns a
+        ReadingBlock as parse_lines() does.
+        """
+        if self.columnar:
+            return self.parse_column_block(rows)
+        return self.parse_items(rows, self.parse_xlsx_row)
+
+    def parse_items(self, items, parse_item):
+        """Parses a list of lines or rows, 'items', one at a time with the function
+        'parse_item', such as parse_line(), which returns a list of readings for one 
+        item.  Returns a ReadingBlock; an item that raises an error is recorded in its
+        'error_lines' list.
+        """
+        block = ReadingBlock()
+        for i, item in enumerate(items):
+            try:
+                reads = parse_item(item)
+            except:
+                block.error_lines.append(i)
+                continue
+            for ts, sensor_id, val in reads:
+                block.ts.append(ts)
+                block.sensor_ids.append(sensor_id)
+                block.values.append(val)
+                block.line_nums.append(i)
+        return block
+
+    def split_lines(self, lines):
+        """Splits each line in the list 'lines' into a list of fields at 'field_sep',
+        and returns the list of the lists of fields.  The lines may be bytes, as they are
+        when 'binary_lines' is True, and then the fields are bytes.
+        """
+        sep = self.field_sep
+        if lines and isinstance(lines[0], bytes):
+            sep = sep.encode('utf-8')
+        return [lin.split(sep) for lin in lines]
+
+    @staticmethod
+    def text_column(col):
+        """Returns the fields of the column 'col' as a list of strings, decoding them
+        from UTF-8 if they are bytes, as they are when 'binary_lines' is True.  Used by
+        parse_columns() for the fields that hold text, such as sensor IDs; numbers can
+        be converted from bytes directly with float() or int().
+        """
+        if col and isinstance(col[0], bytes):
+            return list(map(bytes.decode, col))
+        return list(col)
+
+    def parse_columns(self, rows):
+        """Implemented by a Reader subclass that sets 'columnar' to True, for files with
+        one reading in each line.  'rows' is a list of rows, each a sequence of fields: 
+        the fields of a line split at 'field_sep', the fields of a row in 'row_mode', or
+        the cell values of a worksheet row for 'xlsx_input'.  Returns a three-tuple of 
+        sequences with one entry for each row: (Unix Epoch timestamps, sensor IDs, 
+        reading values).  Work on whole columns, e.g. with map(float, col), which is
+        much faster than parsing one row at a time.  Raises an error if any row cannot
+        be parsed; the rows of the block are then parsed one at a time to find the bad
+        rows.
+        """
+        raise TypeError('The parse_columns() method must be implemented by a Reader '
+                        'that is columnar.')
+
+    def parse_fields(self, fields):
+        """Parses one row of fields with parse_columns() and returns its reading in a
+        list, as parse_line() does.
+        """
+        return list(zip(*self.parse_columns([fields])))
+
+    def parse_column_block(self, rows):
+        """Parses a list of rows of fields with parse_columns() and returns a 
+        ReadingBlock as parse_lines() does.  If the block holds a row that cannot be
+        parsed, the rows are parsed one at a time to find the bad rows.
+        """
+        if not rows:
+            return ReadingBlock()
+        try:
+            ts, sensor_ids, values = self.parse_columns(rows)
+            if not len(ts) == len(sensor_ids) == len(values) == len(rows):
+                raise ValueError('parse_columns() must return one reading for each row.')
+        except Exception:
+            return self.parse_items(rows, self.parse_fields)
+        return ReadingBlock(ts, sensor_ids, values, range(len(rows)))
+
+
+class ReadingBlock:
+    """Holds the sensor readings parsed from a block of lines in columnar form.
+    Reading 'i' has a timestamp of ts[i], a sensor ID of sensor_ids[i], and a value
+    of values[i], and came from line number line_nums[i] of the block (0 is the 
+    first line).  'error_lines' lists the line numbers of lines that could not be
+    parsed.
+    """
+
+    def __init__(self, ts=None, sensor_ids=None, values=None, line_nums=None):
+        self.ts = [] if ts is None else ts
+        self.sensor_ids = [] if sensor_ids is None else sensor_ids
+        self.values = [] if values is None else values
+        self.line_nums = [] if line_nums is None else line_nums
+        self.error_lines = []
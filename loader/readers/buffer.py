@@ -0,0 +1,90 @@
+"""Holds the ReadingBuffer class, which accumulates the readings a Reader routes to
+one BMON server until they are posted.  The readings are stored in columns: the
+timestamps and values in arrays of doubles, and the sensor IDs as numbers in an
+array, each number indexing a list of the distinct sensor IDs seen.  A reading takes
+about 20 bytes this way, instead of a tuple and three Python objects, and the buffer
+holds no objects for the garbage collector to track.  Readings are converted to
+(timestamp, sensor ID, value) tuples only when a chunk is handed to a poster.
+"""
+from array import array
+
+
+class ReadingBuffer:
+    """A buffer of readings for one BMON server.  Not thread-safe; the Reader guards
+    its buffers with a lock.  Timestamps and values must be convertible to float;
+    unlike a list, the buffer cannot hold other JSON values such as None or strings.
+    Timestamps are returned as integers if all of the timestamps added were integers,
+    so the posted readings are the same as the readings parsed.
+    """
+
+    def __init__(self):
+        self.ts = array('d')
+        self.values = array('d')
+        self.sensor_nums = array('L')
+        self.sensor_ids = []        # sensor ID for each sensor number
+        self.sensor_nums_by_id = {}
+        self.int_ts = True
+
+    def __len__(self):
+        return len(self.ts)
+
+    def extend(self, ts, sensor_ids, values):
+        """Adds readings to the end of the buffer.  Reading 'i' has a timestamp of
+        ts[i], a sensor ID of sensor_ids[i], and a value of values[i].  Raises
+        TypeError or ValueError, without changing the buffer, if a timestamp or value
+        cannot be converted to float, or ValueError if the columns have different
+        lengths.
+        """
+        if not len(ts) == len(sensor_ids) == len(values):
+            raise ValueError('Reading columns have different lengths.')
+        # convert the columns before changing the buffer, so a bad timestamp or
+        # value leaves the columns the same length.
+        ts_col = array('d', ts)
+        values_col = array('d', values)
+        nums = self.sensor_nums_by_id
+        sensor_nums = array('L')
+        for sensor_id in sensor_ids:
+            num = nums.get(sensor_id)
+            if num is None:
+                num = nums[sensor_id] = len(self.sensor_ids)
+                self.sensor_ids.append(sensor_id)
+            sensor_nums.append(num)
+        if self.int_ts and not all(type(t) is int for t in ts):
+            self.int_ts = False
+        self.ts.extend(ts_col)
+        self.values.extend(values_col)
+        self.sensor_nums.extend(sensor_nums)
+
+    def take_chunks(self, chunk_size, flush=False):
+        """Removes readings from the front of the buffer and returns them as a list
+        of chunks, each a list of (timestamp, sensor ID, value) tuples holding
+        'chunk_size' readings.  Readings left over that do not fill a chunk stay in
+        the buffer, unless 'flush' is True, in which case they are returned as a
+        final, smaller chunk.
+        """
+        count = len(self.ts) if flush else len(self.ts) // chunk_size * chunk_size
+        if count == 0:
+            return []
+        ts = self.ts[:count].tolist()
+        if self.int_ts:
+            ts = [int(t) for t in ts]
+        ids = self.sensor_ids
+        readings = list(zip(ts, [ids[num] for num in self.sensor_nums[:count]],
+                            self.values[:count].tolist()))
+        del self.ts[:count]
+        del self.values[:count]
+        del self.sensor_nums[:count]
+        return [readings[i:i + chunk_size] for i in range(0, count, chunk_size)]
+
+    def put_back(self, chunks):
+        """Returns the readings in 'chunks', as returned by take_chunks(), to the front
+        of the buffer, e.g. when they could not be queued for posting.
+        """
+        rest = (self.ts, self.sensor_nums, self.values)
+        self.ts, self.sensor_nums, self.values = array('d'), array('L'), array('d')
+        readings = [rd for chunk in chunks for rd in chunk]
+        if readings:
+            self.extend(*[list(col) for col in zip(*readings)])
+        self.ts.extend(rest[0])
+        self.sensor_nums.extend(rest[1])
+        self.values.extend(rest[2])
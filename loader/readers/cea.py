@@ -3,30 +3,28 @@ meter data.
 """
 from .base_reader import BaseReader
 
+# Date/time formats used in the files.  MOA sends the date in the second format.
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%m/%d/%Y %H:%M')
+
 class Reader(BaseReader):
+
+    columnar = True
     
     def read_header(self, fobj, file_name):
         # There are no header lines in the file
         return []
 
-    def parse_line(self, lin):
+    def parse_columns(self, rows):
 
-        # there is one reading per line, fields are separated by commas.
-        fields = lin.split(',')
-        meter_num, dt_tm_str, kwh = fields[:3]
-        meter_mult = float(fields[-1])
+        # there is one reading per line, with the meter multiplier in the last field.
+        meter_nums, dt_tm_strs, kwhs = zip(*[fields[:3] for fields in rows])
+        meter_mults = map(float, [fields[-1] for fields in rows])
 
         # multiply by 4 to get average kW during 15 minute interval.  
         # Include meter multiplier.
-        kw = float(kwh) * 4.0 * meter_mult
-
-        try:
-            ts = self.ts_from_date_str(dt_tm_str, '%Y-%m-%d %H:%M:%S')
-        except:
-            # MOA sends the date in this format
-            ts = self.ts_from_date_str(dt_tm_str, '%m/%d/%Y %H:%M')
+        kws = [float(kwh) * 4.0 * mult for kwh, mult in zip(kwhs, meter_mults)]
 
         # add 7.5 minutes to put timestamp in middle of interval
-        ts += 7.5 * 60
+        ts = [ts + 7.5 * 60 for ts in self.ts_from_date_strs(dt_tm_strs, DATE_FORMATS)]
 
-        return [(ts, f'cea_{meter_num.strip()}', kw)]
+        return ts, [f'cea_{meter_num.strip()}' for meter_num in meter_nums], kws
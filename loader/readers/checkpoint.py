@@ -0,0 +1,114 @@
+"""Holds the FileCheckpoints class, which records how far into each file the
+loading process has gotten, so that loading can resume at that point if the
+process stops before finishing a file.  A checkpoint is only recorded after all
+of the readings from the lines before it have been added to the posting queues.
+Checkpoints are stored in a SQLite database.
+"""
+import os
+import sqlite3
+from threading import get_ident
+
+
+# Checkpoint offset marking a member of a zip file that was completely loaded.
+FINISHED = -1
+
+
+class Checkpoint:
+    """The position reached in a file, and the counts and output file sizes at
+    that position.
+    """
+
+    def __init__(self, offset, line_count, success_ct, error_ct, ok_bytes, err_bytes):
+        self.offset = offset            # position in the file to resume reading at, or
+                                        # FINISHED for a finished member of a zip file
+        self.line_count = line_count    # number of lines read after the header
+        self.success_ct = success_ct    # number of successful lines
+        self.error_ct = error_ct        # number of error lines
+        self.ok_bytes = ok_bytes        # size of the 'completed' file
+        self.err_bytes = err_bytes      # size of the 'errors' file
+
+
+class FileCheckpoints:
+    """Stores a checkpoint for each partially-loaded file.  A file is identified by
+    its path, and its inode, size and modification time must match those recorded
+    with the checkpoint for the checkpoint to be used.  A member of a zip file is
+    identified by the path of the zip file and the member name.  Safe to use from 
+    multiple threads.
+    """
+
+    _create = (
+            'CREATE TABLE IF NOT EXISTS checkpoint '
+            '('
+            '  path TEXT PRIMARY KEY,'
+            '  inode INTEGER,'
+            '  size INTEGER,'
+            '  mtime REAL,'
+            '  offset INTEGER,'
+            '  line_count INTEGER,'
+            '  success_ct INTEGER,'
+            '  error_ct INTEGER,'
+            '  ok_bytes INTEGER,'
+            '  err_bytes INTEGER'
+            ')'
+            )
+    _get = (
+            'SELECT inode, size, mtime, offset, line_count, success_ct, error_ct, '
+            'ok_bytes, err_bytes FROM checkpoint WHERE path = ?'
+            )
+    _save = 'INSERT OR REPLACE INTO checkpoint VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+    _remove = 'DELETE FROM checkpoint WHERE path = ?'
+
+    def __init__(self, path):
+        """'path' is the path to the SQLite database file holding the checkpoints.
+        """
+        self.path = os.path.abspath(path)
+        self._connection_cache = {}
+        with self._get_conn() as conn:
+            conn.execute(self._create)
+
+    def _get_conn(self):
+        """Gets a connection from a pool based on the ID of the thread calling
+        this method.
+        """
+        id = get_ident()
+        if id not in self._connection_cache:
+            self._connection_cache[id] = sqlite3.Connection(self.path, timeout=60)
+        return self._connection_cache[id]
+
+    @staticmethod
+    def _path(fn, member):
+        """Returns the path identifying the file 'fn', or its member 'member'.
+        """
+        path = os.path.abspath(fn)
+        return path if member is None else f'{path}/{member}'
+
+    @staticmethod
+    def _file_key(fn):
+        """Returns the (inode, size, modification time) of the file 'fn'.
+        """
+        st = os.stat(fn)
+        return st.st_ino, st.st_size, st.st_mtime
+
+    def get(self, fn, member=None):
+        """Returns the Checkpoint for the file 'fn', or its zip member 'member', or None
+        if there is no checkpoint or the file has changed since the checkpoint was saved.
+        """
+        with self._get_conn() as conn:
+            row = conn.execute(self._get, (self._path(fn, member),)).fetchone()
+        if row is None or tuple(row[:3]) != self._file_key(fn):
+            return None
+        return Checkpoint(*row[3:])
+
+    def save(self, fn, checkpoint, member=None):
+        """Saves the Checkpoint 'checkpoint' for the file 'fn', or its zip member 'member'.
+        """
+        with self._get_conn() as conn:
+            conn.execute(self._save, (self._path(fn, member),) + self._file_key(fn) + (
+                checkpoint.offset, checkpoint.line_count, checkpoint.success_ct,
+                checkpoint.error_ct, checkpoint.ok_bytes, checkpoint.err_bytes))
+
+    def remove(self, fn, member=None):
+        """Removes any checkpoint for the file 'fn', or its zip member 'member'.
+        """
+        with self._get_conn() as conn:
+            conn.execute(self._remove, (self._path(fn, member),))
@@ -0,0 +1,79 @@
+"""Functions for reading compressed input files.  Files compressed with gzip, bzip2
+or xz are decompressed as they are read, without writing a decompressed copy to disk.
+Each member of a zip file is read as a separate file.  The compression is detected
+from the file name suffix, or, if the suffix is not recognized, from the first bytes
+of the file.
+"""
+import io
+import gzip
+import bz2
+import lzma
+import zipfile
+
+# File name suffixes of the compressed formats.
+SUFFIXES = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.zip': 'zip'}
+
+# The bytes at the start of a file in each compressed format.
+MAGIC = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'PK\x03\x04', 'zip'),
+)
+
+# Functions that open a file in each of the streaming formats.
+OPENERS = {'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+
+
+def detect_compression(fn):
+    """Returns the compression format of the file 'fn': 'gzip', 'bz2', 'xz' or 'zip',
+    or None if the file is not compressed.  XLSX files are zip files, but are not
+    treated as compressed.
+    """
+    name = fn.lower()
+    for suffix, compression in SUFFIXES.items():
+        if name.endswith(suffix):
+            return compression
+    if name.endswith('.xlsx'):
+        return None
+    with open(fn, 'rb') as f:
+        start = f.read(6)
+    for magic, compression in MAGIC:
+        if start.startswith(magic):
+            return compression
+    return None
+
+
+def zip_members(fn):
+    """Returns a list of the names of the files in the zip file 'fn', in the order they
+    are stored, leaving out directories.
+    """
+    with zipfile.ZipFile(fn) as zf:
+        return [info.filename for info in zf.infolist() if not info.is_dir()]
+
+
+def uncompressed_name(fn, compression):
+    """Returns the name of the file 'fn' without the suffix of the compression format
+    'compression', e.g. 'data.csv' for 'data.csv.gz'.
+    """
+    for suffix, suffix_compression in SUFFIXES.items():
+        if suffix_compression == compression and fn.lower().endswith(suffix):
+            return fn[:-len(suffix)]
+    return fn
+
+
+def open_file(fn, compression=None, member=None, binary=False):
+    """Opens the file 'fn' for reading as text, or as bytes if 'binary' is True.  The
+    file is decompressed as it is read if 'compression' is 'gzip', 'bz2' or 'xz'.  If
+    'compression' is 'zip', the member named 'member' of the zip file is opened.  The
+    returned file object is seekable, although seeking forward in a compressed file
+    decompresses the data skipped over.
+    """
+    if compression == 'zip':
+        with zipfile.ZipFile(fn) as zf:
+            # the zip file stays open until the member is closed.
+            fobj = zf.open(member)
+        return fobj if binary else io.TextIOWrapper(fobj)
+    if compression in OPENERS:
+        return OPENERS[compression](fn, 'rb' if binary else 'rt')
+    return open(fn, 'rb' if binary else 'r')
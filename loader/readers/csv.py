@@ -3,15 +3,17 @@ from .base_reader import BaseReader
 
 
 class Reader(BaseReader):
+
+    binary_lines = True
+    columnar = True
     
     def read_header(self, fobj, file_name):
         # One header line
         return [fobj.readline()]
 
-    def parse_line(self, lin):
+    def parse_columns(self, rows):
 
-        # there is one reading per line, fields are separated by commas.
-        fields = lin.split(',')
-        dt_tm, sensor_id, value = fields[:3]
+        # there is one reading per line: timestamp, sensor ID, value.
+        dt_tm, sensor_ids, values = zip(*[fields[:3] for fields in rows])
 
-        return [(float(dt_tm), sensor_id, float(value))]
+        return list(map(float, dt_tm)), self.text_column(sensor_ids), list(map(float, values))
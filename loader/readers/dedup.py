@@ -0,0 +1,134 @@
+"""Holds the HighWaterMarks class, which drops readings that were already posted by
+an earlier run, as happens when a utility resends files covering overlapping date
+ranges.  For each sensor, the timestamp of the newest reading added to a posting
+queue is recorded in a SQLite database.  Readings from later files with timestamps
+at or before that high-water mark are skipped.
+
+The files of one run of a Reader are screened against the marks as they were when
+the run started, not against marks raised by other files of the same run.  Otherwise
+the readings of an older file would be dropped whenever a newer file was processed
+first, which depends on the order and concurrency of the processing.  A reading sent
+in two files of the same run is posted twice, which BMON accepts.
+"""
+import sqlite3
+import threading
+from threading import get_ident
+
+
+class HighWaterMarks:
+    """Stores the timestamp of the newest posted reading for each sensor.  Safe to use
+    from multiple threads.
+    """
+
+    _create = 'CREATE TABLE IF NOT EXISTS high_water (sensor_id TEXT PRIMARY KEY, ts REAL)'
+    _get = 'SELECT ts FROM high_water WHERE sensor_id = ?'
+    _save = 'INSERT OR REPLACE INTO high_water VALUES (?, ?)'
+
+    def __init__(self, path):
+        """'path' is the path to the SQLite database file holding the high-water marks.
+        """
+        self.path = path
+        self._connection_cache = {}
+        self.marks = {}             # cache of the marks read from or saved to the database
+        self.run_marks = {}         # marks, as they were at the start of the run, that
+                                    # have been raised during the run
+        self.lock = threading.Lock()
+        with self._get_conn() as conn:
+            conn.execute(self._create)
+
+    def _get_conn(self):
+        """Gets a connection from a pool based on the ID of the thread calling
+        this method.
+        """
+        id = get_ident()
+        if id not in self._connection_cache:
+            self._connection_cache[id] = sqlite3.Connection(self.path, timeout=60)
+        return self._connection_cache[id]
+
+    def get(self, sensor_id):
+        """Returns the high-water mark timestamp for 'sensor_id', or None if no readings
+        for the sensor have been posted.
+        """
+        try:
+            return self.marks[sensor_id]
+        except KeyError:
+            row = self._get_conn().execute(self._get, (sensor_id,)).fetchone()
+            ts = row[0] if row else None
+            self.marks[sensor_id] = ts
+            return ts
+
+    def start_run(self):
+        """Called at the start of a run of the Reader.  The marks saved from then on are
+        not used to screen readings until the next run.
+        """
+        with self.lock:
+            self.run_marks = {}
+
+    def get_run_mark(self, sensor_id):
+        """Returns the high-water mark timestamp for 'sensor_id' as it was at the start
+        of the run, or None if no readings for the sensor had been posted.
+        """
+        with self.lock:
+            try:
+                return self.run_marks[sensor_id]
+            except KeyError:
+                return self.get(sensor_id)
+
+    def save(self, new_marks):
+        """Raises the high-water marks to the timestamps in the dictionary 'new_marks',
+        keyed on sensor ID.  Marks that are already higher are not changed.
+        """
+        with self.lock:
+            changed = []
+            for sensor_id, ts in new_marks.items():
+                current = self.get(sensor_id)
+                if current is None or ts > current:
+                    self.run_marks.setdefault(sensor_id, current)
+                    self.marks[sensor_id] = ts
+                    changed.append((sensor_id, ts))
+            if changed:
+                with self._get_conn() as conn:
+                    conn.executemany(self._save, changed)
+
+    def start_file(self):
+        """Returns a FileFilter for screening the readings of one file.
+        """
+        return FileFilter(self)
+
+
+class FileFilter:
+    """Screens the readings from one file against the high-water marks as they were at
+    the start of the run, so that readings within the file, and the files of the run,
+    do not need to be in time order.  Tracks the newest reading posted for each sensor so the
+    marks can be raised after the readings are in the posting queues.
+    """
+
+    def __init__(self, high_water_marks):
+        self.hwm = high_water_marks
+        self.baseline = {}      # sensor ID -> high-water mark at the start of the run
+        self.new_marks = {}     # sensor ID -> newest accepted timestamp, not yet saved
+        self.skipped = 0        # number of readings skipped
+
+    def accept(self, sensor_id, ts):
+        """Returns True if the reading for 'sensor_id' at timestamp 'ts' is newer than
+        the high-water mark for the sensor, and so should be posted.
+        """
+        try:
+            mark = self.baseline[sensor_id]
+        except KeyError:
+            mark = self.baseline[sensor_id] = self.hwm.get_run_mark(sensor_id)
+        if mark is not None and ts <= mark:
+            self.skipped += 1
+            return False
+        newest = self.new_marks.get(sensor_id)
+        if newest is None or ts > newest:
+            self.new_marks[sensor_id] = ts
+        return True
+
+    def commit(self):
+        """Saves the newest accepted timestamps to the high-water marks.  Must only be
+        called after the accepted readings have been added to the posting queues.
+        """
+        if self.new_marks:
+            self.hwm.save(self.new_marks)
+            self.new_marks = {}
@@ -4,23 +4,27 @@ meter data.
 from .base_reader import BaseReader
 
 class Reader(BaseReader):
+
+    # The files can be the original XLSX files from GVEA, which are read
+    # directly, or CSV files converted from them.
+    xlsx_input = True
+    columnar = True
     
     def read_header(self, fobj, file_name):
         # There is one header line
         return [fobj.readline()]
 
-    def parse_line(self, lin):
+    def parse_columns(self, rows):
 
-        # there is one reading per line, fields are separated by commas.
-        fields = lin.split(',')
-        meter_num, acct, dt_tm_str, kwh = fields[:4]
-        meter_num = int(float(meter_num))
+        # there is one reading per line.  In XLSX rows, the Read Date cell is a 
+        # datetime and kWh is a number, but the cells may also hold text.
+        meter_nums, accts, dts, kwhs = zip(*[fields[:4] for fields in rows])
+        sensor_ids = [f'gvea_{int(float(meter_num))}' for meter_num in meter_nums]
 
         # multiply by 4 to get average kW during 15 minute interval
-        kw = float(kwh) * 4.0
+        kws = [float(kwh) * 4.0 for kwh in kwhs]
 
-        ts = self.ts_from_date_str(dt_tm_str, '%Y-%m-%d %H:%M:%S.%f')
         # add 7.5 minutes to put timestamp in middle of interval
-        ts += 7.5 * 60
+        ts = [ts + 7.5 * 60 for ts in self.ts_from_date_strs(dts, '%Y-%m-%d %H:%M:%S.%f')]
 
-        return [(ts, f'gvea_{meter_num}', kw)]
+        return ts, sensor_ids, kws
@@ -4,17 +4,17 @@ meter data that has been saved the BMON mea_data_to_file.py script.
 from .base_reader import BaseReader
 
 class Reader(BaseReader):
+
+    binary_lines = True
+    columnar = True
     
     def read_header(self, fobj, file_name):
         # One header line
         return [fobj.readline()]
 
-    def parse_line(self, lin):
+    def parse_columns(self, rows):
 
-        # there is one reading per line, fields are separated by commas.
-        fields = lin.split(',')
-        sensor_id, ts, val = fields[:3]
-        ts = float(ts)
-        val = float(val)
+        # there is one reading per line: sensor ID, timestamp, value.
+        sensor_ids, ts, vals = zip(*[fields[:3] for fields in rows])
 
-        return [(ts, sensor_id, val)]
+        return list(map(float, ts)), self.text_column(sensor_ids), list(map(float, vals))
@@ -1,11 +1,14 @@
 """Reader file to parse Seward Electric Association 15-minute
 meter data provided by Chugach Electric.
 """
-from io import StringIO
 import csv
 from .base_reader import BaseReader
 
 class Reader(BaseReader):
+
+    # The lines contain quoted fields, so the file is split into fields by
+    # a csv.reader and each row is passed to parse_row().
+    row_mode = True
     
     def read_header(self, fobj, file_name):
         # There is one header line
@@ -15,9 +18,10 @@ class Reader(BaseReader):
 
         # Use the csv module to properly split the line into fields, accounting
         # for quoted strings.
-        f = StringIO(lin)
-        rdr = csv.reader(f)
-        fields = next(rdr)
+        return self.parse_row(next(csv.reader([lin])))
+
+    def parse_row(self, fields):
+
         meter_num, dt, tm, _, kw, *rest = fields
 
         meter_num = meter_num.strip().lower()
@@ -0,0 +1,262 @@
+"""Holds the TimestampConverter class, which converts local date/time strings
+into Unix Epoch timestamps much faster than the combination of datetime.strptime(),
+pytz localize() and calendar.timegm().  The speed comes from three parts:
+
+    * Date/time formats with fixed-width fields, such as '%Y-%m-%d %H:%M:%S', are
+      compiled into parsers that slice the fields out of the string.
+    * The UTC offsets of the time zone are looked up in a table built from the
+      time zone's DST transitions instead of calling localize().
+    * The UTC timestamp of the start of each local hour is cached, keyed on the
+      part of the string that holds the date and hour.
+
+Local times that fall within an hour containing a DST transition are converted
+with localize(), so results match localize() (with its default of is_dst=False)
+for ambiguous and non-existent times.  As with the original conversion, fractional
+seconds are dropped and an integer timestamp is returned.
+"""
+from datetime import datetime
+from bisect import bisect_right
+import calendar
+
+# Width of the fixed-width strptime directives that can be compiled into slice
+# parsers.  '%f' is also supported if it is the last directive in the format.
+_FIELD_WIDTHS = {'Y': 4, 'm': 2, 'd': 2, 'H': 2, 'M': 2, 'S': 2}
+
+# Maximum number of date/hour entries held in the cache before it is cleared.
+_MAX_CACHE_SIZE = 200000
+
+class FixedLayout:
+    """A date/time format compiled into the positions of its fields and literal
+    characters.  Only formats made up of fixed-width directives that include at
+    least the year, month and day can be compiled.
+    """
+
+    def __init__(self, fmt):
+        """'fmt' is a strptime format string.  Raises ValueError if the format
+        cannot be compiled.
+        """
+        self.fields = {}       # directive letter -> (start, end) slice positions
+        self.literals = []     # list of (position, character)
+        self.has_frac = False  # True if the format ends with '%f'
+        pos = 0
+        i = 0
+        while i < len(fmt):
+            ch = fmt[i]
+            if ch == '%':
+                if i + 1 >= len(fmt):
+                    raise ValueError(f'Bad format: {fmt}')
+                directive = fmt[i + 1]
+                if directive == 'f' and i + 2 == len(fmt):
+                    self.has_frac = True
+                elif directive in _FIELD_WIDTHS and directive not in self.fields:
+                    width = _FIELD_WIDTHS[directive]
+                    self.fields[directive] = (pos, pos + width)
+                    pos += width
+                else:
+                    raise ValueError(f'Directive %{directive} cannot be compiled.')
+                i += 2
+            else:
+                self.literals.append((pos, ch))
+                pos += 1
+                i += 1
+
+        if not {'Y', 'm', 'd'}.issubset(self.fields):
+            raise ValueError(f'Format {fmt} does not contain a full date.')
+
+        # length of the string excluding any fractional seconds.
+        self.length = pos
+
+        # The cache key is the part of the string that ends with the last of the
+        # date and hour fields.
+        self.key_end = max(end for d, (_, end) in self.fields.items() if d in 'YmdH')
+
+        # Slices for the minute and second fields, which are added onto the
+        # timestamp of the start of the hour.  Empty slices are used if the
+        # fields are not present.
+        self.minute_slice = slice(*self.fields.get('M', (0, 0)))
+        self.second_slice = slice(*self.fields.get('S', (0, 0)))
+
+    def matches(self, s):
+        """Returns True if the date/time string 's' has this layout: the right length,
+        the literal characters in the right places, and digits in every field.
+        """
+        if self.has_frac:
+            frac_len = len(s) - self.length
+            if frac_len < 1 or frac_len > 6 or not s[self.length:].isdigit():
+                return False
+        elif len(s) != self.length:
+            return False
+        for pos, ch in self.literals:
+            if s[pos] != ch:
+                return False
+        for start, end in self.fields.values():
+            if not s[start:end].isdigit():
+                return False
+        return True
+
+    def date_hour(self, s):
+        """Returns (year, month, day, hour) from the date/time string 's'.
+        """
+        f = self.fields
+        hour = int(s[slice(*f['H'])]) if 'H' in f else 0
+        return int(s[slice(*f['Y'])]), int(s[slice(*f['m'])]), int(s[slice(*f['d'])]), hour
+
+
+class TimestampConverter:
+    """Converts date/time strings in a particular time zone into Unix Epoch
+    timestamps.  Safe to use from multiple threads.
+    """
+
+    def __init__(self, time_zone):
+        """'time_zone' is a pytz timezone object.
+        """
+        self.time_zone = time_zone
+        self.layouts = {}        # format string -> FixedLayout, or None if not compilable
+        # (format string, date/hour prefix) -> UTC timestamp of the start of the hour.
+        # (None, year, month, day, hour) is the key for datetimes.
+        self.hour_cache = {}
+        self._build_transition_table()
+
+    def _build_transition_table(self):
+        """Builds lists describing the DST transitions of the time zone in local time.
+        Around each transition there is a window of local times that are either
+        ambiguous or do not exist.  'win_start' and 'win_end' hold the start and end
+        of each window in local seconds, and 'win_offset' holds the UTC offset in
+        seconds in effect after the window.  'base_offset' is the UTC offset before
+        the first transition.
+        """
+        self.win_start = []
+        self.win_end = []
+        self.win_offset = []
+        tz = self.time_zone
+        if hasattr(tz, '_utc_transition_times'):
+            trans_times = tz._utc_transition_times
+            infos = tz._transition_info
+            self.base_offset = infos[0][0].total_seconds()
+            # the first transition time is a placeholder at the start of the calendar.
+            for i in range(1, len(trans_times)):
+                utc_secs = calendar.timegm(trans_times[i].timetuple())
+                prev_offset = infos[i - 1][0].total_seconds()
+                new_offset = infos[i][0].total_seconds()
+                self.win_start.append(utc_secs + min(prev_offset, new_offset))
+                self.win_end.append(utc_secs + max(prev_offset, new_offset))
+                self.win_offset.append(new_offset)
+        else:
+            # a time zone with a constant UTC offset
+            self.base_offset = tz.localize(datetime(2000, 1, 1)).utcoffset().total_seconds()
+
+    def _hour_start_ts(self, year, month, day, hour):
+        """Returns the UTC timestamp of the start of the local hour identified by the
+        arguments, or None if a DST transition occurs within the hour.  Raises ValueError
+        if the date is not valid.
+        """
+        local_secs = calendar.timegm(datetime(year, month, day, hour).timetuple())
+        j = bisect_right(self.win_start, local_secs + 3599) - 1
+        if j < 0:
+            offset = self.base_offset
+        elif self.win_end[j] > local_secs:
+            # a transition window overlaps this hour
+            return None
+        else:
+            offset = self.win_offset[j]
+        return int(local_secs - offset)
+
+    def _localize_ts(self, dt):
+        """Converts the naive local datetime 'dt' to a Unix Epoch timestamp using the
+        time zone's localize() method.
+        """
+        dt_aware = self.time_zone.localize(dt)
+        return calendar.timegm(dt_aware.utctimetuple())
+
+    def _layout(self, fmt):
+        """Returns the compiled FixedLayout for the format 'fmt', or None if it
+        cannot be compiled.
+        """
+        try:
+            return self.layouts[fmt]
+        except KeyError:
+            try:
+                layout = FixedLayout(fmt)
+            except ValueError:
+                layout = None
+            self.layouts[fmt] = layout
+            return layout
+
+    def from_datetime(self, dt):
+        """Converts the naive local datetime 'dt' to an integer Unix Epoch timestamp,
+        dropping any fractional seconds.
+        """
+        key = (None, dt.year, dt.month, dt.day, dt.hour)
+        try:
+            hour_ts = self.hour_cache[key]
+        except KeyError:
+            hour_ts = self._hour_start_ts(dt.year, dt.month, dt.day, dt.hour)
+            if len(self.hour_cache) >= _MAX_CACHE_SIZE:
+                self.hour_cache.clear()
+            self.hour_cache[key] = hour_ts
+        if hour_ts is None:
+            # a DST transition occurs in this hour
+            return self._localize_ts(dt.replace(microsecond=0))
+        return hour_ts + dt.minute * 60 + dt.second
+
+    def to_ts(self, date_time_str, fmt):
+        """Converts the date/time string 'date_time_str' to an integer Unix Epoch timestamp.
+        'fmt' is the strptime format string, or a tuple of alternative format strings that
+        are tried in order.  Raises ValueError if the string does not match the format(s).
+        """
+        formats = (fmt,) if isinstance(fmt, str) else fmt
+
+        for f in formats:
+            layout = self._layout(f)
+            if layout is None or not layout.matches(date_time_str):
+                continue
+
+            s = date_time_str
+            minute = int(s[layout.minute_slice] or 0)
+            second = int(s[layout.second_slice] or 0)
+            if minute > 59 or second > 59:
+                break     # let strptime() produce the error
+
+            key = (f, s[:layout.key_end])
+            try:
+                hour_ts = self.hour_cache[key]
+            except KeyError:
+                try:
+                    hour_ts = self._hour_start_ts(*layout.date_hour(s))
+                except ValueError:
+                    break     # invalid date; let strptime() produce the error
+                if len(self.hour_cache) >= _MAX_CACHE_SIZE:
+                    self.hour_cache.clear()
+                self.hour_cache[key] = hour_ts
+
+            if hour_ts is None:
+                # a DST transition occurs in this hour
+                return self._localize_ts(datetime.strptime(s, f))
+            return hour_ts + minute * 60 + second
+
+        # String does not fit a compiled layout.  Use strptime() with each format,
+        # raising the error from the last format if none work.
+        for i, f in enumerate(formats):
+            try:
+                dt = datetime.strptime(date_time_str, f)
+            except ValueError:
+                if i == len(formats) - 1:
+                    raise
+                continue
+            hour_ts = self._hour_start_ts(dt.year, dt.month, dt.day, dt.hour)
+            if hour_ts is None:
+                return self._localize_ts(dt)
+            return hour_ts + dt.minute * 60 + dt.second
+
+    def to_ts_many(self, values, fmt):
+        """Converts a sequence of date/time strings, 'values', to a list of integer Unix
+        Epoch timestamps, as to_ts() does with the format(s) 'fmt'.  Values that are 
+        naive datetimes are converted with from_datetime().  Each distinct value is only
+        converted once, since the readings of many meters in a block of lines usually
+        share a few timestamps.  Raises ValueError if any string does not match.
+        """
+        converted = {}
+        for val in set(values):
+            converted[val] = self.to_ts(val, fmt) if isinstance(val, str) \
+                             else self.from_datetime(val)
+        return [converted[val] for val in values]
@@ -0,0 +1,77 @@
+"""Holds the XlsxRows class, which reads the rows of an Excel XLSX file for Readers
+with 'xlsx_input' True.  The first worksheet is streamed with openpyxl in read-only
+mode, so the whole workbook is never held in memory, and the cells are returned as
+native Python values: datetimes, numbers and strings.  This avoids converting the
+file to CSV and then parsing the text of the numbers and dates again.
+
+The openpyxl package is only imported when an XLSX file is read.
+"""
+import csv
+import io
+
+
+class XlsxRows:
+    """A forward-only reader of the rows of the first worksheet of an XLSX file.  The
+    position in the file is the number of rows read, which is used as the file offset
+    in checkpoints.  readline() returns a row as a CSV line, so a Reader's read_header()
+    can read header rows as it does from a text file.
+    """
+
+    def __init__(self, source):
+        """'source' is the path to the XLSX file, or a seekable binary file object, which
+        is closed by close().
+        """
+        import openpyxl
+        self.source = source
+        self.workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+        self.rows = self.workbook.worksheets[0].iter_rows(values_only=True)
+        self.position = 0
+        self._text = io.StringIO()
+        self._writer = csv.writer(self._text, lineterminator='\n')
+
+    def next_row(self):
+        """Returns the next row as a tuple of cell values, with None for empty cells,
+        or None at the end of the worksheet.
+        """
+        row = next(self.rows, None)
+        if row is not None:
+            self.position += 1
+        return row
+
+    def row_text(self, row):
+        """Returns the cell values 'row' as a CSV line, ending with a newline.  Used for
+        the header and for the lines of the 'completed' and 'errors' files.
+        """
+        self._text.seek(0)
+        self._text.truncate()
+        self._writer.writerow(['' if val is None else val for val in row])
+        return self._text.getvalue()
+
+    def readline(self):
+        """Returns the next row as a CSV line, or '' at the end of the worksheet.
+        """
+        row = self.next_row()
+        return '' if row is None else self.row_text(row)
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position):
+        """Skips ahead to the row number 'position'.  Rows cannot be read again, so
+        'position' must not be before the current position.
+        """
+        if position < self.position:
+            raise ValueError('Cannot seek backwards in an XLSX file.')
+        while self.position < position and self.next_row() is not None:
+            pass
+
+    def close(self):
+        self.workbook.close()
+        if hasattr(self.source, 'close'):
+            self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,169 @@
+"""Holds the SensorRouter class, which determines the BMON server that each sensor
+reading is sent to.  Besides exact sensor IDs, entries in the sensor-to-BMON mapping
+can be routing rules that match many sensor IDs:
+
+    gvea_*                  a prefix: any sensor ID starting with 'gvea_'
+    cea_1??                 a glob pattern, using the wildcards of the fnmatch module
+    re:ses_\\d+_kwh          a regular expression that must match the whole sensor ID
+    range:cea_1000-1999     a prefix followed by an integer in the range 1000 - 1999,
+                            inclusive.
+
+An exact sensor ID entry always takes precedence over the rules.  Otherwise, the
+first rule, in the order of the mapping source, that matches the sensor ID is used.
+"""
+
+import re
+import fnmatch
+
+# Maximum number of resolved sensor IDs held in the cache before it is cleared.
+_MAX_CACHE_SIZE = 100000
+
+# Marks a sensor ID in the cache that matches no rule.
+_NO_MATCH = object()
+
+_range_re = re.compile(r'(.*?)(\d+)-(\d+)$')
+
+
+def is_rule(key):
+    """Returns True if the mapping key 'key' is a routing rule instead of a sensor ID.
+    Keys that are not strings, such as numeric sensor IDs, are never rules.
+    """
+    return isinstance(key, str) and \
+        (key.startswith(('re:', 'range:')) or any(ch in key for ch in '*?['))
+
+
+def compile_rule(rule):
+    """Returns a function that accepts a sensor ID and returns True if the sensor ID
+    matches the routing rule 'rule'.  Raises ValueError if the rule is not valid.
+    """
+    if rule.startswith('re:'):
+        try:
+            return re.compile(rule[3:]).fullmatch
+        except re.error as e:
+            raise ValueError(f'Bad regular expression in routing rule {rule}: {e}')
+
+    if rule.startswith('range:'):
+        m = _range_re.match(rule[6:])
+        if m is None:
+            raise ValueError(f'Bad range routing rule: {rule}')
+        prefix, low, high = m.group(1), int(m.group(2)), int(m.group(3))
+        n = len(prefix)
+        def match_range(sensor_id):
+            if not sensor_id.startswith(prefix):
+                return False
+            num = sensor_id[n:]
+            return num.isdigit() and low <= int(num) <= high
+        return match_range
+
+    prefix = rule[:-1]
+    if rule.endswith('*') and not any(ch in prefix for ch in '*?['):
+        # a simple prefix, which is much faster to check than a pattern.
+        return lambda sensor_id: sensor_id.startswith(prefix)
+
+    return re.compile(fnmatch.translate(rule)).match
+
+
+class RoutingTable:
+    """One version of the sensor-to-BMON mapping, with its routing rules compiled.  It
+    is not changed after it is built, other than its cache of resolved sensor IDs, so
+    a SensorRouter can switch to a new mapping by replacing its RoutingTable.
+    """
+
+    def __init__(self, mapping):
+        """'mapping' is a dictionary whose keys are sensor IDs or routing rules and whose
+        values are BMON server IDs.  Invalid rules are skipped and reported in the
+        'bad_rules' list.
+        """
+        self.exact = {}
+        self.rules = []
+        self.bad_rules = []
+        self.cache = {}
+        for key, bmon_id in mapping.items():
+            if is_rule(key):
+                try:
+                    self.rules.append((compile_rule(key), bmon_id))
+                except ValueError as e:
+                    self.bad_rules.append(str(e))
+            else:
+                self.exact[key] = bmon_id
+
+    def lookup(self, sensor_id):
+        """Returns the BMON ID for 'sensor_id' from the routing rules, or None if no
+        rule matches.  Sensor IDs that are not strings match no rule.
+        """
+        cache = self.cache
+        bmon_id = cache.get(sensor_id)
+        if bmon_id is None:
+            bmon_id = _NO_MATCH
+            if isinstance(sensor_id, str):
+                for match, rule_bmon_id in self.rules:
+                    if match(sensor_id):
+                        bmon_id = rule_bmon_id
+                        break
+            if len(cache) >= _MAX_CACHE_SIZE:
+                cache.clear()
+            cache[sensor_id] = bmon_id
+        return None if bmon_id is _NO_MATCH else bmon_id
+
+
+class SensorRouter:
+    """Maps sensor IDs to BMON server IDs using exact sensor ID entries and routing
+    rules.  Has the get() method of a dictionary, so it can be used in place of the
+    'id_to_bmon' dictionary.  Resolved sensor IDs are cached, so each rule lookup is
+    only done once for a sensor ID.  Safe to use from multiple threads.
+    """
+
+    def __init__(self, mapping=None):
+        """'mapping' is a dictionary whose keys are sensor IDs or routing rules and whose
+        values are BMON server IDs.
+        """
+        self.set_mapping(mapping or {})
+
+    def set_mapping(self, mapping):
+        """Replaces the mapping used by the router with 'mapping', a dictionary whose
+        keys are sensor IDs or routing rules.  Invalid rules are skipped and reported
+        in the 'bad_rules' list.
+        """
+        # The new mapping is built completely, then swapped in with one assignment,
+        # so other threads see either the old or the new mapping, never a mix.
+        self.table = RoutingTable(mapping)
+
+    @property
+    def exact(self):
+        return self.table.exact
+
+    @property
+    def bad_rules(self):
+        return self.table.bad_rules
+
+    @property
+    def rule_count(self):
+        return len(self.table.rules)
+
+    def lookup(self, sensor_id):
+        """Returns the BMON ID for 'sensor_id' from the routing rules, or None if no
+        rule matches.
+        """
+        return self.table.lookup(sensor_id)
+
+    def get(self, sensor_id, default=None):
+        """Returns the BMON ID for 'sensor_id', or 'default' if neither an exact entry
+        nor a rule matches it.
+        """
+        table = self.table
+        try:
+            return table.exact[sensor_id]
+        except KeyError:
+            pass
+        if table.rules:
+            bmon_id = table.lookup(sensor_id)
+            if bmon_id is not None:
+                return bmon_id
+        return default
+
+    def __contains__(self, sensor_id):
+        return self.get(sensor_id) is not None
+
+    def __len__(self):
+        table = self.table
+        return len(table.exact) + len(table.rules)
@@ -0,0 +1,242 @@
+"""Holds the SensorMapping class, which loads the dictionary mapping sensor IDs to
+BMON server IDs from the 'sensor_to_bmon_file' given in the configuration file.
+
+The resolved dictionary is saved to a local snapshot file.  At startup, the snapshot
+is used instead of reading the mapping source if it is still valid:  for a CSV or
+SQLite mapping file, the file must not have changed since the snapshot was saved;
+for a Google Sheets mapping, the snapshot must be younger than a time-to-live.  A
+Google Sheets snapshot that is older than that is used right away and refreshed in a
+background thread, so the run does not wait on, or fail because of, the network.
+"""
+
+import os
+import csv
+import json
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+
+from routing import SensorRouter
+
+# Incremented when the layout of the snapshot file changes, so that old snapshots
+# are ignored.
+SNAPSHOT_VERSION = 1
+
+
+def read_mapping_source(config):
+    """Reads and returns the dictionary mapping sensor IDs to BMON server IDs from the
+    'sensor_to_bmon_file' in 'config'.
+    """
+    # The file name
+    # comes from the config file and is either a SQLite database (if the file
+    # extension is .sqlite), a CSV file (if the file extension is .csv), or
+    # the name of a Google Sheets spreadsheet (if there is no file extension).
+    id_to_bmon_fn = Path(config['sensor_to_bmon_file'])
+    if id_to_bmon_fn.suffix.lower() == '.sqlite':
+        conn = sqlite3.connect(id_to_bmon_fn)
+        with conn:
+            cur = conn.cursor()
+            cur.execute('SELECT sensor_id, bmon_id from sensor_target')
+            rows = cur.fetchall()
+            id_to_bmon = dict(rows)
+
+    elif id_to_bmon_fn.suffix.lower() ==  '.csv':
+        id_to_bmon = {}
+        with open(id_to_bmon_fn) as csvfile:
+            filereader = csv.reader(csvfile)
+            for row in filereader:
+                if len(row) != 2:
+                    continue
+                id_to_bmon[row[0].strip()] = row[1].strip()
+
+    elif id_to_bmon_fn.suffix == '':
+        # no file extension so this must be a Google Sheets document.  The Google
+        # packages are only imported when needed, as they are slow to import.
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+
+        scope = ['https://spreadsheets.google.com/feeds',
+                 'https://www.googleapis.com/auth/drive']
+        creds = ServiceAccountCredentials.from_json_keyfile_name(
+            config['google_credentials_file'], scope)
+        client = gspread.authorize(creds)
+        sheet = client.open(config['sensor_to_bmon_file']).sheet1
+        id_to_bmon = {}
+        for rec in sheet.get_all_records():
+            id_to_bmon[rec['sensor_id'].strip()] = rec['bmon_id'].strip()
+
+    else:
+        raise TypeError('Invalid extension for configuration file.')
+
+    return id_to_bmon
+
+
+class SensorMapping:
+    """Provides the mapping of sensor IDs to BMON server IDs, using a local snapshot
+    of the mapping when possible.  The mapping is held by a SensorRouter object in the
+    'id_to_bmon' attribute, which is updated in place when the mapping is refreshed, so
+    Readers holding it see the new mapping.
+    """
+
+    def __init__(self, config, snapshot_file, ttl=3600):
+        """'config' is the configuration file dictionary.  'snapshot_file' is the path
+        to the file used to store the snapshot of the mapping.  'ttl' is the number of
+        seconds that a snapshot of a Google Sheets mapping is used before it is
+        refreshed.
+        """
+        self.source = config.get('sensor_to_bmon_file')
+        self.config = config
+        self.snapshot_file = Path(snapshot_file)
+        self.ttl = ttl
+        self.id_to_bmon = SensorRouter()
+        self.saved_time = None          # time that the mapping in use was read from its source
+        self.version = None             # source_version() of the mapping in use
+        self.refresh_thread = None
+
+    def source_version(self):
+        """Returns a value that changes when the mapping source changes, or None if that
+        can't be determined, as for a Google Sheet.
+        """
+        if Path(self.source).suffix == '':
+            return None
+        st = os.stat(self.source)
+        return [st.st_size, st.st_mtime]
+
+    def load(self, force_refresh=False):
+        """Loads the mapping and returns the 'id_to_bmon' SensorRouter.  If 'force_refresh'
+        is True, the mapping is read from its source even if the snapshot is valid,
+        though the snapshot is still used if reading the source fails.
+        """
+        if self.source is None:
+            # No mapping file, so presumably every file source will have a
+            # default bmon location.
+            self.id_to_bmon.set_mapping({})
+            return self.id_to_bmon
+
+        start = time.time()
+        snapshot = self.read_snapshot()
+        version = self.source_version()
+
+        if snapshot and not force_refresh:
+            if version is not None:
+                fresh = snapshot['source_version'] == version
+            else:
+                fresh = time.time() - snapshot['saved'] < self.ttl
+            if fresh or version is None:
+                self.update(snapshot['map'], snapshot['saved'], snapshot['source_version'])
+                elapsed = time.time() - start
+                logging.info('Loaded mapping for %d sensors and %d routing rules from snapshot '
+                             'in %.2f s, saving about %.2f s of startup time.' %
+                             (len(self.id_to_bmon.exact), self.id_to_bmon.rule_count, elapsed, 
+                              snapshot['load_secs'] - elapsed))
+                if not fresh:
+                    # a stale Google Sheets snapshot: refresh it in the background.
+                    self.refresh_in_background()
+                return self.id_to_bmon
+
+        try:
+            self.refresh()
+        except:
+            if snapshot is None:
+                raise
+            logging.exception('Error reading sensor mapping; using the snapshot saved at %s.' %
+                              time.ctime(snapshot['saved']))
+            self.update(snapshot['map'], snapshot['saved'], snapshot['source_version'])
+
+        return self.id_to_bmon
+
+    def refresh(self):
+        """Reads the mapping from its source, updates 'id_to_bmon' and saves a new
+        snapshot.
+        """
+        start = time.time()
+        version = self.source_version()
+        new_map = read_mapping_source(self.config)
+        load_secs = time.time() - start
+        self.update(new_map, start, version)
+        logging.info('Read mapping for %d sensors and %d routing rules from %s in %.2f s.' %
+                     (len(self.id_to_bmon.exact), self.id_to_bmon.rule_count, self.source, 
+                      load_secs))
+        self.save_snapshot(new_map, version, start, load_secs)
+
+    def refresh_in_background(self):
+        """Refreshes the mapping in a background thread, if a refresh is not already
+        running.  Errors are logged and the current mapping is kept.
+        """
+        if self.refresh_thread is not None and self.refresh_thread.is_alive():
+            return
+
+        def run():
+            try:
+                self.refresh()
+            except:
+                logging.exception('Error refreshing sensor mapping; keeping the current mapping.')
+
+        # Not a daemon thread, so a refresh that is underway finishes before the
+        # script exits.
+        self.refresh_thread = threading.Thread(target=run)
+        self.refresh_thread.start()
+
+    def refresh_if_stale(self):
+        """Refreshes the mapping in the background if it was read from its source
+        more than 'ttl' seconds ago, or if the mapping file has changed.  Used
+        to keep the mapping current in long-running processes.
+        """
+        if self.source is None or self.saved_time is None:
+            return
+        try:
+            version = self.source_version()
+        except OSError:
+            return      # mapping file is missing for the moment; keep the current mapping
+        if version is None:
+            if time.time() - self.saved_time > self.ttl:
+                self.refresh_in_background()
+                self.saved_time = time.time()     # don't retry until another 'ttl' passes
+        elif version != self.version:
+            self.refresh_in_background()
+            self.version = version
+
+    def update(self, new_map, saved_time, version):
+        """Updates 'id_to_bmon' in place to hold the mapping 'new_map'.
+        """
+        self.id_to_bmon.set_mapping(new_map)
+        for msg in self.id_to_bmon.bad_rules:
+            logging.error(f'Skipping routing rule in sensor mapping. {msg}')
+        self.saved_time = saved_time
+        self.version = version
+
+    def read_snapshot(self):
+        """Returns the snapshot dictionary, or None if there is no usable snapshot for
+        the current mapping source.
+        """
+        try:
+            with open(self.snapshot_file) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except:
+            logging.exception('Error reading sensor mapping snapshot.')
+            return None
+        if snapshot.get('version') != SNAPSHOT_VERSION or \
+                snapshot.get('source') != str(self.source):
+            return None
+        return snapshot
+
+    def save_snapshot(self, new_map, version, saved_time, load_secs):
+        """Saves the mapping 'new_map' to the snapshot file, replacing the file
+        atomically so a partly-written snapshot is never read.
+        """
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'source': str(self.source),
+            'source_version': version,
+            'saved': saved_time,
+            'load_secs': load_secs,
+            'map': new_map,
+        }
+        tmp_file = self.snapshot_file.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp_file, self.snapshot_file)
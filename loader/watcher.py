@@ -0,0 +1,81 @@
+"""Watches directories for new or changed files, for use by the daemon mode of
+process_files.py.  Uses Linux inotify through the inotify_simple package when it
+is installed, and otherwise falls back to polling the directories with os.scandir().
+"""
+
+import os
+import time
+import logging
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+
+class DirectoryWatcher:
+    """Waits for files to be added to, or changed in, a set of directories.
+    """
+
+    def __init__(self, directories, poll_interval=5.0):
+        """'directories' is a list of directory paths to watch.  'poll_interval' is
+        the number of seconds between scans of the directories when inotify is not
+        available.
+        """
+        self.directories = [str(d) for d in directories]
+        self.poll_interval = poll_interval
+        self.inotify = None
+        if INotify is not None:
+            try:
+                self.inotify = INotify()
+                watch_flags = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.MODIFY
+                for d in self.directories:
+                    self.inotify.add_watch(d, watch_flags)
+                logging.info('Watching directories with inotify.')
+            except OSError:
+                logging.exception('Error setting up inotify; polling directories instead.')
+                self.inotify = None
+        if self.inotify is None:
+            self.snapshot = self.scan()
+
+    def scan(self):
+        """Returns a dictionary keyed on file path of the (size, modification time)
+        of each file in the watched directories.
+        """
+        files = {}
+        for d in self.directories:
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if entry.is_file():
+                            st = entry.stat()
+                            files[entry.path] = (st.st_size, st.st_mtime_ns)
+            except FileNotFoundError:
+                pass
+        return files
+
+    def wait(self, timeout):
+        """Waits up to 'timeout' seconds for a file to be added or changed in one
+        of the directories.  Returns True if a change was seen.
+        """
+        if self.inotify is not None:
+            events = self.inotify.read(timeout=int(timeout * 1000))
+            return len(events) > 0
+
+        # Poll the directories, only looking for new or changed files, as files
+        # are deleted by the loading process.
+        deadline = time.time() + timeout
+        while True:
+            files = self.scan()
+            changed = any(self.snapshot.get(path) != info for path, info in files.items())
+            self.snapshot = files
+            if changed:
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.poll_interval, remaining))
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
@@ -0,0 +1,106 @@
+"""Test configuration.  The loader modules import each other as top-level modules
+(e.g. 'from metrics import ...'), as they do when loader/process_files.py is run,
+so the loader and tools directories are put on the module search path.
+"""
+import sys
+import json
+import gzip
+import threading
+import http.server
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+for dir_name in ('loader', 'tools'):
+    sys.path.insert(0, str(ROOT / dir_name))
+
+from poster.queue_limits import QueueFullError
+
+
+class FakePoster:
+    """Stands in for an HttpPoster, recording the readings added to it.  After
+    'fail_after' calls to add_readings_many(), it raises 'error', by default the
+    QueueFullError of a full queue with the 'fail' policy.
+    """
+
+    def __init__(self, fail_after=None, error=QueueFullError):
+        self.readings = []
+        self.calls = 0
+        self.fail_after = fail_after
+        self.error = error
+
+    def add_readings_many(self, reading_data_list):
+        if self.fail_after is not None and self.calls >= self.fail_after:
+            raise self.error('Could not add readings to the posting queue.')
+        self.calls += 1
+        for readings in reading_data_list:
+            self.readings.extend(readings)
+
+
+@pytest.fixture
+def fake_poster():
+    return FakePoster()
+
+
+class BMONHandler(http.server.BaseHTTPRequestHandler):
+    """Handles the requests to a BMONServer.
+    """
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        self.send_response(self.server.respond(json.loads(body)))
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def do_HEAD(self):
+        self.send_response(503 if self.server.down else 200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class BMONServer(http.server.ThreadingHTTPServer):
+    """A local stand-in for the reading storage URL of a BMON server.  Stores the
+    posted readings, except that it returns a server error while 'down' is True or
+    'errors' is above 0, and rejects posts holding a sensor ID in 'bad_ids' with a
+    400 status, or every post if 'reject_all' is True.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), BMONHandler)
+        self.url = f'http://127.0.0.1:{self.server_port}/readings/store/'
+        self.readings = []
+        self.posts = []          # (status, number of readings) of each post
+        self.down = False
+        self.errors = 0
+        self.bad_ids = set()
+        self.reject_all = False
+        self.lock = threading.Lock()
+
+    def respond(self, data):
+        readings = data['readings']
+        with self.lock:
+            if self.down or self.errors > 0:
+                self.errors -= 1
+                status = 500
+            elif self.reject_all or any(rd[1] in self.bad_ids for rd in readings):
+                status = 400
+            else:
+                self.readings.extend(tuple(rd) for rd in readings)
+                status = 200
+            self.posts.append((status, len(readings)))
+        return status
+
+
+@pytest.fixture
+def bmon_server():
+    server = BMONServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,81 @@
+"""Tests of AsyncHttpPoster posting to a local stand-in for a BMON server.
+"""
+import threading
+
+import pytest
+
+from poster.asyncPoster import AsyncHttpPoster
+from poster.httpPoster import BMSreadConverter
+
+READINGS = [(1600000000 + 900 * i, f'sensor_{i % 5}', float(i)) for i in range(40)]
+
+
+@pytest.fixture
+def make_poster(tmp_path, bmon_server):
+    posters = []
+
+    def make(**kw):
+        poster = AsyncHttpPoster(bmon_server.url, BMSreadConverter('key'),
+                                 post_q_filename=tmp_path / 'postQ.sqlite',
+                                 post_time_file=tmp_path / 'last_post_time',
+                                 bmon_id='test', **kw)
+        posters.append(poster)
+        return poster
+
+    yield make
+    for poster in posters:
+        poster.close()
+        poster.engine.join(5)
+        assert not poster.engine.is_alive()
+
+
+def chunks(readings, size):
+    return [readings[i:i + size] for i in range(0, len(readings), size)]
+
+
+def test_posts_all_readings(make_poster, bmon_server):
+    poster = make_poster(gzip_posts=True)
+    poster.add_readings_many(chunks(READINGS, 7))
+    assert poster.wait_until_done(timeout=10)
+    assert sorted(bmon_server.readings) == sorted(READINGS)
+
+
+def test_retries_after_server_error(make_poster, bmon_server):
+    bmon_server.errors = 2
+    # the circuit opens after the first failure and is probed quickly, so the post
+    # is retried without waiting for the retry delay.
+    poster = make_poster(breaker_failures=1, probe_interval=0.05)
+    poster.add_readings(READINGS[:10])
+    assert poster.wait_until_done(timeout=10)
+    assert bmon_server.readings == READINGS[:10]
+    assert [status for status, _ in bmon_server.posts] == [500, 500, 200]
+    assert poster.post_Q.dead_letter_count() == 0
+
+
+def test_rejected_reading_moved_to_dead_letters(make_poster, bmon_server):
+    bmon_server.bad_ids = {'bad'}
+    bad = (1600000000, 'bad', 1.0)
+    readings = READINGS[:5] + [bad] + READINGS[5:10]
+    poster = make_poster(reject_limit=1)
+    poster.add_readings(readings)
+    assert poster.wait_until_done(timeout=10)
+    assert sorted(bmon_server.readings) == sorted(READINGS[:10])
+    letters = poster.post_Q.dead_letters()
+    assert [item for _, item, _, _ in letters] == [{'storeKey': 'key', 'readings': [bad]}]
+    assert letters[0][3].startswith('Status 400')
+
+
+def test_queue_work_runs_off_the_event_loop(make_poster, bmon_server):
+    poster = make_poster()
+    threads = {'pop_many': set(), 'finished_many': set()}
+    q = poster.post_Q
+    for name in threads:
+        method = getattr(q, name)
+        def record(*args, name=name, method=method):
+            threads[name].add(threading.get_ident())
+            return method(*args)
+        setattr(q, name, record)
+    poster.add_readings_many(chunks(READINGS, 10))
+    assert poster.wait_until_done(timeout=10)
+    assert threads['pop_many'] and threads['finished_many']
+    assert poster.engine.ident not in threads['pop_many'] | threads['finished_many']
@@ -0,0 +1,54 @@
+"""Tests of the conversion of AVEC XML meter files by tools/avec_xml_to_csv.py.
+"""
+from avec_xml_to_csv import iter_xml_readings, parse_xml_file
+
+
+def meter_xml(sn, direction, readings):
+    rdgs = ''.join(f'<Reading TimeStamp="{ts}" RawReading="{raw}"/>' for ts, raw in readings)
+    return (f'<MeterReadings><Meter SerialNumber=" {sn} " TimeZoneOffset="540"/>'
+            f'<IntervalData><IntervalSpec Interval="15" Direction="{direction}"/>{rdgs}'
+            '</IntervalData></MeterReadings>')
+
+
+def write_xml(path, meters):
+    path.write_text('<?xml version="1.0"?><ReadingExport>' + ''.join(meters) +
+                    '</ReadingExport>')
+    return path
+
+
+# 2021-01-01 00:00:00 local time with a 540 minute offset, plus half of the interval
+TS0 = 1609491600 + 450.0
+
+
+def test_two_way_records_combined_when_not_adjacent(tmp_path):
+    fn = write_xml(tmp_path / 'meters.xml', [
+        meter_xml('111', 'Delivered', [('2021-01-01 00:00:00', 2),
+                                       ('2021-01-01 00:15:00', 3)]),
+        meter_xml('222', 'Delivered', [('2021-01-01 00:00:00', 5)]),
+        meter_xml('111', 'Received', [('2021-01-01 00:00:00', 0.5),
+                                      ('2021-01-01 00:30:00', 1)]),
+    ])
+    assert parse_xml_file(fn) == [
+        ('111', TS0, 6.0),
+        ('111', TS0 + 900, 12.0),
+        ('222', TS0, 20.0),
+        ('111', TS0 + 1800, -4.0),
+    ]
+
+
+def test_bad_meter_keeps_other_readings(tmp_path):
+    fn = write_xml(tmp_path / 'meters.xml', [
+        '<MeterReadings><IntervalData/></MeterReadings>',
+        meter_xml('111', 'Delivered', [('2021-01-01 00:00:00', 2), ('bad', 3)]),
+    ])
+    assert parse_xml_file(fn) == [('111', TS0, 8.0)]
+
+
+def test_pending_readings_are_bounded(tmp_path):
+    times = [f'2021-01-01 {h:02d}:00:00' for h in range(10)]
+    fn = write_xml(tmp_path / 'meters.xml',
+                   [meter_xml(str(sn), 'Delivered', [(t, 1) for t in times])
+                    for sn in range(5)])
+    readings = list(iter_xml_readings(fn, max_pending=20))
+    assert readings == parse_xml_file(fn)
+    assert len(readings) == 50
@@ -0,0 +1,52 @@
+"""Tests that a file whose loading stops part way, because a posting queue is full,
+is left in place and resumed from its checkpoint without losing readings.
+"""
+import pytest
+
+from readers import mea
+from readers.checkpoint import FileCheckpoints, Checkpoint
+from conftest import FakePoster
+
+LINES = [f'mea_{i % 7},{1600000000 + 900 * i},{i}' for i in range(500)]
+READINGS = [(1600000000 + 900 * i, f'mea_{i % 7}', float(i)) for i in range(500)]
+
+
+def make_reader(tmp_path, poster, binary=True):
+    reader = mea.Reader(str(tmp_path / '*.csv'), {'bmon': poster}, default_bmon='bmon',
+                        chunk_size=20, block_size=30, checkpoint=True,
+                        checkpoint_file=tmp_path / 'checkpoints.sqlite',
+                        checkpoint_interval=60)
+    reader.binary_lines = binary
+    return reader
+
+
+@pytest.mark.parametrize('binary', [True, False])
+def test_resume_after_full_queue(tmp_path, binary):
+    fn = tmp_path / 'data.csv'
+    fn.write_text('id,ts,val\n' + ''.join(lin + '\n' for lin in LINES))
+
+    full = FakePoster(fail_after=5)
+    make_reader(tmp_path, full, binary).load()
+    assert fn.exists()
+    cp = FileCheckpoints(tmp_path / 'checkpoints.sqlite').get(fn)
+    assert cp is not None and 0 < cp.line_count < len(LINES)
+    # everything before the checkpoint was queued.
+    assert full.readings[:cp.line_count] == READINGS[:cp.line_count]
+
+    poster = FakePoster()
+    make_reader(tmp_path, poster, binary).load()
+    assert not fn.exists()
+    assert poster.readings == READINGS[cp.line_count:]
+    assert (tmp_path / 'completed' / 'data_ok.csv').read_text() == \
+        'id,ts,val\n' + ''.join(lin + '\n' for lin in LINES)
+    assert FileCheckpoints(tmp_path / 'checkpoints.sqlite').get(fn) is None
+
+
+def test_changed_file_ignores_checkpoint(tmp_path):
+    fn = tmp_path / 'data.csv'
+    fn.write_text('id,ts,val\n' + LINES[0] + '\n')
+    checkpoints = FileCheckpoints(tmp_path / 'checkpoints.sqlite')
+    checkpoints.save(fn, Checkpoint(12, 1, 1, 0, 10, 10))
+    assert checkpoints.get(fn).offset == 12
+    fn.write_text('id,ts,val\n' + LINES[0] + '\n' + LINES[1] + '\n')
+    assert checkpoints.get(fn) is None
@@ -0,0 +1,67 @@
+"""Tests of the CircuitBreaker, probing a local HTTP server.
+"""
+import threading
+import http.server
+
+from poster.circuit import CircuitBreaker, OPEN, CLOSED
+
+
+class HeadHandler(http.server.BaseHTTPRequestHandler):
+    status = 503
+
+    def do_HEAD(self):
+        self.send_response(self.server.status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(status):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), HeadHandler)
+    server.status = status
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/readings/store/'
+
+
+def test_opens_after_threshold_and_closes_on_success():
+    breaker = CircuitBreaker('http://127.0.0.1:9/', 'test', failure_threshold=3,
+                             probe_interval=60)
+    changes = []
+    breaker.add_listener(changes.append)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open
+    breaker.record_failure()
+    breaker.record_success()
+    assert not breaker.is_open
+    assert changes == [OPEN, CLOSED]
+
+
+def test_probe_closes_circuit_and_wakes_waiters():
+    server, url = start_server(503)
+    try:
+        breaker = CircuitBreaker(url, 'test', failure_threshold=1, probe_interval=0.05)
+        breaker.record_failure()
+        assert breaker.is_open
+        woken = []
+        t = threading.Thread(target=lambda: woken.append(breaker.wait_after_failure(60)))
+        t.start()
+        t.join(0.3)
+        assert t.is_alive()     # the server still returns server errors
+        server.status = 200
+        t.join(5)
+        assert woken == [True]
+        assert breaker.state == CLOSED
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_wait_after_failure_times_out_while_closed():
+    breaker = CircuitBreaker('http://127.0.0.1:9/', 'test')
+    assert breaker.wait_after_failure(0.01) is False
@@ -0,0 +1,62 @@
+"""Tests that the high-water marks skip readings posted by earlier runs without
+dropping readings of the current run, whatever order its files are processed in.
+"""
+import pytest
+
+from readers import mea
+from readers.dedup import HighWaterMarks
+from conftest import FakePoster
+
+
+def write_file(path, readings):
+    path.write_text('id,ts,val\n' + ''.join(f'{id},{ts},{val}\n' for ts, id, val in readings))
+
+
+def make_reader(tmp_path, poster, max_workers=1):
+    return mea.Reader(str(tmp_path / '*.csv'), {'bmon': poster}, default_bmon='bmon',
+                      chunk_size=10, block_size=10, max_workers=max_workers, dedup=True,
+                      dedup_file=tmp_path / 'high_water.sqlite')
+
+
+def readings(start, count, sensor='mea_1'):
+    return [(1600000000 + 900 * i, sensor, float(i)) for i in range(start, start + count)]
+
+
+@pytest.mark.parametrize('max_workers', [1, 4])
+def test_newer_file_first_keeps_older_readings(tmp_path, max_workers):
+    # the newer readings are in the file processed first.
+    write_file(tmp_path / 'a_newer.csv', readings(50, 50))
+    for i in range(5):
+        write_file(tmp_path / f'b_older_{i}.csv', readings(10 * i, 10))
+    poster = FakePoster()
+    make_reader(tmp_path, poster, max_workers).load()
+    assert sorted(poster.readings) == readings(0, 100)
+
+    # a later run skips readings at or before the marks raised by this run.
+    write_file(tmp_path / 'resent.csv', readings(90, 20) + readings(0, 5, 'mea_2'))
+    poster = FakePoster()
+    make_reader(tmp_path, poster).load()
+    assert sorted(poster.readings) == sorted(readings(100, 10) + readings(0, 5, 'mea_2'))
+    marks = HighWaterMarks(tmp_path / 'high_water.sqlite')
+    assert marks.get('mea_1') == 1600000000 + 900 * 109
+
+
+def test_unordered_lines_within_file(tmp_path):
+    rds = readings(0, 30)
+    write_file(tmp_path / 'data.csv', rds[20:] + rds[:20])
+    poster = FakePoster()
+    make_reader(tmp_path, poster).load()
+    assert sorted(poster.readings) == rds
+
+
+def test_marks_only_raised_for_queued_readings(tmp_path):
+    write_file(tmp_path / 'data.csv', readings(0, 30))
+    full = FakePoster(fail_after=0)
+    make_reader(tmp_path, full).load()
+    assert full.readings == []
+    assert HighWaterMarks(tmp_path / 'high_water.sqlite').get('mea_1') is None
+    assert (tmp_path / 'data.csv').exists()
+
+    poster = FakePoster()
+    make_reader(tmp_path, poster).load()
+    assert poster.readings == readings(0, 30)
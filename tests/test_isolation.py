@@ -0,0 +1,60 @@
+"""Tests that both posting engines isolate the readings a server rejects, and wait
+out a server that rejects every post instead of moving readings to the dead letter
+table.
+"""
+import threading
+
+import pytest
+
+from poster.httpPoster import HttpPoster, BMSreadConverter
+from poster.asyncPoster import AsyncHttpPoster
+
+READINGS = [(1600000000 + 900 * i, f'sensor_{i}', float(i)) for i in range(16)]
+
+
+@pytest.fixture(params=[HttpPoster, AsyncHttpPoster])
+def make_poster(request, tmp_path, bmon_server):
+    posters = []
+
+    def make():
+        # the circuit breaker ends the retry delay quickly after a failed post.
+        poster = request.param(bmon_server.url, BMSreadConverter('key'),
+                               post_q_filename=tmp_path / 'postQ.sqlite',
+                               post_time_file=tmp_path / 'last_post_time',
+                               bmon_id='test', reject_limit=1, breaker_failures=1,
+                               probe_interval=0.05)
+        posters.append(poster)
+        return poster
+
+    yield make
+    for poster in posters:
+        if isinstance(poster, AsyncHttpPoster):
+            poster.close()
+
+
+def dead_readings(poster):
+    return sorted(rd for _, item, _, _ in poster.post_Q.dead_letters()
+                  for rd in item['readings'])
+
+
+def test_bad_readings_in_both_halves(make_poster, bmon_server):
+    bad = [READINGS[2], READINGS[13]]
+    bmon_server.bad_ids = {rd[1] for rd in bad}
+    poster = make_poster()
+    poster.add_readings(READINGS)
+    assert poster.wait_until_done(timeout=10)
+    assert sorted(bmon_server.readings) == [rd for rd in READINGS if rd not in bad]
+    assert dead_readings(poster) == bad
+    assert all(len(item['readings']) == 1 for _, item, _, _ in poster.post_Q.dead_letters())
+
+
+def test_server_rejecting_every_post(make_poster, bmon_server):
+    bmon_server.reject_all = True
+    poster = make_poster()
+    poster.add_readings(READINGS)
+    timer = threading.Timer(0.5, setattr, (bmon_server, 'reject_all', False))
+    timer.start()
+    assert poster.wait_until_done(timeout=10)
+    timer.join()
+    assert sorted(bmon_server.readings) == READINGS
+    assert poster.post_Q.dead_letter_count() == 0
@@ -0,0 +1,68 @@
+"""Tests that a file is only deleted once all of its readings are in the posting
+queues, and is left for a later run if they cannot be queued.
+"""
+import sqlite3
+
+import pytest
+
+from readers import mea
+from conftest import FakePoster
+
+LINES = [f'mea_{i % 3},{1600000000 + 900 * i},{i}' for i in range(95)]
+READINGS = [(1600000000 + 900 * i, f'mea_{i % 3}', float(i)) for i in range(95)]
+
+
+def make_reader(tmp_path, poster):
+    return mea.Reader(str(tmp_path / '*.csv'), {'bmon': poster}, default_bmon='bmon',
+                      chunk_size=20, block_size=30)
+
+
+def write_file(tmp_path):
+    fn = tmp_path / 'data.csv'
+    fn.write_text('id,ts,val\n' + ''.join(lin + '\n' for lin in LINES))
+    return fn
+
+
+# the first call adds a block's full chunks, and the last call, the final partial chunk.
+@pytest.mark.parametrize('fail_after', [0, 2, 3])
+def test_queue_error_keeps_file(tmp_path, fail_after):
+    fn = write_file(tmp_path)
+    broken = FakePoster(fail_after, sqlite3.OperationalError)
+    reader = make_reader(tmp_path, broken)
+    reader.load([str(fn)])
+    assert fn.exists()
+    assert len(broken.readings) < len(READINGS)
+    # the readings that could not be queued are kept in the buffer, in order.
+    queued = len(broken.readings)
+    kept = reader.rd_buffer['bmon'].take_chunks(1000, flush=True)[0]
+    assert broken.readings + kept == READINGS[:queued + len(kept)]
+
+    # an unchanged file that failed is not picked up again right away.
+    assert reader.find_files() == ([], 0)
+
+    poster = FakePoster()
+    make_reader(tmp_path, poster).load()
+    assert not fn.exists()
+    assert poster.readings == READINGS
+
+
+def test_file_deleted_after_readings_queued(tmp_path):
+    fn = write_file(tmp_path)
+    poster = FakePoster()
+    reader = make_reader(tmp_path, poster)
+    queued = []
+    reader.load_file = lambda fn, load_file=reader.load_file: (
+        load_file(fn), queued.append(len(poster.readings)))
+    reader.load()
+    assert not fn.exists()
+    # the final partial chunk was queued before the file was finished.
+    assert queued == [len(READINGS)]
+
+
+def test_unreadable_file_is_kept(tmp_path):
+    fn = tmp_path / 'data.csv'
+    fn.write_bytes(b'\xff\xfe header\n' + LINES[0].encode() + b'\n')
+    reader = make_reader(tmp_path, FakePoster())
+    reader.binary_lines = False
+    reader.load()
+    assert fn.exists()
@@ -0,0 +1,80 @@
+"""Tests of the policies QueueLimits applies when a posting queue is over its limits.
+"""
+import threading
+import time
+
+import pytest
+
+from poster.sqlite_queue import SqliteReliableQueue
+from poster.queue_limits import QueueLimits, QueueFullError
+
+
+def make_queue(tmp_path):
+    return SqliteReliableQueue(tmp_path / 'queue.sqlite')
+
+
+def test_fail_policy_raises(tmp_path):
+    q = make_queue(tmp_path)
+    limits = QueueLimits(q, 'test', max_items=5, policy='fail', check_interval=0)
+    assert limits.admit([1, 2, 3])
+    q.extend([1, 2, 3])
+    assert limits.admit([4, 5])
+    q.extend([4, 5])
+    with pytest.raises(QueueFullError):
+        limits.admit([6])
+    # the queue must drain below the resume fraction of the limit
+    items = q.pop_many(1)
+    q.finished_many([id for id, _ in items])
+    with pytest.raises(QueueFullError):
+        limits.admit([6])
+    items = q.pop_many(1)
+    q.finished_many([id for id, _ in items])
+    assert limits.admit([6])
+
+
+def test_estimate_catches_additions_between_checks(tmp_path):
+    q = make_queue(tmp_path)
+    limits = QueueLimits(q, 'test', max_items=5, policy='fail', check_interval=3600)
+    for i in range(5):
+        assert limits.admit([i])
+        q.extend([i])
+    with pytest.raises(QueueFullError):
+        limits.admit([5])
+
+
+def test_block_policy_waits_for_room(tmp_path):
+    q = make_queue(tmp_path)
+    limits = QueueLimits(q, 'test', max_items=2, policy='block', check_interval=0)
+    q.extend([1, 2])
+    admitted = threading.Event()
+    t = threading.Thread(target=lambda: limits.admit([3]) and admitted.set())
+    t.start()
+    assert not admitted.wait(0.3)
+    items = q.pop_many(2)
+    q.finished_many([id for id, _ in items])
+    assert admitted.wait(5)
+    t.join(5)
+
+
+def test_spill_policy_keeps_order(tmp_path):
+    q = make_queue(tmp_path)
+    limits = QueueLimits(q, 'test', max_items=2, policy='spill',
+                         spill_dir=tmp_path / 'spill', check_interval=0)
+    for i in range(5):
+        if limits.admit([i]):
+            q.extend([i])
+    assert list(q) == [0, 1]
+    assert limits.spilled_count() == 3
+
+    # as the queue is posted, the spilled items are moved into it in order.
+    posted = []
+    deadline = time.time() + 10
+    while len(posted) < 5 and time.time() < deadline:
+        items = q.pop_many(1, sleep_wait=False)
+        if items:
+            posted.extend(item for _, item in items)
+            q.finished_many([id for id, _ in items])
+        else:
+            time.sleep(0.01)
+    assert posted == [0, 1, 2, 3, 4]
+    assert limits.spill_segments() == []
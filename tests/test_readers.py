@@ -0,0 +1,76 @@
+"""Tests of the block parsing of the Readers: columnar parsing of text and bytes
+lines, the fallback that finds the bad lines in a block, and routing.
+"""
+import pytest
+
+from readers import mea, avec
+from conftest import FakePoster
+
+MEA_LINES = [
+    'mea_1,1600000000,1.5',
+    'mea_2,1600000900,2.0',
+    'mea_1,not a time,3.0',
+    'mea_3,1600001800',
+    'mea_2,1600002700,4.25',
+]
+
+
+def write_file(path, header, lines):
+    path.write_text(header + ''.join(lin + '\n' for lin in lines))
+    return path
+
+
+@pytest.mark.parametrize('binary', [True, False])
+def test_mea_parse_block(binary):
+    reader = mea.Reader('/tmp/*.csv', {})
+    lines = [lin.encode() for lin in MEA_LINES] if binary else MEA_LINES
+    block = reader.parse_lines(lines)
+    assert sorted(block.error_lines) == [2, 3]
+    assert list(block.line_nums) == [0, 1, 4]
+    assert list(block.sensor_ids) == ['mea_1', 'mea_2', 'mea_2']
+    assert list(block.ts) == [1600000000.0, 1600000900.0, 1600002700.0]
+    assert list(block.values) == [1.5, 2.0, 4.25]
+
+
+def test_avec_requires_three_fields():
+    reader = avec.Reader('/tmp/*.csv', {})
+    block = reader.parse_lines([b'123,1600000000,5', b'123,1600000000',
+                                b' 456 ,1600000900,6'])
+    assert block.error_lines == [1]
+    assert list(block.sensor_ids) == ['avec_123', 'avec_456']
+    assert list(block.values) == [5.0, 6.0]
+
+
+@pytest.mark.parametrize('binary', [True, False])
+def test_load_writes_completed_and_errors(tmp_path, binary):
+    write_file(tmp_path / 'data.csv', 'id,ts,val\n', MEA_LINES)
+    poster = FakePoster()
+    reader = mea.Reader(str(tmp_path / '*.csv'), {'bmon': poster},
+                        id_to_bmon={'mea_1': 'bmon', 'mea_2': 'bmon'}, block_size=2)
+    reader.binary_lines = binary
+    reader.load()
+    assert not (tmp_path / 'data.csv').exists()
+    assert (tmp_path / 'completed' / 'data_ok.csv').read_text() == \
+        'id,ts,val\n' + ''.join(MEA_LINES[i] + '\n' for i in (0, 1, 4))
+    assert (tmp_path / 'errors' / 'data_err.csv').read_text() == \
+        'id,ts,val\n' + ''.join(MEA_LINES[i] + '\n' for i in (2, 3))
+    assert poster.readings == [(1600000000, 'mea_1', 1.5), (1600000900, 'mea_2', 2.0),
+                               (1600002700, 'mea_2', 4.25)]
+
+
+def test_unrouted_sensors_are_errors(tmp_path):
+    lines = ['mea_1,1600000000,1', 'other,1600000000,2', 'mea_1,1600000900,3']
+    write_file(tmp_path / 'data.csv', 'id,ts,val\n', lines)
+    posters = {'a': FakePoster(), 'b': FakePoster()}
+    reader = mea.Reader(str(tmp_path / '*.csv'), posters, id_to_bmon={'mea_1': 'a'})
+    reader.load()
+    assert posters['a'].readings == [(1600000000, 'mea_1', 1.0), (1600000900, 'mea_1', 3.0)]
+    assert posters['b'].readings == []
+    assert (tmp_path / 'errors' / 'data_err.csv').read_text() == \
+        'id,ts,val\nother,1600000000,2\n'
+
+    write_file(tmp_path / 'data.csv', 'id,ts,val\n', lines)
+    reader = mea.Reader(str(tmp_path / '*.csv'), posters, id_to_bmon={'mea_1': 'a'},
+                        default_bmon='b')
+    reader.load()
+    assert posters['b'].readings == [(1600000000, 'other', 2.0)]
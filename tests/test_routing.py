@@ -0,0 +1,50 @@
+"""Tests of the routing rules of SensorRouter.
+"""
+from routing import SensorRouter, is_rule
+
+
+def test_rules_and_precedence():
+    router = SensorRouter({
+        'gvea_42': 'exact',
+        'gvea_*': 'prefix',
+        'cea_1??': 'glob',
+        r're:ses_\d+_kwh': 'regex',
+        'range:mea_1000-1999': 'range',
+        'mea_*': 'later',
+    })
+    assert router.get('gvea_42') == 'exact'
+    assert router.get('gvea_7') == 'prefix'
+    assert router.get('cea_123') == 'glob'
+    assert router.get('cea_1234') is None
+    assert router.get('ses_17_kwh') == 'regex'
+    assert router.get('ses_17_kwh_x') is None
+    assert router.get('mea_1500') == 'range'
+    assert router.get('mea_2000') == 'later'      # first matching rule wins
+    assert router.get('other', 'default') == 'default'
+    assert router.rule_count == 5 and len(router.exact) == 1
+
+
+def test_bad_rules_are_skipped():
+    router = SensorRouter({'re:(': 'a', 'range:abc': 'b', 'x_*': 'c'})
+    assert len(router.bad_rules) == 2
+    assert router.rule_count == 1
+    assert router.get('x_1') == 'c'
+
+
+def test_numeric_sensor_ids():
+    assert not is_rule(1234)
+    router = SensorRouter({1234: 'numeric', 'gvea_*': 'prefix'})
+    assert router.get(1234) == 'numeric'
+    assert router.get(5678) is None
+    assert router.get('gvea_1') == 'prefix'
+
+
+def test_set_mapping_swaps_whole_table():
+    router = SensorRouter({'s_1': 'a', 's_*': 'a'})
+    old = router.table
+    assert router.get('s_2') == 'a'
+    router.set_mapping({'s_1': 'b', 's_*': 'b'})
+    # a lookup that started with the old mapping sees only the old mapping.
+    assert old.exact == {'s_1': 'a'} and old.lookup('s_2') == 'a'
+    assert router.table is not old
+    assert router.get('s_1') == router.get('s_2') == 'b'
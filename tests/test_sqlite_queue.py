@@ -0,0 +1,66 @@
+"""Tests of the batched operations and reliability of SqliteReliableQueue.
+"""
+import threading
+
+from poster.sqlite_queue import SqliteReliableQueue
+
+
+def make_queue(tmp_path):
+    return SqliteReliableQueue(tmp_path / 'queue.sqlite', journal_mode='WAL',
+                               synchronous='NORMAL')
+
+
+def test_pop_many_in_order(tmp_path):
+    q = make_queue(tmp_path)
+    q.extend([[i] for i in range(10)])
+    assert len(q) == 10
+    items = q.pop_many(4)
+    assert [item for _, item in items] == [[0], [1], [2], [3]]
+    assert len(q) == 6
+    assert q.processing_count() == 4
+    rest = q.pop_many(100)
+    assert [item for _, item in rest] == [[i] for i in range(4, 10)]
+    assert q.pop_many(5, sleep_wait=False) == []
+
+
+def test_finished_many_removes_processing(tmp_path):
+    q = make_queue(tmp_path)
+    q.extend(['a', 'b', 'c'])
+    items = q.pop_many(3)
+    q.finished_many([id for id, _ in items[:2]])
+    assert list(q.iter_processing()) == ['c']
+    count, _, _ = q.stats()
+    assert count == 1
+
+
+def test_unfinished_items_restored_on_reopen(tmp_path):
+    q = make_queue(tmp_path)
+    q.extend(['a', 'b', 'c', 'd'])
+    items = q.pop_many(3)
+    q.finished(items[0][0])
+    # the process stops before 'b' and 'c' are finished.
+    q = make_queue(tmp_path)
+    assert q.processing_count() == 0
+    assert sorted(q) == ['b', 'c', 'd']
+
+
+def test_pop_many_waits_for_items(tmp_path):
+    q = make_queue(tmp_path)
+    result = []
+    t = threading.Thread(target=lambda: result.extend(q.pop_many(5)))
+    t.start()
+    q.extend(['x', 'y'])
+    t.join(5)
+    assert not t.is_alive()
+    assert [item for _, item in result] == ['x', 'y']
+
+
+def test_dead_letters_replay(tmp_path):
+    q = make_queue(tmp_path)
+    q.add_dead_letters([[(1, 'a', 1.0)], [(2, 'b', 2.0)]], 'HTTP 400')
+    assert q.dead_letter_count() == 2
+    letters = q.dead_letters()
+    assert [reason for _, _, _, reason in letters] == ['HTTP 400', 'HTTP 400']
+    assert q.remove_dead_letters([letters[1][0]], replay=True) == 1
+    assert list(q) == [[(2, 'b', 2.0)]]
+    assert q.dead_letter_count() == 1
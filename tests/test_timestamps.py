@@ -0,0 +1,63 @@
+"""Tests that the fast TimestampConverter gives the same timestamps as strptime()
+with pytz localize(), including around DST transitions.
+"""
+from datetime import datetime, timedelta
+import calendar
+
+import pytest
+import pytz
+
+from readers.timestamps import TimestampConverter
+
+FMT = '%Y-%m-%d %H:%M:%S'
+
+
+def localize_ts(tz, s, fmt):
+    dt = datetime.strptime(s, fmt).replace(microsecond=0)
+    return calendar.timegm(tz.localize(dt).utctimetuple())
+
+
+@pytest.mark.parametrize('tz_name', ['US/Alaska', 'Europe/London', 'UTC'])
+def test_matches_localize_around_dst(tz_name):
+    tz = pytz.timezone(tz_name)
+    conv = TimestampConverter(tz)
+    # every 7 minutes through the days around both 2020 DST transitions, which
+    # includes non-existent and ambiguous local times.
+    for start in (datetime(2020, 3, 7), datetime(2020, 10, 24), datetime(2020, 10, 31)):
+        for i in range(3 * 24 * 60 // 7):
+            s = (start + timedelta(minutes=7 * i, seconds=i % 60)).strftime(FMT)
+            assert conv.to_ts(s, FMT) == localize_ts(tz, s, FMT), s
+
+
+def test_fractional_seconds_and_alternative_formats():
+    tz = pytz.timezone('US/Alaska')
+    conv = TimestampConverter(tz)
+    fmt = '%Y-%m-%d %H:%M:%S.%f'
+    s = '2021-01-15 13:45:10.250'
+    assert conv.to_ts(s, fmt) == localize_ts(tz, s, fmt)
+    formats = ('%m/%d/%Y %H:%M', FMT)
+    assert conv.to_ts('2021-01-15 13:45:10', formats) == \
+        localize_ts(tz, '2021-01-15 13:45:10', FMT)
+    assert conv.to_ts('1/15/2021 13:45', formats) == \
+        localize_ts(tz, '1/15/2021 13:45', '%m/%d/%Y %H:%M')
+
+
+@pytest.mark.parametrize('bad', ['2021-02-30 01:00:00', '2021-01-15 13:61:00',
+                                 '2021-01-15', 'not a date'])
+def test_bad_strings_raise(bad):
+    conv = TimestampConverter(pytz.timezone('US/Alaska'))
+    with pytest.raises(ValueError):
+        conv.to_ts(bad, FMT)
+
+
+def test_to_ts_many_and_datetimes():
+    tz = pytz.timezone('US/Alaska')
+    conv = TimestampConverter(tz)
+    strs = ['2020-11-01 01:30:00', '2020-11-01 00:15:00', '2020-11-01 01:30:00']
+    assert conv.to_ts_many(strs, FMT) == [conv.to_ts(s, FMT) for s in strs]
+    dts = [datetime(2020, 11, 1, 1, 30), datetime(2020, 7, 4, 12, 0, 5, 500000)]
+    assert conv.to_ts_many(dts, FMT) == \
+        [calendar.timegm(tz.localize(dt.replace(microsecond=0)).utctimetuple())
+         for dt in dts]
+    with pytest.raises(ValueError):
+        conv.to_ts_many(strs + ['bad'], FMT)
@@ -5,91 +5,173 @@ Error and info log information is put into the 'xmlcsv-log'
 subdirectory.
 
 The script expects one command line argument: the folder that
-holds the XML files to convert.
+holds the XML files to convert.  An optional second argument gives the
+number of files converted at the same time, each in its own process; it
+defaults to the number of CPUs.
 
 Example Usage:
 
     python3 avec_xml_to_csv.py /home/user1/avec-files
+    python3 avec_xml_to_csv.py /home/user1/avec-files 4
+
+The XML files are read incrementally, so large files can be converted without
+holding the whole document in memory.
 
 """
 import sys
+import os
 from pathlib import Path
 import shutil
 import csv
+from itertools import islice
 from datetime import datetime, timedelta, timezone
 import xml.etree.ElementTree as ET
 import logging
 import logging.handlers
-from collections import OrderedDict
-
-def parse_xml_file(fn):
-    """Parses one XML file with the full path of 'fn' and returns a list of
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Maximum number of readings held while a file is parsed.  The readings of a file are
+# held until its end, so the Delivered and Received records of a two-way meter are
+# combined wherever they are in the file.  If a file has more readings, the oldest
+# are written early.
+MAX_PENDING = 1000000
+
+def meter_readings(meter_readings_elem, readings=None):
+    """Adds the readings from one 'MeterReadings' element to the dictionary 'readings',
+    and returns it.  The keys are (meter serial #, UNIX timestamp), and the value is
+    the average kW during the interval.  A new dictionary is used if 'readings' is None.
+    """
+    if readings is None:
+        readings = {}
+    meter = meter_readings_elem.find('./Meter')
+    meter_sn = meter.attrib['SerialNumber'].strip()
+    tz_offset_mins = float(meter.attrib['TimeZoneOffset'])   # minutes
+    for interval_data in meter_readings_elem.findall('./IntervalData'):
+
+        interval_spec = interval_data.find('./IntervalSpec')
+        interval = float(interval_spec.attrib['Interval'])
+        
+        # determine the multiplier to convert kWh in the interval to average
+        # kW.
+        interval_mult = 60.0 / interval
+        
+        # Determine a multiplier to account for the direction flow
+        direction = interval_spec.attrib['Direction']
+        dir_mult = -1.0 if direction == 'Received' else 1.0 
+        for rdg in interval_data.findall('./Reading'):
+            try:
+                ts_str = rdg.attrib['TimeStamp']
+                ts_dt = datetime.strptime(ts_str, '%Y-%m-%d %H:%M:%S')
+                ts_dt += timedelta(minutes=tz_offset_mins)  # convert to UTC
+                ts_dt = ts_dt.replace(tzinfo=timezone.utc)
+                # make timestamp in middle of interval
+                ts = ts_dt.timestamp() + interval / 2.0 * 60.0
+
+                # retrieve an existing record for this meter/timestamp
+                kw = readings.get((meter_sn, ts), 0.0)
+                kw += interval_mult * dir_mult * float(rdg.attrib['RawReading'])
+                readings[(meter_sn, ts)] = kw
+
+            except:
+                logging.exception('Error processing a reading.')
+
+    return readings
+
+def iter_xml_readings(fn, max_pending=MAX_PENDING):
+    """Parses one XML file with the full path of 'fn' incrementally and yields
     readings, each reading being a tuple of the form: 
         (meter serial number, UNIX timestamp, avereage kW in interval)
     Timestamps are placed at the middle of the time interval.
+    Two-way meters may have two separate usage records (Delivered, and Received),
+    which are combined.  The readings are held, in the order they are first seen,
+    until the end of the file, so the records do not need to be adjacent.  Each 
+    'MeterReadings' element is cleared after it is processed, so only the readings
+    are held in memory, not the XML document.  If more than 'max_pending' readings 
+    are held, the oldest are yielded early and a warning is logged, as records for
+    them later in the file would not be combined.
     """
-    # create element tree object
-    tree = ET.parse(fn)
-
-    # get root element
-    root = tree.getroot()
-
-    # Create an ordered dictionary to hold readings.  The keys are 
-    # (meter serial #, UNIX timestamp), and the value is the average kW during 
-    # the interval.  This dictionary is used instead of a list because two-way
-    # meters may have two separate usage records (Delivered, and Received), which
-    # need to be combined.
-    readings = OrderedDict()
-
-    for meter_readings in root.findall('./MeterReadings'):
+    context = ET.iterparse(str(fn), events=('start', 'end'))
+    _, root = next(context)     # the root element, from the first 'start' event
+
+    pending = {}           # (meter serial #, timestamp) -> kW, not yet yielded
+    warned = False
+    for event, elem in context:
+        if event != 'end' or elem.tag != 'MeterReadings':
+            continue
         try:
-            meter = meter_readings.find('./Meter')
-            meter_sn = meter.attrib['SerialNumber'].strip()
-            tz_offset_mins = float(meter.attrib['TimeZoneOffset'])   # minutes
-            for interval_data in meter_readings.findall('./IntervalData'):
-
-                interval_spec = interval_data.find('./IntervalSpec')
-                interval = float(interval_spec.attrib['Interval'])
-                
-                # determine the multiplier to convert kWh in the interval to average
-                # kW.
-                interval_mult = 60.0 / interval
-                
-                # Determine a multiplier to account for the direction flow
-                direction = interval_spec.attrib['Direction']
-                dir_mult = -1.0 if direction == 'Received' else 1.0 
-                for rdg in interval_data.findall('./Reading'):
-                    try:
-                        ts_str = rdg.attrib['TimeStamp']
-                        ts_dt = datetime.strptime(ts_str, '%Y-%m-%d %H:%M:%S')
-                        ts_dt += timedelta(minutes=tz_offset_mins)  # convert to UTC
-                        ts_dt = ts_dt.replace(tzinfo=timezone.utc)
-                        ts = ts_dt.timestamp() + interval / 2.0 * 60.0   # make timestamp in middle of interval
-
-                        # retrieve an existing record for this meter/timestamp
-                        kw = readings.get((meter_sn, ts), 0.0)
-                        kw += interval_mult * dir_mult * float(rdg.attrib['RawReading'])
-                        readings[(meter_sn, ts)] = kw
-
-                    except:
-                        logging.exception('Error processing a reading.')
-
+            meter_readings(elem, pending)
         except:
             logging.exception('Error processing a meter.')
-    
-    # convert reading dictionary into a list
-    rdg_list = []
-    for ky, kw in readings.items():
-        meter_sn, ts = ky
-        rdg_list.append( (meter_sn, ts, kw))
-        
-    return rdg_list
+        # free the memory used by the processed element
+        elem.clear()
+        root.clear()
+
+        if len(pending) > max_pending:
+            if not warned:
+                logging.warning(f'More than {max_pending} readings in {fn}; writing the '
+                                'oldest before the end of the file.')
+                warned = True
+            # yield the oldest half, so this is not repeated for every element.
+            oldest = list(islice(pending, len(pending) - max_pending // 2))
+            for ky in oldest:
+                yield ky[0], ky[1], pending.pop(ky)
+
+    for (sn, ts), kw in pending.items():
+        yield sn, ts, kw
+
+def parse_xml_file(fn):
+    """Parses one XML file with the full path of 'fn' and returns a list of
+    readings, each reading being a tuple of the form: 
+        (meter serial number, UNIX timestamp, avereage kW in interval)
+    """
+    return list(iter_xml_readings(fn))
+
+def convert_file(xml_file, xml_completed_path):
+    """Converts the XML file 'xml_file' into a CSV file in the same directory, and
+    moves the XML file into the 'xml_completed_path' directory.  The CSV file is
+    written under a temporary name and renamed when complete, so the loader never
+    sees a partial file.
+    """
+    try:
+        csv_file_name = xml_file.with_suffix('.csv')
+        tmp_file_name = xml_file.with_suffix('.csv.tmp')
+        rdg_count = 0
+        with open(tmp_file_name, 'w', newline='') as csvfile:
+            csvwriter = csv.writer(csvfile, quoting=csv.QUOTE_MINIMAL)
+            for rdg in iter_xml_readings(xml_file):
+                csvwriter.writerow(rdg)
+                rdg_count += 1
+
+        if rdg_count:
+            os.replace(tmp_file_name, csv_file_name)
+            logging.info(f'{rdg_count} readings from {xml_file} converted.')
+        else:
+            tmp_file_name.unlink()
+            logging.info(f'No readings present in {xml_file}.')
+
+        # copy completed XML file to completed directory and then delete
+        shutil.copyfile(xml_file, xml_completed_path / xml_file.name)
+        xml_file.unlink()
+
+    except:
+        logging.exception(f'Error processing {xml_file}')
+
+def init_worker_logging(log_queue):
+    """Sends the log messages of a worker process to 'log_queue', so that only the
+    main process writes to the log file.
+    """
+    logging.root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logging.root.setLevel(logging.INFO)
 
 if __name__ == '__main__':
 
     # get the base directory to process
     base_path = Path(sys.argv[1])
 
+    # the number of files to convert at the same time
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
     # create the directory for the completed XML files
     xml_completed_path = (base_path / 'xml-completed')
     xml_completed_path.mkdir(exist_ok=True)
@@ -117,24 +199,20 @@ if __name__ == '__main__':
     logging.root.setLevel(logging.INFO)
 
     # Process all of the XML files in the base directory.
-    for xml_file in base_path.glob('*.xml'):
+    xml_files = list(base_path.glob('*.xml'))
+    if max_workers > 1 and len(xml_files) > 1:
+        # convert the files in a pool of processes.  Log messages from the worker
+        # processes are passed back to this process to be written.
+        log_queue = multiprocessing.Queue()
+        listener = logging.handlers.QueueListener(log_queue, fh, console_h)
+        listener.start()
         try:
-            readings = parse_xml_file(xml_file)
-            if len(readings):
-                csv_file_name = xml_file.with_suffix('.csv')
-                with open(csv_file_name, 'w', newline='') as csvfile:
-                    csvwriter = csv.writer(csvfile, quoting=csv.QUOTE_MINIMAL)
-                    for rdg in readings:
-                        csvwriter.writerow(rdg)
-
-                logging.info(f'{len(readings)} readings from {xml_file} converted.')
-
-            else:
-                logging.info(f'No readings present in {xml_file}.')
-
-            # copy completed XML file to completed directory and then delete
-            shutil.copyfile(xml_file, xml_completed_path / xml_file.name)
-            xml_file.unlink()
-
-        except:
-            logging.exception(f'Error processing {xml_file}')
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker_logging, 
+                                     initargs=(log_queue,)) as executor:
+                list(executor.map(convert_file, xml_files, 
+                                  [xml_completed_path] * len(xml_files)))
+        finally:
+            listener.stop()
+    else:
+        for xml_file in xml_files:
+            convert_file(xml_file, xml_completed_path)
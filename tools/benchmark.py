@@ -0,0 +1,308 @@
+"""Script to measure the end-to-end throughput of file-to-bmon.  It generates
+synthetic meter files in the format of each Reader, runs the loader/process_files.py
+script on them, and posts the readings to a stand-in BMON server running inside this
+script.  The stand-in server can add latency to each post and fail a fraction of the
+posts, to mimic a slow or unreliable BMON server.
+
+While process_files.py runs, the size of its posting queue and its memory use are
+sampled.  At the end, these results are reported:
+
+    * readings/sec: readings received by the server divided by the total time
+    * load time: time until all of the input files were processed
+    * drain time: time from the end of the load until all readings were received
+    * peak RSS: the peak memory use of the process_files.py process
+    * peak queue depth, and the queue depth over time
+
+Example Usage:
+
+    python3 benchmark.py --readers cea mea --files 4 --lines 50000 --latency 50
+
+Use 'python3 benchmark.py --help' to see all of the options.  Settings for the BMON
+server and file source entries of the configuration file can be added with the
+--server-option and --source-option arguments, e.g. '--server-option engine=async'.
+Files are created in a temporary directory unless --work-dir is given.
+"""
+import argparse
+import gzip
+import http.server
+import json
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import yaml
+
+READERS = ('cea', 'gvea', 'mea', 'avec', 'ses_cea', 'csv')
+
+# All synthetic files start at this date, with readings every 15 minutes.
+START_TIME = datetime(2021, 1, 1)
+
+
+def generate_lines(reader, n_lines, n_sensors, file_num):
+    """Returns a list of lines, with newlines, for a synthetic file in the format
+    of the Reader 'reader'.  The file holds 'n_lines' readings spread across 'n_sensors'
+    sensors.  'file_num' offsets the timestamps so each file holds different readings.
+    """
+    lines = []
+    if reader in ('gvea', 'mea', 'ses_cea', 'csv'):
+        lines.append({
+            'gvea': 'Meter,Account,Read Date,kWh\n',
+            'mea': 'sensor_id,ts,val\n',
+            'ses_cea': 'Meter,Date,Time,Unit,kW\n',
+            'csv': 'ts,sensor_id,value\n',
+        }[reader])
+
+    intervals = -(-n_lines // n_sensors)      # ceiling division
+    first_interval = file_num * intervals
+    for i in range(n_lines):
+        sensor = i % n_sensors
+        dt = START_TIME + timedelta(minutes=15 * (first_interval + i // n_sensors))
+        ts = int((dt - datetime(1970, 1, 1)).total_seconds())
+        val = random.random() * 10.0
+        if reader == 'cea':
+            lines.append(f'{10000 + sensor},{dt:%Y-%m-%d %H:%M:%S},{val:.3f},kWh,1\n')
+        elif reader == 'gvea':
+            lines.append(f'{20000 + sensor}.0,{500 + sensor},{dt:%Y-%m-%d %H:%M:%S}.000,'
+                         f'{val:.3f}\n')
+        elif reader == 'mea':
+            lines.append(f'mea_{sensor},{ts},{val:.3f}\n')
+        elif reader == 'avec':
+            lines.append(f'{30000 + sensor},{ts},{val:.3f}\n')
+        elif reader == 'ses_cea':
+            # dates are MMDDYY, times are HMM with no leading zeros, and kW values
+            # are quoted with thousands separators.
+            tm = dt.hour * 100 + dt.minute
+            lines.append(f'"S{sensor}",{dt.month}{dt:%d%y},{tm},KW,"{val * 1000:,.2f}"\n')
+        elif reader == 'csv':
+            lines.append(f'{ts},csv_{sensor},{val:.3f}\n')
+    return lines
+
+
+def generate_files(data_dir, readers, n_files, n_lines, n_sensors):
+    """Creates 'n_files' synthetic files for each Reader in 'readers' in a subdirectory
+    of 'data_dir' named after the Reader.  Returns the total number of readings.
+    """
+    total = 0
+    for reader in readers:
+        reader_dir = data_dir / reader
+        reader_dir.mkdir(parents=True, exist_ok=True)
+        for file_num in range(n_files):
+            with open(reader_dir / f'{reader}_{file_num}.csv', 'w') as f:
+                f.writelines(generate_lines(reader, n_lines, n_sensors, file_num))
+            total += n_lines
+    return total
+
+
+class StandInServer:
+    """An HTTP server that accepts posts like the BMON 'store' endpoint and counts the
+    readings received.  Each post is delayed by 'latency' seconds, and 'error_rate' is
+    the fraction of posts that fail with a 500 status code.
+    """
+
+    def __init__(self, port=0, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.posts = 0
+        self.errors = 0
+        self.readings = 0
+        self.last_post_time = None
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if server.latency:
+                    time.sleep(server.latency)
+                if random.random() < server.error_rate:
+                    with server.lock:
+                        server.errors += 1
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                n = len(json.loads(body)['readings'])
+                with server.lock:
+                    server.posts += 1
+                    server.readings += n
+                    server.last_post_time = time.time()
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(b'{"status": "success"}')
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+
+
+def queue_depth(queue_file):
+    """Returns the number of items waiting or in process in the posting queue file
+    'queue_file', or None if it can't be read.
+    """
+    try:
+        conn = sqlite3.connect(f'file:{queue_file}?mode=ro', uri=True, timeout=1)
+        try:
+            return sum(conn.execute(f'SELECT COUNT(*) FROM {t}').fetchone()[0]
+                       for t in ('queue', 'processing'))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+def process_rss(pid):
+    """Returns the resident memory of process 'pid' in MB, or None if not available.
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for lin in f:
+                if lin.startswith('VmRSS:'):
+                    return int(lin.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def parse_options(option_list):
+    """Converts a list of 'key=value' strings into a dictionary, with the values
+    parsed as YAML so numbers and booleans have the right type.
+    """
+    options = {}
+    for opt in option_list or []:
+        key, _, val = opt.partition('=')
+        options[key] = yaml.safe_load(val)
+    return options
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the throughput of file-to-bmon.')
+    parser.add_argument('--readers', nargs='+', default=list(READERS), choices=READERS,
+                        help='Readers to generate files for. Default is all Readers.')
+    parser.add_argument('--files', type=int, default=2, help='Files per Reader.')
+    parser.add_argument('--lines', type=int, default=20000, help='Readings per file.')
+    parser.add_argument('--sensors', type=int, default=200, help='Sensors per file.')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Milliseconds of delay added to each post.')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of posts that fail with a 500 status.')
+    parser.add_argument('--server-option', action='append', metavar='KEY=VALUE',
+                        help='Setting added to the bmon_servers entry.')
+    parser.add_argument('--source-option', action='append', metavar='KEY=VALUE',
+                        help='Setting added to each file_sources entry.')
+    parser.add_argument('--config-option', action='append', metavar='KEY=VALUE',
+                        help='Setting added to the top level of the configuration file.')
+    parser.add_argument('--timeout', type=float, default=600,
+                        help='Maximum seconds to wait for all readings to be received.')
+    parser.add_argument('--sample-interval', type=float, default=0.5,
+                        help='Seconds between samples of queue depth and memory use.')
+    parser.add_argument('--work-dir', 
+                        help='Directory for the files. Default is a temporary directory.')
+    args = parser.parse_args()
+
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix='f2b_bench_')).resolve()
+    work_dir.mkdir(parents=True, exist_ok=True)
+    data_dir = work_dir / 'data'
+
+    print(f'Generating files in {work_dir}')
+    expected = generate_files(data_dir, args.readers, args.files, args.lines, args.sensors)
+
+    server = StandInServer(latency=args.latency / 1000.0, error_rate=args.error_rate)
+
+    server_entry = {
+        'url': f'http://127.0.0.1:{server.port}/readingdb/reading/store/',
+        'store_key': 'bench',
+    }
+    server_entry.update(parse_options(args.server_option))
+    config = {
+        'logging_level': 'WARNING',
+        'dry_run': False,
+        'file_sources': [],
+        'bmon_servers': {'bench': server_entry},
+    }
+    config.update(parse_options(args.config_option))
+    for reader in args.readers:
+        src = {'pattern': str(data_dir / reader / '*.csv'), 'reader': reader,
+               'default_bmon': 'bench'}
+        src.update(parse_options(args.source_option))
+        config['file_sources'].append(src)
+    config_file = work_dir / 'config.yaml'
+    with open(config_file, 'w') as f:
+        yaml.safe_dump(config, f)
+    queue_file = work_dir / 'posters' / 'bench_postQ.sqlite'
+
+    loader_dir = Path(__file__).resolve().parent.parent / 'loader'
+    print(f'Loading {expected} readings from {len(args.readers) * args.files} files')
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, 'process_files.py', str(config_file)],
+                            cwd=loader_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # Sample until all readings are received, or the time limit passes.
+    samples = []          # (seconds since start, queue depth, RSS in MB)
+    load_done = None      # seconds until all input files were processed
+    peak_rss = 0.0
+    while True:
+        elapsed = time.time() - start
+        rss = process_rss(proc.pid) if proc.poll() is None else None
+        if rss:
+            peak_rss = max(peak_rss, rss)
+        samples.append((elapsed, queue_depth(queue_file), rss))
+        if load_done is None and not any(data_dir.glob('*/*.csv')):
+            load_done = elapsed
+        if server.readings >= expected or elapsed > args.timeout:
+            break
+        if proc.poll() is not None and load_done is not None:
+            # process_files.py has exited, and readings left in the queue are not
+            # posted until the next run.
+            break
+        time.sleep(args.sample_interval)
+
+    finish = (server.last_post_time or time.time()) - start
+    try:
+        proc.wait(timeout=max(args.timeout - (time.time() - start), 1))
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+    # The peak memory of the finished child process, which catches peaks between samples.
+    # ru_maxrss is in KB on Linux.
+    peak_rss = max(peak_rss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)
+    server.shutdown()
+
+    print()
+    print(f'Readings received:  {server.readings} of {expected}')
+    print(f'Posts:              {server.posts} successful, {server.errors} failed')
+    print(f'Total time:         {finish:.2f} s')
+    print(f'Readings/sec:       {server.readings / finish:,.0f}')
+    if load_done is not None:
+        print(f'Load time:          {load_done:.2f} s')
+        print(f'Drain time:         {max(finish - load_done, 0.0):.2f} s')
+    print(f'Peak RSS:           {peak_rss:.1f} MB')
+    depths = [d for _, d, _ in samples if d is not None]
+    if depths:
+        print(f'Peak queue depth:   {max(depths)} items')
+        print()
+        print('Queue depth over time:')
+        step = max(len(samples) // 20, 1)
+        for elapsed, depth, rss in samples[::step]:
+            print(f'  {elapsed:7.1f} s  {depth if depth is not None else "-":>8}')
+    print()
+    print(f'process_files.py log: {work_dir / "log" / "process_files.log"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Script to list, replay or delete the readings that a BMON server rejected, which
+are held in the 'dead_letter' table of a posting queue file.  See the discussion of
+the 'reject_limit' setting in docs/script_docs.md.
+
+The first argument is the command: 'list', 'replay' or 'delete'.  The second is the
+path to the posting queue file of a BMON server, found in the 'posters' directory
+beneath the configuration file.  'replay' and 'delete' take optional IDs of the
+rejected readings, as shown by 'list'; if none are given, all of the rejected
+readings are replayed or deleted.  Replayed readings are moved back into the queue
+and are posted the next time process_files.py runs.  Run this script when
+process_files.py is not running, as opening the queue file returns the readings
+being posted to the queue.
+
+Example Usage:
+
+    python3 dead_letter.py list ../loader/posters/bmon1_postQ.sqlite
+    python3 dead_letter.py replay ../loader/posters/bmon1_postQ.sqlite 12 13
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# get the loader directory in path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'loader'))
+
+from poster.sqlite_queue import SqliteReliableQueue
+
+
+def list_dead_letters(queue):
+    """Prints the rejected readings in 'queue', one line per set of readings.
+    """
+    rows = queue.dead_letters()
+    for id, item, added, reason in rows:
+        added_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(added))
+        if isinstance(item, dict) and 'readings' in item:
+            readings = item['readings']
+        else:
+            readings = item
+        print(f'{id}\t{added_str}\t{reason}\t{readings}')
+    print(f'{len(rows)} sets of rejected readings.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='List, replay or delete rejected readings.')
+    parser.add_argument('command', choices=('list', 'replay', 'delete'))
+    parser.add_argument('queue_file', help='Path to the posting queue file of a BMON server.')
+    parser.add_argument('ids', nargs='*', type=int, 
+                        help='IDs of the rejected readings to replay or delete. Default is all.')
+    args = parser.parse_args()
+
+    if not Path(args.queue_file).exists():
+        sys.exit(f'{args.queue_file} does not exist.')
+    queue = SqliteReliableQueue(args.queue_file)
+
+    if args.command == 'list':
+        list_dead_letters(queue)
+    else:
+        count = queue.remove_dead_letters(args.ids or None, replay=args.command == 'replay')
+        action = 'Replayed' if args.command == 'replay' else 'Deleted'
+        print(f'{action} {count} sets of rejected readings.')
+
+
+if __name__ == '__main__':
+    main()
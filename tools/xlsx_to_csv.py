@@ -3,30 +3,56 @@ into CSV files.  After successful conversion, the XLSX file
 is deleted.
 
 The script expects one command line argument: the folder that
-holds the XLSX files to convert.
+holds the XLSX files to convert.  An optional second argument gives
+the number of files converted at the same time, each in its own
+process; it defaults to the number of CPUs.
 
 Example Usage:
 
     python3 xlsx_to_csv.py /home/user1/excelfiles
+    python3 xlsx_to_csv.py /home/user1/excelfiles 4
 
 This script is used with Golden Valley Electric 15 minute electric
-meter readings files.
+meter readings files.  The gvea Reader can also read the XLSX files
+directly, without this conversion; see docs/script_docs.md.
 """
 import sys
+import os
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from xlsx2csv import Xlsx2csv
 
-# get the first command line argument which is the path the folder
-# holding the xlsx files.
-xlsx_folder = sys.argv[1]
-
-# Loop through all XLSX files in that folder, convert and delete
-# the orginal if the conversion was successful.
-for p_xlsx in Path(xlsx_folder).glob('*.xlsx'):
+def convert_file(p_xlsx):
+    """Converts the XLSX file 'p_xlsx' to a CSV file with the same name and
+    deletes the XLSX file if the conversion was successful.  The CSV file is
+    written under a temporary name and renamed when complete, so a partial
+    file is never loaded.
+    """
     p_csv = p_xlsx.with_suffix('.csv')
+    p_tmp = p_xlsx.with_suffix('.csv.tmp')
     try:
-        Xlsx2csv(str(p_xlsx), outputencoding="utf-8").convert(str(p_csv))
-        if p_csv.exists():
+        Xlsx2csv(str(p_xlsx), outputencoding="utf-8").convert(str(p_tmp))
+        if p_tmp.exists():
+            os.replace(p_tmp, p_csv)
             p_xlsx.unlink()
     except:
         print(f'Error processing {p_xlsx}.')
+
+if __name__ == '__main__':
+
+    # get the first command line argument which is the path the folder
+    # holding the xlsx files.
+    xlsx_folder = sys.argv[1]
+
+    # the number of files to convert at the same time
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    # Convert all XLSX files in that folder, deleting the orginal if the
+    # conversion was successful.
+    xlsx_files = list(Path(xlsx_folder).glob('*.xlsx'))
+    if max_workers > 1 and len(xlsx_files) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(convert_file, xlsx_files))
+    else:
+        for p_xlsx in xlsx_files:
+            convert_file(p_xlsx)